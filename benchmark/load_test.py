@@ -0,0 +1,142 @@
+"""
+Load test of the read endpoints, against a running server filled by benchmark.seed_data.
+
+Seeded users log in first, then each worker sends requests as one of them for --duration seconds, picking an
+endpoint by weight: HTTP LB list, HTTP LB details, compare-version and event logs.
+Reported per endpoint: requests, errors, throughput, and p50/p95/p99 latency.
+
+The seed settings (--lbs, --revisions, --users, --password) must match the ones used by benchmark.seed_data.
+Usage: python -m benchmark.load_test --url http://127.0.0.1:8000 --concurrency 50 --duration 60
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+
+from benchmark.seed_data import app_name, app_environment, username
+
+
+def scenario(args) -> list[tuple[str, int, callable]]:
+    """
+    :return: (endpoint name, weight, function returning the request path and parameters)
+    """
+
+    def lb_index(generator: random.Random) -> int:
+        return generator.randrange(args.lbs)
+
+    def details(generator: random.Random):
+        index = lb_index(generator)
+        return f'/xc/http-lb/{app_name(index)}/{app_environment(index)}', {}
+
+    def compare(generator: random.Random):
+        index = lb_index(generator)
+        new_version = generator.randint(2, max(2, args.revisions))
+        return '/xc/http-lb/compare-version', {
+            'new_app_name': app_name(index), 'new_environment': app_environment(index), 'new_version': new_version,
+            'old_app_name': app_name(index), 'old_environment': app_environment(index),
+            'old_version': new_version - 1}
+
+    return [
+        ('http_lb_list', args.weight_list, lambda generator: ('/xc/http-lb/', {})),
+        ('http_lb_details', args.weight_details, details),
+        ('compare_version', args.weight_compare, compare),
+        ('event_logs', args.weight_logs, lambda generator: ('/xc/logs/', {})),
+    ]
+
+
+async def login(client: httpx.AsyncClient, name: str, password: str) -> str:
+    response = await client.post('/mgmt/login', data={'username': name, 'password': password})
+    response.raise_for_status()
+    return response.json()['access_token']
+
+
+async def worker(client: httpx.AsyncClient, token: str, endpoints: list, deadline: float, seed: int,
+                 results: dict):
+    generator = random.Random(seed)
+    names = [each[0] for each in endpoints]
+    weights = [each[1] for each in endpoints]
+    requests_by_name = {each[0]: each[2] for each in endpoints}
+    headers = {'Authorization': f'Bearer {token}'}
+    while time.perf_counter() < deadline:
+        name = generator.choices(names, weights)[0]
+        path, params = requests_by_name[name](generator)
+        start = time.perf_counter()
+        try:
+            response = await client.get(path, params=params, headers=headers)
+            # The body is read entirely, like a browser would
+            ok = response.status_code == 200 and response.content is not None
+        except httpx.HTTPError:
+            ok = False
+        results[name]['latencies'].append(time.perf_counter() - start)
+        if not ok:
+            results[name]['errors'] += 1
+
+
+def summary(name: str, latencies: list[float], errors: int, duration: float) -> dict:
+    result = {'endpoint': name, 'requests': len(latencies), 'errors': errors,
+              'throughput_rps': round(len(latencies) / duration, 2)}
+    if len(latencies) >= 2:
+        cut_points = statistics.quantiles(latencies, n=100, method='inclusive')
+        result.update({'p50_ms': round(cut_points[49] * 1000, 1), 'p95_ms': round(cut_points[94] * 1000, 1),
+                       'p99_ms': round(cut_points[98] * 1000, 1), 'max_ms': round(max(latencies) * 1000, 1)})
+    return result
+
+
+async def run(args) -> list[dict]:
+    endpoints = [each for each in scenario(args) if each[1] > 0]
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, timeout=args.timeout, limits=limits) as client:
+        tokens = await asyncio.gather(*[login(client, username(index), args.password)
+                                        for index in range(min(args.users, args.concurrency))])
+        results = defaultdict(lambda: {'latencies': [], 'errors': 0})
+        start = time.perf_counter()
+        await asyncio.gather(*[worker(client, tokens[index % len(tokens)], endpoints, start + args.duration, index,
+                                      results) for index in range(args.concurrency)])
+        duration = time.perf_counter() - start
+    report = [summary(name, result['latencies'], result['errors'], duration) for name, result in results.items()]
+    report.append(summary('total', [each for result in results.values() for each in result['latencies']],
+                          sum(result['errors'] for result in results.values()), duration))
+    return report
+
+
+def print_report(report: list[dict]):
+    print(f"{'endpoint':<18} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for each in report:
+        print(f"{each['endpoint']:<18} {each['requests']:>9} {each['errors']:>7} {each['throughput_rps']:>9} "
+              f"{each.get('p50_ms', '-'):>9} {each.get('p95_ms', '-'):>9} {each.get('p99_ms', '-'):>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8000')
+    parser.add_argument('--concurrency', type=int, default=20, help='Concurrent users')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds')
+    parser.add_argument('--timeout', type=float, default=60, help='Request timeout in seconds')
+    parser.add_argument('--lbs', type=int, default=10000)
+    parser.add_argument('--revisions', type=int, default=100)
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--password', default='load-test-password')
+    parser.add_argument('--weight-list', type=int, default=2)
+    parser.add_argument('--weight-details', type=int, default=5)
+    parser.add_argument('--weight-compare', type=int, default=2)
+    parser.add_argument('--weight-logs', type=int, default=1)
+    parser.add_argument('--output', help='Write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'timestamp': int(time.time()), 'settings': vars(args), 'report': report}, f, indent=2)
+    if any(each['errors'] for each in report):
+        print('Some requests failed.', file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
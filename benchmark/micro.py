@@ -0,0 +1,221 @@
+"""
+Micro benchmarks of the CPU-bound parts of the snapshot and the compare endpoints, on synthetic XC configurations
+generated by the mock XC. The database is an in-memory SQLite, so only the Python side is measured.
+
+Each case is calibrated to run about --min-time seconds per repeat, and the best and median time per call are kept.
+
+Usage:
+    python -m benchmark.micro --save                  # store the results as the baseline
+    python -m benchmark.micro --compare               # compare with the baseline
+    python -m benchmark.micro --compare --threshold 5 --case generate_uid
+Baselines are stored in benchmark/baselines/<name>.json (--baseline, defaults to micro). They depend on the machine,
+so compare results from the same machine only.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Micro benchmarks never touch a real database
+os.environ['SQL_URL'] = 'sqlite://'
+os.environ.setdefault('XC_NAMESPACE', 'benchmark')
+
+from pydantic import TypeAdapter
+from sqlmodel import SQLModel, Session
+
+import dependency
+import snapshot_pipeline
+from benchmark.mock_xc import MockXC
+from model.http_model import HttpLbRevisionSchema, HttpLbStagingRevisionSchema
+from routes import http_lb
+
+baseline_dir = Path(__file__).parent / 'baselines'
+# Case name: setup function returning the function to measure
+cases = {}
+
+
+def case(name: str):
+    def register(setup):
+        cases[name] = setup
+        return setup
+
+    return register
+
+
+def revisions(mock: MockXC, count: int) -> list[dict]:
+    """
+    :return: HTTP LB revisions as built by the snapshot, from the objects of the mock XC
+    """
+    pools = mock.store['origin_pools']
+    firewalls = mock.store['app_firewalls']
+    rows = []
+    for version, (name, lb) in enumerate(list(mock.store['http_loadbalancers'].items())[:count], start=1):
+        spec = lb['replace_form']['spec']
+        app_name = name.replace('-staging', '')
+        waf = firewalls[spec['app_firewall']['name']] if 'app_firewall' in spec else {}
+        rows.append({
+            'uid': dependency.generate_uid('rev', app_name, 'staging', 1700000000, version),
+            'app_name': app_name, 'original_app_name': name, 'generated_by': 'benchmark',
+            'version': version, 'previous_version': version - 1 or None, 'timestamp': 1700000000,
+            'lb_resource_version': int(lb['resource_version']),
+            'waf_resource_version': int(waf['resource_version']) if waf else 0, 'origin_resource_version': 0,
+            'lb_config': lb, 'waf_config': waf,
+            'origin_config': [pools[each['pool']['name']] for each in spec['default_route_pools']],
+            'bot_config': {}, 'ddos_config': {}, 'remarks': 'System-generated'})
+    return rows
+
+
+@case('filter_lb_names')
+def filter_lb_names():
+    mock = MockXC(lbs=15000, routes=0, wafs=0)
+    load_balancer_list = {'items': [{'name': name} for name in mock.store['http_loadbalancers']]}
+    return lambda: dependency.filter_lb_names(load_balancer_list, 'production')
+
+
+@case('partition_lb_names')
+def partition_lb_names():
+    mock = MockXC(lbs=15000, routes=0, wafs=0, staging_ratio=1)
+    names = list(mock.store['http_loadbalancers'])
+    with Session(dependency.engine) as session:
+        for row in revisions(mock, len(names) // 2):
+            session.add(HttpLbStagingRevisionSchema(**row))
+        session.commit()
+    return lambda: dependency.partition_lb_names(HttpLbStagingRevisionSchema.app_name, names)
+
+
+@case('is_origin_updated')
+def is_origin_updated():
+    mock = MockXC(lbs=3000, pools_per_lb=4, wafs=0)
+    origins = [row['origin_config'] for row in revisions(mock, 1000)]
+    # Unchanged pools, the comparison goes through every pool
+    return lambda: [dependency.is_origin_updated(each, each) for each in origins]
+
+
+@case('generate_uid')
+def generate_uid():
+    return lambda: [dependency.generate_uid('rev', f'app-{index}', 'production', 1700000000, index)
+                    for index in range(1000)]
+
+
+@case('list_app_and_version')
+def list_app_and_version():
+    rows = revisions(MockXC(lbs=3000), 1000)
+    return lambda: snapshot_pipeline.list_app_and_version(rows, 'http')
+
+
+@case('compare_http_lb_version')
+def compare_http_lb_version():
+    mock = MockXC(lbs=3, routes=20, pools_per_lb=4, waf_ratio=1, staging_ratio=1)
+    left = revisions(mock, 1)[0]
+    mock.mutate(1)
+    right = {**revisions(mock, 1)[0], 'version': 2, 'uid': 'benchmark-right'}
+    with Session(dependency.engine) as session:
+        session.add(HttpLbStagingRevisionSchema(**{**left, 'app_name': 'compare', 'uid': 'benchmark-left'}))
+        session.add(HttpLbStagingRevisionSchema(**{**right, 'app_name': 'compare'}))
+        session.commit()
+    return lambda: http_lb.compare_http_lb_version('compare', 'staging', 2, 'compare', 'staging', 1)
+
+
+@case('validate_http_lb_revisions')
+def validate_http_lb_revisions():
+    rows = revisions(MockXC(lbs=1500), 500)
+    adapter = TypeAdapter(list[HttpLbRevisionSchema])
+    return lambda: adapter.validate_python(rows)
+
+
+def measure(function, repeat: int, min_time: float) -> dict:
+    """
+    :return: Best and median time per call in microseconds, and calls per repeat
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / elapsed) + 1))
+    timings = [elapsed / number]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        timings.append((time.perf_counter() - start) / number)
+    return {'best_us': round(min(timings) * 1e6, 2), 'median_us': round(statistics.median(timings) * 1e6, 2),
+            'number': number, 'repeat': repeat}
+
+
+def run(names: list[str], repeat: int, min_time: float) -> dict:
+    SQLModel.metadata.create_all(dependency.engine)
+    results = {}
+    for name in names:
+        # The functions measured print their progress, keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            function = cases[name]()
+            results[name] = measure(function, repeat, min_time)
+        print(f"{name:<30} best {results[name]['best_us']:>12.2f} us   median {results[name]['median_us']:>12.2f} us",
+              file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """
+    Print the difference with the baseline, on the median time.
+    :return: Cases slower than the baseline by more than threshold percent
+    """
+    regressions = []
+    print(f"\n{'case':<30} {'baseline us':>12} {'current us':>12} {'change':>9}")
+    for name, result in results.items():
+        before = baseline['results'].get(name)
+        if not before:
+            print(f"{name:<30} {'-':>12} {result['median_us']:>12.2f} {'new':>9}")
+            continue
+        change = (result['median_us'] - before['median_us']) / before['median_us'] * 100
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            flag = '  faster'
+        print(f"{name:<30} {before['median_us']:>12.2f} {result['median_us']:>12.2f} {change:>+8.1f}%{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--case', action='append', choices=list(cases), help='Run only these cases')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds per repeat')
+    parser.add_argument('--baseline', default='micro', help='Name of the baseline file')
+    parser.add_argument('--save', action='store_true', help='Store the results as the baseline')
+    parser.add_argument('--compare', action='store_true', help='Compare the results with the baseline')
+    parser.add_argument('--threshold', type=float, default=10, help='Regression threshold in percent')
+    args = parser.parse_args()
+
+    results = run(args.case or list(cases), args.repeat, args.min_time)
+    baseline_file = baseline_dir / f'{args.baseline}.json'
+    regressions = []
+    if args.compare:
+        if not baseline_file.exists():
+            parser.error(f'No baseline at {baseline_file}, run with --save first.')
+        regressions = compare(results, json.loads(baseline_file.read_text()), args.threshold)
+    if args.save:
+        baseline_dir.mkdir(exist_ok=True)
+        stored = json.loads(baseline_file.read_text())['results'] if baseline_file.exists() else {}
+        baseline_file.write_text(json.dumps({
+            'timestamp': int(time.time()), 'python': platform.python_version(), 'machine': platform.node(),
+            'results': {**stored, **results}}, indent=2))
+        print(f"Baseline stored in {baseline_file}", file=sys.stderr)
+    if regressions:
+        sys.exit(f"Regressions over {args.threshold}%: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Local stand-in for the XC config API, for benchmarks.
+
+Serves the endpoints used by the tool: list, GET (GET_RSP_FORMAT_FOR_REPLACE) and PUT of HTTP, TCP and CDN LB,
+Origin Pools and App Firewalls, with a configurable latency, number of objects and sharing of Origin Pools and
+App Firewalls between LB.
+
+Standalone: python -m benchmark.mock_xc --lbs 1000 --latency-ms 20 --port 8900
+Then set XC_URL=http://127.0.0.1:8900 and XC_NAMESPACE=benchmark.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+lb_collections = ('http_loadbalancers', 'tcp_loadbalancers', 'cdn_loadbalancers')
+collections = lb_collections + ('origin_pools', 'app_firewalls')
+
+
+class MockXC:
+    """
+    Objects of one namespace, and the number of requests received.
+    """
+
+    def __init__(self, lbs: int = 100, pools: int | None = None, pools_per_lb: int = 1, wafs: int = 10,
+                 waf_ratio: float = 0.5, staging_ratio: float = 0.5, routes: int = 5, latency_ms: float = 0,
+                 jitter_ms: float = 0, throttle_ratio: float = 0, namespace: str = 'benchmark', seed: int = 1):
+        """
+        :param lbs: Number of LB, split between HTTP, TCP and CDN
+        :param pools: Number of Origin Pools. Defaults to one per LB, fewer means pools are shared.
+        :param pools_per_lb: Origin Pools referenced by each LB
+        :param wafs: Number of App Firewalls, shared by the HTTP and CDN LB using one
+        :param waf_ratio: Share of HTTP and CDN LB with an App Firewall
+        :param staging_ratio: Share of LB on staging
+        :param routes: Routes of each HTTP LB, to make the configuration size realistic
+        :param latency_ms: Latency of every request
+        :param jitter_ms: Random latency added to every request
+        :param throttle_ratio: Share of requests answered with 429
+        :param namespace: Namespace served
+        :param seed: Seed of the random generator
+        """
+        self.namespace = namespace
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.throttle_ratio = throttle_ratio
+        self.random = random.Random(seed)
+        self.store = {collection: {} for collection in collections}
+        self.calls = Counter()
+        self._resource_version = 1000
+        self._lock = threading.Lock()
+        pools = pools or max(1, lbs)
+        for index in range(pools):
+            self.add('origin_pools', f'pool-{index}', {
+                'origin_servers': [{'public_name': {'dns_name': f'origin-{index}-{each}.example.com'}}
+                                   for each in range(2)],
+                'port': 443, 'use_tls': {'tls_config': {'default_security': {}}},
+                'healthcheck': [{'name': 'default-healthcheck'}], 'loadbalancer_algorithm': 'LB_OVERRIDE'})
+        for index in range(wafs):
+            self.add('app_firewalls', f'waf-{index}', {
+                'blocking': {}, 'detection_settings': {'signature_selection_setting': {'default_attack_type_settings': {}}},
+                'allow_all_response_codes': {}, 'default_anonymization': {}})
+        for index in range(lbs):
+            collection = lb_collections[index % len(lb_collections)]
+            name = f'{collection.split("_")[0]}-{index}'
+            if self.random.random() < staging_ratio:
+                name = f'{name}-staging'
+            lb_pools = [{'pool': {'name': f'pool-{(index * pools_per_lb + each) % pools}', 'namespace': namespace},
+                         'weight': 1, 'priority': 1} for each in range(pools_per_lb)]
+            if collection == 'tcp_loadbalancers':
+                spec = {'domains': [f'{name}.example.com'], 'listen_port': 443, 'origin_pools_weights': lb_pools}
+            else:
+                spec = {'domains': [f'{name}.example.com'], 'default_route_pools': lb_pools,
+                        'routes': [{'simple_route': {'path': {'prefix': f'/route-{each}'},
+                                                     'origin_pools': lb_pools}} for each in range(routes)]}
+                if wafs and self.random.random() < waf_ratio:
+                    spec['app_firewall'] = {'name': f'waf-{index % wafs}', 'namespace': namespace}
+            self.add(collection, name, spec)
+
+    def add(self, collection: str, name: str, spec: dict):
+        """
+        Create or replace an object, with a new resource version.
+        """
+        with self._lock:
+            self._resource_version += 1
+            self.store[collection][name] = {
+                'replace_form': {'metadata': {'name': name, 'namespace': self.namespace, 'labels': {},
+                                              'annotations': {}, 'disable': False},
+                                 'spec': spec},
+                'resource_version': str(self._resource_version)}
+
+    def mutate(self, ratio: float, collection_names: tuple = collections) -> int:
+        """
+        Change a share of the objects, as if they were edited in XC.
+        :param ratio: Share of the objects to change
+        :param collection_names: Collections to change
+        :return: Number of objects changed
+        """
+        changed = 0
+        for collection in collection_names:
+            for name, stored in list(self.store[collection].items()):
+                if self.random.random() < ratio:
+                    self.add(collection, name, {**stored['replace_form']['spec'], 'description': f'edit {time.time()}'})
+                    changed += 1
+        return changed
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def count(self, method: str, collection: str):
+        with self._lock:
+            self.calls[f'{method} {collection}'] += 1
+
+
+def make_handler(mock: MockXC):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            return
+
+        def reply(self, status: int, body: dict, headers: dict | None = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self) -> tuple[str | None, str | None]:
+            # /api/config/namespaces/<namespace>/<collection>[/<name>]
+            parts = urlsplit(self.path).path.strip('/').split('/')
+            if len(parts) < 5 or parts[:3] != ['api', 'config', 'namespaces'] or parts[3] != mock.namespace \
+                    or parts[4] not in collections:
+                return None, None
+            return parts[4], parts[5] if len(parts) > 5 else None
+
+        def wait(self) -> bool:
+            time.sleep(mock.latency + mock.random.random() * mock.jitter)
+            if mock.throttle_ratio and mock.random.random() < mock.throttle_ratio:
+                self.reply(429, {'code': 8, 'message': 'Too many requests'}, {'Retry-After': '1'})
+                return False
+            return True
+
+        def do_GET(self):
+            collection, name = self.route()
+            mock.count('GET', collection or 'unknown')
+            if not self.wait():
+                return
+            if not collection:
+                return self.reply(404, {'code': 5, 'message': 'Not found'})
+            if name is None:
+                return self.reply(200, {'items': [{'name': each, 'namespace': mock.namespace, 'labels': {},
+                                                   'disabled': False}
+                                                  for each in mock.store[collection]], 'errors': []})
+            stored = mock.store[collection].get(name)
+            if not stored:
+                return self.reply(404, {'code': 5, 'message': f'{name} not found'})
+            self.reply(200, stored)
+
+        def do_PUT(self):
+            collection, name = self.route()
+            mock.count('PUT', collection or 'unknown')
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            if not self.wait():
+                return
+            if not collection or name not in mock.store[collection]:
+                return self.reply(404, {'code': 5, 'message': f'{name} not found'})
+            mock.add(collection, name, body.get('spec', {}))
+            self.reply(200, {})
+
+    return Handler
+
+
+def serve(mock: MockXC, host: str = '127.0.0.1', port: int = 0) -> ThreadingHTTPServer:
+    """
+    Serve the mock XC in a background thread.
+    :return: The server. Its address is server.server_address.
+    """
+    server = ThreadingHTTPServer((host, port), make_handler(mock))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-xc', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--lbs', type=int, default=100)
+    parser.add_argument('--pools', type=int, default=None)
+    parser.add_argument('--pools-per-lb', type=int, default=1)
+    parser.add_argument('--wafs', type=int, default=10)
+    parser.add_argument('--waf-ratio', type=float, default=0.5)
+    parser.add_argument('--staging-ratio', type=float, default=0.5)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--throttle-ratio', type=float, default=0)
+    parser.add_argument('--namespace', default='benchmark')
+    args = parser.parse_args()
+    mock = MockXC(lbs=args.lbs, pools=args.pools, pools_per_lb=args.pools_per_lb, wafs=args.wafs,
+                  waf_ratio=args.waf_ratio, staging_ratio=args.staging_ratio, latency_ms=args.latency_ms,
+                  jitter_ms=args.jitter_ms, throttle_ratio=args.throttle_ratio, namespace=args.namespace)
+    server = serve(mock, args.host, args.port)
+    print(f"Mock XC serving {args.lbs} LB on http://{args.host}:{server.server_address[1]}, "
+          f"namespace {args.namespace}")
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,36 +1,142 @@
 # Create SQL Connection
 import base64
+import hashlib
 import json
 import os
+import threading
 import time
+from contextlib import contextmanager
 
-import requests
 from dotenv import load_dotenv
 from fastapi import HTTPException
-from sqlalchemy import insert, create_engine, Select
+from sqlalchemy import insert, create_engine, func, Select, delete, text, update
+from sqlalchemy.exc import IntegrityError
 from sqlmodel import Session, select, SQLModel
+from starlette import status
 
-from helper import event_type
+from helper import event_type, lb_types, log, metrics, query_stats, tracing
+from helper.xc_client import xc_request, xc_hedged_get, raise_for_xc_status
 from model.cdn_model import CDNLBStagingRevSchema, CDNLBProductionRevSchema, CDNLBVersionSchema
-from model.generic_model import SchedulerModel
+from model.generic_model import SchedulerModel, DependencyIndexSchema, SnapshotQueueSchema, SchedulerLeaderSchema, \
+    VersionHistorySchema
 from model.http_model import HttpLbStagingRevisionSchema, HttpLbProductionRevisionSchema, HttpLBVersionSchema
 from model.log_stuff_model import EventLogSchema
+from model.profile_model import ProfileSchema
+from model.snapshot_model import SnapshotJobSchema, SnapshotRunSchema, SnapshotCheckpointSchema
 from model.tcp_model import TcpLbStagingRevSchema, TcpLbProductionRevSchema, TcpLbVersionSchema
 
 load_dotenv()
-sql_address = (f'mysql+pymysql://{os.getenv("SQL_USERNAME")}:{os.getenv("SQL_PASSWORD")}@'
-               f'{os.getenv("SQL_ADDRESS")}:{int(os.getenv("SQL_PORT"))}/{os.getenv("SQL_DATABASE_NAME")}')
-echo = os.getenv("DEMO") == "1"
+logger = log.get_logger(__name__)
+# SQL_URL (optional) is a full database URL replacing the SQL_* settings, e.g. a local benchmark database
+sql_address = os.getenv("SQL_URL") or (
+    f'mysql+pymysql://{os.getenv("SQL_USERNAME")}:{os.getenv("SQL_PASSWORD")}@'
+    f'{os.getenv("SQL_ADDRESS")}:{int(os.getenv("SQL_PORT"))}/{os.getenv("SQL_DATABASE_NAME")}')
 engine = create_engine(sql_address, echo=False)
+metrics.instrument_engine(engine)
+query_stats.instrument_engine(engine)
 list_rpc = [
     "ves.io.schema.views.http_loadbalancer",
     "ves.io.schema.views.tcp_loadbalancer",
-    "ves.io.schema.views.cdn_loadbalancer"
+    "ves.io.schema.views.cdn_loadbalancer",
     "ves.io.schema.app_firewall",
     "ves.io.schema.views.origin_pool",
-    "ves.io.schema.views."
     "ves.io.schema.healthcheck"
 ]
+# Audit log RPC to the kind of object it changes. Changes to other RPC in list_rpc will trigger a full snapshot.
+rpc_object_kinds = {
+    "ves.io.schema.views.http_loadbalancer": lb_types.http,
+    "ves.io.schema.views.tcp_loadbalancer": lb_types.tcp,
+    "ves.io.schema.views.cdn_loadbalancer": lb_types.cdn,
+    "ves.io.schema.app_firewall": lb_types.app_firewall,
+    "ves.io.schema.views.origin_pool": lb_types.origin_pool,
+}
+
+
+def match_rpc(rpc: str) -> str | None:
+    """
+    Match the RPC of an audit log with the RPC in list_rpc.
+    Audit logs contain the full RPC (e.g. ves.io.schema.views.origin_pool.API.Replace).
+    :param rpc: RPC from the audit log
+    :return: The matching RPC in list_rpc, or None if the RPC is not relevant.
+    """
+    for each in list_rpc:
+        if rpc == each or rpc.startswith(f"{each}."):
+            return each
+    return None
+
+
+def create_tables():
+    """
+    Create the tables used by the tool internally if they don't exist yet.
+    """
+    SQLModel.metadata.create_all(engine, tables=[DependencyIndexSchema.__table__, SnapshotQueueSchema.__table__,
+                                                 SnapshotJobSchema.__table__, SchedulerLeaderSchema.__table__,
+                                                 VersionHistorySchema.__table__, ProfileSchema.__table__,
+                                                 SnapshotRunSchema.__table__, SnapshotCheckpointSchema.__table__])
+
+
+_local_locks: dict[str, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+
+@contextmanager
+def advisory_lock(name: str, timeout: int = 60):
+    """
+    Named lock shared by every worker process connected to the same database (MySQL GET_LOCK).
+    On other databases, the lock is only shared within this process.
+    :param name: Name of the lock
+    :param timeout: Seconds to wait for the lock. 0 returns immediately if the lock is taken.
+    :except HTTPException: Raised with status 409 if the lock can't be acquired in time
+    """
+    lock_name = f"{os.getenv('SQL_DATABASE_NAME')}:{name}"
+    # MySQL lock names are limited to 64 characters
+    if len(lock_name) > 64:
+        lock_name = hashlib.sha1(lock_name.encode()).hexdigest()
+    busy = HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"{name} is busy, try again later.")
+    if engine.dialect.name == 'mysql':
+        # The lock belongs to the connection, so the same connection has to release it
+        with engine.connect() as connection:
+            with tracing.tracer.start_as_current_span('acquire lock', attributes={'lock.name': name}):
+                acquired = connection.execute(text("SELECT GET_LOCK(:name, :timeout)"),
+                                              {'name': lock_name, 'timeout': timeout}).scalar()
+            if acquired != 1:
+                raise busy
+            try:
+                yield
+            finally:
+                connection.execute(text("SELECT RELEASE_LOCK(:name)"), {'name': lock_name})
+        return
+    with _local_locks_guard:
+        lock = _local_locks.setdefault(lock_name, threading.Lock())
+    with tracing.tracer.start_as_current_span('acquire lock', attributes={'lock.name': name}):
+        acquired = lock.acquire(timeout=timeout)
+    if not acquired:
+        raise busy
+    try:
+        yield
+    finally:
+        lock.release()
+
+
+def lb_lock(lb_type: str, environment: str, app_name: str, timeout: int = 60):
+    """
+    Lock of a single LB. Replacing and snapshotting the same LB are serialized with it.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB (staging | production)
+    :param app_name: Name of the LB, without the environment
+    :param timeout: Seconds to wait for the lock
+    """
+    app_name = app_name.replace('-staging', '').replace('-production', '')
+    return advisory_lock(f"lb:{lb_type}:{environment}:{app_name}", timeout=timeout)
+
+
+def get_session():
+    """
+    Request-scoped database session, for FastAPI Depends. Anything not committed is rolled back after the response.
+    :return: Database session
+    """
+    with Session(engine) as session:
+        yield session
 
 
 def log_stuff(data: EventLogSchema):
@@ -39,6 +145,12 @@ def log_stuff(data: EventLogSchema):
         session.commit()
 
 
+def save_profile(profile: ProfileSchema):
+    with Session(engine) as session:
+        session.merge(profile)
+        session.commit()
+
+
 def auto_snapshot_pause(status: bool):
     with Session(engine) as session:
         stmt = select(SchedulerModel).where(SchedulerModel.id == 1)
@@ -47,54 +159,79 @@ def auto_snapshot_pause(status: bool):
         session.commit()
 
 
-def push_http_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None):
+@contextmanager
+def auto_snapshot_paused():
+    """
+    Pause the scheduled snapshot while replacing LB. It resumes even if the replace fails.
+    """
+    auto_snapshot_pause(True)
+    try:
+        yield
+    finally:
+        auto_snapshot_pause(False)
+
+
+def push_http_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None) -> list[str]:
     """
     Push the snapshot of HTTP Load Balancers to the Database
     :param environment: Environment of the XC Configuration
     :param new_data: List of new Load Balancers.
     :param exist_data: List of existing Load Balancers that have been updated
+    :return: Names in XC of the Load Balancers stored. The new ones already stored by another snapshot and the updated
+    ones replaced since they were compared are left out.
     """
     timestamp = int(round(time.time()))
+    stored = []
     if environment == "staging":
         q1 = HttpLbStagingRevisionSchema
     else:
         q1 = HttpLbProductionRevisionSchema
     # todo: update the VersionSchema's lb_version stuff
     if new_data:
-        with Session(engine) as session:
-            session.exec(statement=insert(q1), params=new_data)
-            for each in new_data:
-                new_app_name: str = each['app_name'].replace('-staging', '').replace('-production', '')
-                log_stuff(
-                    EventLogSchema(event_type=event_type.HTTP_SNAPSHOT, timestamp=int(round(time.time())),
-                                   description=f'User {q1.generated_by} '
-                                               f'created a new snapshot for a new HTTP Load Balancer '
-                                               f'{new_app_name} on environment {environment}.',
-                                   target_version=each['version']
-                                   ))
-                ins: HttpLBVersionSchema = HttpLBVersionSchema(
+        for each in new_data:
+            new_app_name: str = each['app_name'].replace('-staging', '').replace('-production', '')
+            with lb_lock(lb_types.http, environment, new_app_name), Session(engine) as session:
+                # Another snapshot stored the LB after it was compared (e.g. a targeted one during a full one)
+                stored_version = select(HttpLBVersionSchema.uid).where(HttpLBVersionSchema.app_name == new_app_name)
+                if session.exec(stored_version.where(HttpLBVersionSchema.environment == environment)).first():
+                    continue
+                # Insert LB to Revision table
+                session.exec(statement=insert(q1), params=[each])
+                # Insert LB to Version table
+                session.add(HttpLBVersionSchema(
                     uid=generate_uid(uid_type='app', app_name=each['app_name'], environment=environment,
                                      timestamp=timestamp),
                     app_name=new_app_name,
                     timestamp=timestamp,
                     original_app_name=each['app_name'],
                     environment=environment,
-                    current_version=1
-                )
-                session.add(ins)
-            session.commit()
-
+                    current_version=1))
+                activate_version(session, lb_types.http, environment, new_app_name, each['version'], timestamp,
+                                 'snapshot')
+                session.add(
+                    EventLogSchema(event_type=event_type.HTTP_SNAPSHOT, timestamp=int(round(time.time())),
+                                   description=f'User {q1.generated_by} '
+                                               f'created a new snapshot for a new HTTP Load Balancer '
+                                               f'{new_app_name} on environment {environment}.',
+                                   target_version=each['version']
+                                   ))
+                session.commit()
+            stored.append(each['original_app_name'])
     if exist_data:
-        with Session(engine) as session:
-            session.exec(statement=insert(q1), params=exist_data)
-            for each in exist_data:
+        for each in exist_data:
+            with lb_lock(lb_types.http, environment, each['app_name']), Session(engine) as session:
                 query = session.exec(
                     select(HttpLBVersionSchema).where(HttpLBVersionSchema.app_name == each['app_name']).where(
                         HttpLBVersionSchema.environment == environment)).first()
+                # The LB was replaced after it was compared. The next snapshot will compare it again.
+                if query.current_version != each['previous_version']:
+                    continue
+                session.exec(statement=insert(q1), params=[each])
                 query.current_version = each['version']
-                session.commit()
+                activate_version(session, lb_types.http, environment, each['app_name'], each['version'], timestamp,
+                                 'snapshot')
                 new_app_name: str = each['app_name'].replace('-staging', '').replace('-production', '')
-                log_stuff(
+                session.add(
                     EventLogSchema(event_type=event_type.HTTP_SNAPSHOT, timestamp=int(round(time.time())),
                                    description=f'User {q1.generated_by} '
                                                f'created a new snapshot for an existing HTTP Load Balancer '
@@ -102,60 +239,74 @@ def push_http_lb_to_db(environment: str, new_data: list | None = None, exist_dat
                                    previous_version=each['previous_version'],
                                    target_version=each['version']
                                    ))
+                session.commit()
+                stored.append(each['original_app_name'])
+    return stored
 
 
-def push_tcp_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None):
+def push_tcp_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None) -> list[str]:
     """
     Push the snapshot of HTTP Load Balancers to the Database
     :param environment: Environment of the XC Configuration
     :param new_data: List of new Load Balancers.
     :param exist_data: List of existing Load Balancers that have been updated
+    :return: Names in XC of the Load Balancers stored. The new ones already stored by another snapshot and the updated
+    ones replaced since they were compared are left out.
     """
     timestamp = int(round(time.time()))
+    stored = []
     if environment == "staging":
         q1 = TcpLbStagingRevSchema
     else:
         q1 = TcpLbProductionRevSchema
     # todo: update the VersionSchema's lb_version stuff
     if new_data:
-        with Session(engine) as session:
-            # Insert LB to Revision table
-            session.exec(statement=insert(q1), params=new_data)
-            # Insert LB to Version table
-            for each in new_data:
-                new_app_name: str = each['tcp_lb_name'].replace('-staging', '').replace('-production', '')
-                ins: TcpLbVersionSchema = TcpLbVersionSchema(
+        for each in new_data:
+            new_app_name: str = each['tcp_lb_name'].replace('-staging', '').replace('-production', '')
+            with lb_lock(lb_types.tcp, environment, new_app_name), Session(engine) as session:
+                # Another snapshot stored the LB after it was compared (e.g. a targeted one during a full one)
+                stored_version = select(TcpLbVersionSchema.uid).where(TcpLbVersionSchema.tcp_lb_name == new_app_name)
+                if session.exec(stored_version.where(TcpLbVersionSchema.environment == environment)).first():
+                    continue
+                # Insert LB to Revision table
+                session.exec(statement=insert(q1), params=[each])
+                # Insert LB to Version table
+                session.add(TcpLbVersionSchema(
                     uid=generate_uid(uid_type='tcp', app_name=each['tcp_lb_name'], environment=environment,
                                      timestamp=timestamp),
                     tcp_lb_name=new_app_name,
                     timestamp=timestamp,
                     original_tcp_lb_name=each['original_tcp_lb_name'],
                     environment=environment,
-                    current_version=1
-                )
-                session.add(ins)
-                log_stuff(
+                    current_version=1))
+                activate_version(session, lb_types.tcp, environment, new_app_name, each['version'], timestamp,
+                                 'snapshot')
+                session.add(
                     EventLogSchema(event_type=event_type.TCP_SNAPSHOT, timestamp=int(round(time.time())),
                                    description=f'User {q1.generated_by} '
                                                f'created a new snapshot for a new TCP Load Balancer '
                                                f'{new_app_name} on environment {environment}.',
                                    target_version=each['version']
                                    ))
-            session.commit()
+                session.commit()
+            stored.append(each['original_tcp_lb_name'])
     if exist_data:
-        with Session(engine) as session:
-            # Insert to Revision table
-            session.exec(statement=insert(q1), params=exist_data)
-            # Update Version table
-            for each in exist_data:
+        for each in exist_data:
+            with lb_lock(lb_types.tcp, environment, each['tcp_lb_name']), Session(engine) as session:
                 query = session.exec(
                     select(TcpLbVersionSchema).where(TcpLbVersionSchema.tcp_lb_name == each['tcp_lb_name']).where(
                         TcpLbVersionSchema.environment == environment)).first()
+                # The LB was replaced after it was compared. The next snapshot will compare it again.
+                if query.current_version != each['previous_version']:
+                    continue
+                # Insert to Revision table
+                session.exec(statement=insert(q1), params=[each])
+                # Update Version table
                 query.current_version = each['version']
-                session.commit()
+                activate_version(session, lb_types.tcp, environment, each['tcp_lb_name'], each['version'],
+                                 timestamp, 'snapshot')
                 new_app_name: str = each['tcp_lb_name'].replace('-staging', '').replace('-production', '')
-
-                log_stuff(
+                session.add(
                     EventLogSchema(event_type=event_type.TCP_SNAPSHOT, timestamp=int(round(time.time())),
                                    description=f'User {q1.generated_by} '
                                                f'created a new snapshot for an existing TCP Load Balancer '
@@ -163,60 +314,74 @@ def push_tcp_lb_to_db(environment: str, new_data: list | None = None, exist_data
                                    previous_version=each['previous_version'],
                                    target_version=each['version']
                                    ))
+                session.commit()
+                stored.append(each['original_tcp_lb_name'])
+    return stored
 
 
-def push_cdn_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None):
+def push_cdn_lb_to_db(environment: str, new_data: list | None = None, exist_data: list | None = None) -> list[str]:
     """
     Push the snapshot of HTTP Load Balancers to the Database
     :param environment: Environment of the XC Configuration
     :param new_data: List of new Load Balancers.
     :param exist_data: List of existing Load Balancers that have been updated
+    :return: Names in XC of the Load Balancers stored. The new ones already stored by another snapshot and the updated
+    ones replaced since they were compared are left out.
     """
     timestamp = int(round(time.time()))
+    stored = []
     if environment == "staging":
         q1 = CDNLBStagingRevSchema
     else:
         q1 = CDNLBProductionRevSchema
     # todo: update the VersionSchema's lb_version stuff
     if new_data:
-        with Session(engine) as session:
-            # Insert LB to Revision table
-            session.exec(statement=insert(q1), params=new_data)
-            # Insert LB to Version table
-            for each in new_data:
-                new_app_name: str = (each['cdn_lb_name']).replace('-staging', '').replace('-production', '')
-                # print(f"cdn db: {each['cdn_lb_name']} {new_app_name}")
-                ins: CDNLBVersionSchema = CDNLBVersionSchema(
+        for each in new_data:
+            new_app_name: str = each['cdn_lb_name'].replace('-staging', '').replace('-production', '')
+            with lb_lock(lb_types.cdn, environment, new_app_name), Session(engine) as session:
+                # Another snapshot stored the LB after it was compared (e.g. a targeted one during a full one)
+                stored_version = select(CDNLBVersionSchema.uid).where(CDNLBVersionSchema.cdn_lb_name == new_app_name)
+                if session.exec(stored_version.where(CDNLBVersionSchema.environment == environment)).first():
+                    continue
+                # Insert LB to Revision table
+                session.exec(statement=insert(q1), params=[each])
+                # Insert LB to Version table
+                session.add(CDNLBVersionSchema(
                     uid=generate_uid(uid_type='cdn', app_name=each['cdn_lb_name'], environment=environment,
                                      timestamp=timestamp),
                     cdn_lb_name=new_app_name,
                     timestamp=timestamp,
                     original_cdn_lb_name=each['original_cdn_lb_name'],
                     environment=environment,
-                    current_version=1)
-                session.add(ins)
-                log_stuff(
+                    current_version=1))
+                activate_version(session, lb_types.cdn, environment, new_app_name, each['version'], timestamp,
+                                 'snapshot')
+                session.add(
                     EventLogSchema(event_type=event_type.CDN_SNAPSHOT, timestamp=int(round(time.time())),
                                    description=f'User {q1.generated_by} '
                                                f'created a new snapshot for a new CDN Load Balancer '
                                                f'{new_app_name} on environment {environment}.',
                                    target_version=each['version']
                                    ))
-            session.commit()
+                session.commit()
+            stored.append(each['original_cdn_lb_name'])
     if exist_data:
-        with Session(engine) as session:
-            # Insert to Revision table
-            session.exec(statement=insert(q1), params=exist_data)
-            # Update Version table
-            for each in exist_data:
+        for each in exist_data:
+            with lb_lock(lb_types.cdn, environment, each['cdn_lb_name']), Session(engine) as session:
                 query = session.exec(
                     select(CDNLBVersionSchema).where(CDNLBVersionSchema.cdn_lb_name == each['cdn_lb_name']).where(
                         CDNLBVersionSchema.environment == environment)).first()
+                # The LB was replaced after it was compared. The next snapshot will compare it again.
+                if query.current_version != each['previous_version']:
+                    continue
+                # Insert to Revision table
+                session.exec(statement=insert(q1), params=[each])
+                # Update Version table
                 query.current_version = each['version']
+                activate_version(session, lb_types.cdn, environment, each['cdn_lb_name'], each['version'],
+                                 timestamp, 'snapshot')
                 new_app_name: str = each['cdn_lb_name'].replace('-staging', '').replace('-production', '')
-
-                session.commit()
-                log_stuff(
+                session.add(
                     EventLogSchema(event_type=event_type.CDN_SNAPSHOT, timestamp=int(round(time.time())),
                                    description=f'User {q1.generated_by} '
                                                f'created a new snapshot for an existing CDN Load Balancer '
@@ -224,6 +389,9 @@ def push_cdn_lb_to_db(environment: str, new_data: list | None = None, exist_data
                                    previous_version=each['previous_version'],
                                    target_version=each['version']
                                    ))
+                session.commit()
+                stored.append(each['original_cdn_lb_name'])
+    return stored
 
 
 def get_model_dict(models: SQLModel):
@@ -250,18 +418,202 @@ def generate_uid(uid_type: str, app_name: str, environment: str, timestamp: int,
     return base64.b64encode(pre_uid.encode('utf-8')).decode('utf-8')
 
 
-def get_http_lb_data(namespace: str, environment: str, load_balancer_list: list, username: str = "autogenerated"):
+def lb_references(lb_type: str, environment: str, app_data: dict) -> list[dict]:
     """
-    Gets the HTTP LB data from XC to be stored to the database.
-    :param username: Username of the requester. Defaults to autogenerated.
-    :param namespace: Namespace of the XC
-    :param environment: Environment of the HTTP Load Balancer
-    :param load_balancer_list: List of HTTP Load Balancers name to retrieve from XC.
-    :return: List of new HTTP LB and list of existing HTTP LB to be updated.
+    List the Origin Pools and App Firewall referenced by a Load Balancer, to be stored in the dependency index.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB
+    :param app_data: The replace_form of the LB
+    :return: Rows of the dependency index
+    """
+    lb_name = app_data['metadata']['name']
+    pool_field = 'origin_pools_weights' if lb_type == lb_types.tcp else 'default_route_pools'
+    objects = [(lb_types.origin_pool, _pool['pool']['name']) for _pool in app_data['spec'].get(pool_field) or []]
+    if 'app_firewall' in app_data['spec']:
+        objects.append((lb_types.app_firewall, app_data['spec']['app_firewall']['name']))
+    references = []
+    for object_kind, object_name in objects:
+        pre_uid = f"dep_{object_kind}_{object_name}_{lb_type}_{lb_name}"
+        references.append({'uid': base64.b64encode(pre_uid.encode('utf-8')).decode('utf-8'),
+                           'object_kind': object_kind, 'object_name': object_name, 'lb_type': lb_type,
+                           'lb_name': lb_name, 'environment': environment})
+    return references
+
+
+def refresh_dependency_index(lb_type: str, lb_names: list[str], references: list[dict]):
+    """
+    Replace the dependency index rows of the Load Balancers that were retrieved from XC.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param lb_names: Name of the Load Balancers in XC that were retrieved
+    :param references: Rows of the dependency index from lb_references()
     """
+    if not lb_names:
+        return
     timestamp = int(round(time.time()))
+    # The same pool can be referenced twice by a LB, so dedupe them by uid
+    rows = list({each['uid']: {**each, 'timestamp': timestamp} for each in references}.values())
+    with Session(engine) as session:
+        session.exec(delete(DependencyIndexSchema).where(DependencyIndexSchema.lb_type == lb_type).where(
+            DependencyIndexSchema.lb_name.in_(lb_names)))
+        if rows:
+            session.exec(statement=insert(DependencyIndexSchema), params=rows)
+        session.commit()
+
+
+def prune_dependency_index(lb_type: str, lb_names: set[str]):
+    """
+    Remove the dependency index rows of the Load Balancers deleted from XC, so changes to the objects they
+    referenced don't queue snapshots of them anymore.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param lb_names: Name of every Load Balancer of the type listed in XC
+    """
+    with Session(engine) as session:
+        indexed = set(session.exec(select(DependencyIndexSchema.lb_name).where(
+            DependencyIndexSchema.lb_type == lb_type).distinct()).all())
+    deleted = sorted(indexed - lb_names)
+    if deleted:
+        logger.debug("Removing the dependency index of %s deleted from XC: %s", lb_type, deleted)
+        refresh_dependency_index(lb_type, deleted, [])
+
+
+def find_dependent_lbs(object_kind: str, object_name: str) -> list[tuple[str, str, str]]:
+    """
+    Find the Load Balancers referencing an Origin Pool or an App Firewall.
+    :param object_kind: origin_pool | app_firewall
+    :param object_name: Name of the object in XC
+    :return: List of (LB type, environment, LB name in XC)
+    """
+    with Session(engine) as session:
+        rows = session.exec(select(DependencyIndexSchema).where(
+            DependencyIndexSchema.object_kind == object_kind).where(
+            DependencyIndexSchema.object_name == object_name)).all()
+    return [(row.lb_type, row.environment, row.lb_name) for row in rows]
+
+
+def enqueue_snapshot_targets(targets: list[tuple[str, str, str]], debounce: int):
+    """
+    Queue Load Balancers to be snapshot. Targets queued while a batch is pending join that batch,
+    so a burst of changes is snapshot once after the debounce window.
+    :param targets: List of (LB type, environment, LB name in XC)
+    :param debounce: Debounce window in seconds
+    """
+    current = int(round(time.time()))
+    for attempt in range(2):
+        with Session(engine) as session:
+            pending = session.exec(select(SnapshotQueueSchema).order_by(SnapshotQueueSchema.due_time)).first()
+            due_time = pending.due_time if pending else current + debounce
+            for lb_type, environment, lb_name in set(targets):
+                pre_uid = f"queue_{lb_type}_{lb_name}-{environment}"
+                uid = base64.b64encode(pre_uid.encode('utf-8')).decode('utf-8')
+                if session.get(SnapshotQueueSchema, uid):
+                    continue
+                session.add(SnapshotQueueSchema(uid=uid, lb_type=lb_type, environment=environment, lb_name=lb_name,
+                                                queued_time=current, due_time=due_time))
+            try:
+                session.commit()
+                return
+            except IntegrityError:
+                # Another webhook queued the same LB at the same time, try again with its row
+                session.rollback()
+
+
+def dequeue_snapshot_targets() -> list[tuple[str, str, str]]:
+    """
+    Take the Load Balancers whose debounce window has passed out of the snapshot queue.
+    :return: List of (LB type, environment, LB name in XC)
+    """
+    current = int(round(time.time()))
+    with Session(engine) as session:
+        rows = session.exec(select(SnapshotQueueSchema).where(SnapshotQueueSchema.due_time <= current)).all()
+        targets = [(row.lb_type, row.environment, row.lb_name) for row in rows]
+        for row in rows:
+            session.delete(row)
+        session.commit()
+    return targets
+
+
+def activate_version(session: Session, lb_type: str, environment: str, app_name: str, version: int,
+                     timestamp: int, activated_by: str):
+    """
+    Record in the version history that a version became current. The previous version stops being current.
+    Added to the session, so it is committed along with the version table.
+    :param session: Session updating the version table
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB
+    :param app_name: Name of the LB, without the environment
+    :param version: Version now current
+    :param timestamp: Time the version became current
+    :param activated_by: What made the version current (snapshot | replace)
+    """
+    session.exec(update(VersionHistorySchema).where(VersionHistorySchema.lb_type == lb_type).where(
+        VersionHistorySchema.environment == environment).where(VersionHistorySchema.app_name == app_name).where(
+        VersionHistorySchema.valid_to.is_(None)).values(valid_to=timestamp))
+    session.add(VersionHistorySchema(lb_type=lb_type, environment=environment, app_name=app_name, version=version,
+                                     valid_from=timestamp, activated_by=activated_by))
+
+
+def versions_at(timestamp: int, lb_type: str | None = None,
+                environment: str | None = None) -> list[VersionHistorySchema]:
+    """
+    Version of every LB that was current at a point in time.
+    :param timestamp: Point in time
+    :param lb_type: (Optional) Only this type of LB
+    :param environment: (Optional) Only this environment
+    :return: Version history of each LB that existed at the timestamp
+    """
+    statement = select(VersionHistorySchema).where(VersionHistorySchema.valid_from <= timestamp).where(
+        (VersionHistorySchema.valid_to.is_(None)) | (VersionHistorySchema.valid_to > timestamp))
+    if lb_type:
+        statement = statement.where(VersionHistorySchema.lb_type == lb_type)
+    if environment:
+        statement = statement.where(VersionHistorySchema.environment == environment)
+    with Session(engine) as session:
+        return list(session.exec(statement).all())
+
+
+def backfill_version_history():
+    """
+    Start the version history of LB snapshotted before it existed. Their current version is counted from the time
+    its revision was taken.
+    Every API worker calls it at startup, a single one runs it at a time. The others skip it.
+    """
+    tables = [(lb_types.http, HttpLBVersionSchema, 'app_name', HttpLbStagingRevisionSchema,
+               HttpLbProductionRevisionSchema),
+              (lb_types.tcp, TcpLbVersionSchema, 'tcp_lb_name', TcpLbStagingRevSchema, TcpLbProductionRevSchema),
+              (lb_types.cdn, CDNLBVersionSchema, 'cdn_lb_name', CDNLBStagingRevSchema, CDNLBProductionRevSchema)]
+    try:
+        with advisory_lock('version_history_backfill', timeout=0), Session(engine) as session:
+            for lb_type, version_schema, name_column, staging_schema, production_schema in tables:
+                app_name = getattr(version_schema, name_column)
+                # Only the LB without an interval yet, so running it again inserts nothing
+                tracked = select(VersionHistorySchema.id).where(VersionHistorySchema.lb_type == lb_type).where(
+                    VersionHistorySchema.environment == version_schema.environment).where(
+                    VersionHistorySchema.app_name == app_name).exists()
+                for revision_schema, in_environment in ((staging_schema, version_schema.environment == "staging"),
+                                                        (production_schema, version_schema.environment != "staging")):
+                    columns = (app_name, version_schema.environment, version_schema.current_version,
+                               version_schema.timestamp)
+                    untracked = session.exec(select(*columns, func.min(revision_schema.timestamp)).outerjoin(
+                        revision_schema, (getattr(revision_schema, name_column) == app_name) & (
+                                revision_schema.version == version_schema.current_version)).where(
+                        in_environment).where(~tracked).group_by(*columns)).all()
+                    for name, environment, version, timestamp, revision_time in untracked:
+                        session.add(VersionHistorySchema(lb_type=lb_type, environment=environment, app_name=name,
+                                                         version=version, valid_from=revision_time or timestamp,
+                                                         activated_by='snapshot'))
+            session.commit()
+    except HTTPException:
+        logger.info("Version history backfill skipped, another worker is running it")
+
+
+def filter_lb_names(load_balancer_list: dict, environment: str) -> list[str]:
+    """
+    Get the names of the Load Balancers from the XC list response that belong to the environment.
+    :param load_balancer_list: XC list response (``{'items': [{'name': ...}, ...]}``)
+    :param environment: Environment of the Load Balancer
+    :return: List of Load Balancer names as written in XC
+    """
     each_lb_name_xc = []
-    # Get all LB Name from the list
     for each in load_balancer_list['items']:
         app_name: str = each['name']
         match environment:
@@ -271,679 +623,712 @@ def get_http_lb_data(namespace: str, environment: str, load_balancer_list: list,
             case "production":
                 if app_name.endswith('-staging') is False:
                     each_lb_name_xc.append(app_name)
-    # Get all data in SQL data according to environment
-    with Session(engine) as session:
-        if environment == "staging":
-            q1 = HttpLbStagingRevisionSchema
-        else:
-            q1 = HttpLbProductionRevisionSchema
-        sql = session.exec(select(q1).order_by(q1.version.desc())).all()
-    # Get only the names from SQL data
-    query_lb_name = []
-    if sql:
-        for _sql in sql:
-            query_lb_name.append(_sql.app_name)
-    # Check if LB exists in SQL data
+    return each_lb_name_xc
+
+
+def fetch_lb_span(lb_type: str, environment: str, lb_name: str, is_new: bool):
+    """
+    Span of the fetch of one LB from XC during a snapshot. The requests of its Origin Pools and App Firewall
+    are its children.
+    :param is_new: True if the LB isn't in the database yet
+    """
+    return tracing.tracer.start_as_current_span('fetch LB', attributes={
+        'lb.type': lb_type, 'lb.name': lb_name, 'environment': environment, 'lb.new': is_new})
+
+
+def partition_lb_names(name_column, lb_names: list[str]):
+    """
+    Split the XC Load Balancer names into new and existing ones, according to the revision table.
+    Only the names being processed are looked up, instead of loading the whole revision table.
+    :param name_column: Name column of the revision table (e.g. HttpLbStagingRevisionSchema.app_name)
+    :param lb_names: List of Load Balancer names as written in XC
+    :return: List of new Load Balancers and list of existing Load Balancers
+    """
     new_lb, exist_lb = [], []
-    for each in each_lb_name_xc:
-        name = each.replace('-staging', '').replace('-production', '')
-        if name not in query_lb_name:
+    if not lb_names:
+        return new_lb, exist_lb
+    names_no_env = {each: each.replace('-staging', '').replace('-production', '') for each in lb_names}
+    with Session(engine) as session:
+        stored = set(session.exec(
+            select(name_column).where(name_column.in_(set(names_no_env.values()))).distinct()).all())
+    for each in lb_names:
+        if names_no_env[each] not in stored:
             new_lb.append(each)
         else:
             exist_lb.append(each)
+    return new_lb, exist_lb
+
+
+def is_origin_updated(stored_origin: list, xc_origin: list) -> bool:
+    """
+    Check if the Origin Pools in XC are newer than the ones stored in the revision.
+    :param stored_origin: Origin Pools stored in the current revision
+    :param xc_origin: Origin Pools retrieved from XC
+    :return: True if the Origin Pools need to be updated
+    """
+    if not xc_origin:
+        return False
+    if not stored_origin:
+        return True
+    # A pool was added or removed, so the LB itself must be updated as well
+    if len(stored_origin) != len(xc_origin):
+        return True
+    for stored, current in zip(stored_origin, xc_origin):
+        if stored['replace_form']['metadata']['name'] == current['replace_form']['metadata']['name'] and \
+                stored['resource_version'] < current['resource_version']:
+            return True
+    return False
+
+
+def new_http_lb_revision(namespace: str, environment: str, lb_name: str, username: str, timestamp: int,
+                         references: list | None = None) -> dict:
+    """
+    Gets a new HTTP LB from XC, along with its Origin Pools and App Firewall, as the first revision.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the HTTP Load Balancer
+    :param lb_name: Name of the HTTP Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database
+    """
+    app_dict = {}
+    get_app_data = _get_http_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data["replace_form"]
+    if references is not None:
+        references.extend(lb_references(lb_types.http, environment, app_data))
+    app_dict['uid'] = generate_uid(uid_type='rev', app_name=app_data['metadata']['name'], environment=environment,
+                                   highest_version=0, timestamp=timestamp)
+    app_dict['timestamp'] = timestamp
+    app_dict['app_name'] = app_data['metadata']['name']
+    app_dict['original_app_name'] = get_app_data['replace_form']['metadata']['name']
+    app_dict['generated_by'] = username  # todo: get the username
+    app_dict['timestamp'] = timestamp
+    app_dict['version'] = 1
+    # todo: add previous version
+    app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    # Default values that will later be replaced if they exist
+    app_dict['origin_resource_version'] = 0
+    app_dict['waf_resource_version'] = 0
+    app_dict['lb_config'] = get_app_data
+    app_dict['ddos_config'] = {}  # todo:
+    app_dict['bot_config'] = {}  # todo:
+    app_dict['remarks'] = "System-generated"
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists
+    if 'default_route_pools' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['default_route_pools']:
+            for _pool in app_data['spec']['default_route_pools']:
+                __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+    app_dict['origin_config'] = origin_pool
+    # Get Application Firewall from App Data
+    firewall = {}
+    # If WAF isn't set up, it won't show up on JSON, so we have to check it
+    if 'app_firewall' in app_data['spec']:
+        firewall = get_app_firewall(namespace=namespace, firewall_name=app_data['spec']['app_firewall']['name'])
+        app_dict['waf_resource_version'] = firewall['resource_version']
+    app_dict['waf_config'] = firewall
+    __xc_name_no_env__: str = (app_data['metadata']['name']).replace('-staging', '').replace('-production', '')
+    app_dict['app_name'] = __xc_name_no_env__
+    return app_dict
+
+
+def exist_http_lb_revision(namespace: str, environment: str, lb_name: str, username: str,
+                           timestamp: int, references: list | None = None) -> dict | None:
+    """
+    Gets an existing HTTP LB from XC and compares it with the current revision in the database.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the HTTP Load Balancer
+    :param lb_name: Name of the HTTP Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database, or None if nothing has changed
+    """
+    if environment == "staging":
+        q1 = HttpLbStagingRevisionSchema
+    else:
+        q1 = HttpLbProductionRevisionSchema
+    exist_dict = {}
+    get_app_data = _get_http_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data['replace_form']
+    if references is not None:
+        references.extend(lb_references(lb_types.http, environment, app_data))
+    exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    # Default values that will later be replaced if they exist
+    exist_dict['origin_resource_version'] = 0
+    exist_dict['waf_resource_version'] = 0
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists to prevent errors
+    if 'default_route_pools' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['default_route_pools']:
+            for _pool in app_data['spec']['default_route_pools']:
+                __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+    # Get Application Firewall from App Data
+    firewall = {}
+    # If WAF isn't set up, it won't show up on JSON, so we have to check it
+    if 'app_firewall' in app_data['spec']:
+        firewall = get_app_firewall(namespace=namespace, firewall_name=app_data['spec']['app_firewall']['name'])
+    __xc_app_name_no_env__ = lb_name.replace("-staging", '').replace("-production", '')
+
+    # Get current version from app
+    with Session(engine) as session:
+        get_version_schema = session.exec(
+            select(HttpLBVersionSchema).where(HttpLBVersionSchema.app_name == __xc_app_name_no_env__).where(
+                HttpLBVersionSchema.environment == environment)).first()
+        # Get configuration from revisions by specific version
+        get_revision_schema = session.exec(select(q1).where(q1.app_name == __xc_app_name_no_env__).where(
+            q1.version == get_version_schema.current_version)).first()
+        if not get_revision_schema:
+            logger.warning("%s on %s has no revision for its current version", __xc_app_name_no_env__,
+                           environment)
+            return None
+    is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
+    # Check if App Firewall is the latest
+    is_waf_latest_in_xc = False
+    if firewall:
+        is_waf_latest_in_xc = get_revision_schema.waf_resource_version < int(firewall['resource_version'])
+    # Check if Origin Pool is the latest
+    is_origin_latest_in_xc = is_origin_updated(get_revision_schema.origin_config, origin_pool)
+    # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
+    sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
+    if sum_update == 0:
+        return None
+    # Start changing database from here
+    # Update LB
+    if is_lb_latest_in_xc:
+        lb_value = get_app_data
+    # If LB is not updated, the db will copy the old one.
+    else:
+        lb_value = get_revision_schema.lb_config
+    # Update Origin
+    if is_origin_latest_in_xc:
+        origin_value = origin_pool
+    # If Origin is not updated, the db will copy the old one.
+    else:
+        origin_value = get_revision_schema.origin_config
+    # Update WAF
+    if is_waf_latest_in_xc:
+        waf_value = firewall
+        exist_dict['waf_resource_version'] = firewall['resource_version']
+    else:
+        waf_value = get_revision_schema.waf_config
+        if 'resource_version' in get_revision_schema.waf_config:
+            exist_dict['waf_resource_version'] = get_revision_schema.waf_config['resource_version']
+        else:
+            exist_dict['waf_resource_version'] = 0
+    with Session(engine) as session:
+        stmt = select(q1).where(
+            q1.app_name == __xc_app_name_no_env__).order_by(q1.version.desc())
+        get_ver = session.exec(stmt).first()
+
+    exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.app_name,
+                                     environment=environment,
+                                     highest_version=get_version_schema.current_version, timestamp=timestamp)
+    exist_dict['app_name'] = get_version_schema.app_name
+    exist_dict['version'] = get_ver.version + 1
+    exist_dict['timestamp'] = timestamp
+    exist_dict['previous_version'] = get_version_schema.current_version
+    exist_dict['original_app_name'] = get_app_data['replace_form']['metadata']['name']
+    exist_dict['generated_by'] = username  # todo: update to get the current user
+    exist_dict['lb_config'] = lb_value
+    exist_dict['waf_config'] = waf_value
+    exist_dict['origin_config'] = origin_value
+    exist_dict['ddos_config'] = {}
+    exist_dict['bot_config'] = {}
+    return exist_dict
+
+
+def get_http_lb_data(namespace: str, environment: str, load_balancer_list: dict, username: str = "autogenerated",
+                     progress=None):
+    """
+    Gets the HTTP LB data from XC to be stored to the database.
+    :param username: Username of the requester. Defaults to autogenerated.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the HTTP Load Balancer
+    :param load_balancer_list: List of HTTP Load Balancers name to retrieve from XC.
+    :param progress: (Optional) SnapshotProgress, notified for each LB retrieved from XC.
+    :return: List of new HTTP LB and list of existing HTTP LB to be updated.
+    """
+    timestamp = int(round(time.time()))
+    # Get all LB Name from the list
+    each_lb_name_xc = filter_lb_names(load_balancer_list, environment)
+    # Check if LB exists in SQL data according to environment
+    if environment == "staging":
+        q1 = HttpLbStagingRevisionSchema
+    else:
+        q1 = HttpLbProductionRevisionSchema
+    new_lb, exist_lb = partition_lb_names(q1.app_name, each_lb_name_xc)
+    if progress:
+        progress.start(lb_types.http, environment, len(each_lb_name_xc))
     # Query XC to get the new data
+    references = []
     new_list = []
-    # print(exist_lb)
     for new in new_lb:
-        app_dict = {}
-        get_app_data = _get_http_lb(namespace=namespace, app_name=new)
-        app_data = get_app_data["replace_form"]
-        app_dict['uid'] = generate_uid(uid_type='rev', app_name=app_data['metadata']['name'], environment=environment,
-                                       highest_version=0, timestamp=timestamp)
-        app_dict['timestamp'] = timestamp
-        app_dict['app_name'] = app_data['metadata']['name']
-        app_dict['original_app_name'] = get_app_data['replace_form']['metadata']['name']
-        app_dict['generated_by'] = username  # todo: get the username
-        app_dict['timestamp'] = timestamp
-        app_dict['version'] = 1
-        # todo: add previous version
-        app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-        # Default values that will later be replaced if they exist
-        app_dict['origin_resource_version'] = 0
-        app_dict['waf_resource_version'] = 0
-        app_dict['lb_config'] = get_app_data
-        app_dict['ddos_config'] = {}  # todo:
-        app_dict['bot_config'] = {}  # todo:
-        app_dict['remarks'] = "System-generated"
-        # Get Origin Pools from App Data
-        origin_pool = []
-        # Check if Origin Pool exists
-        if 'default_route_pools' in app_data['spec']:
-            # Check if it has anything. Just in case.
-            if app_data['spec']['default_route_pools']:
-                for _pool in app_data['spec']['default_route_pools']:
-                    __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
-                    origin_pool.append(__origin__)
-        app_dict['origin_config'] = origin_pool
-        # Get Application Firewall from App Data
-        firewall = {}
-        # If WAF isn't set up, it won't show up on JSON, so we have to check it
-        if 'app_firewall' in app_data['spec']:
-            firewall = get_app_firewall(namespace=namespace, firewall_name=app_data['spec']['app_firewall']['name'])
-            app_dict['waf_resource_version'] = firewall['resource_version']
-        app_dict['waf_config'] = firewall
-        __xc_name_no_env__: str = (app_data['metadata']['name']).replace('-staging', '').replace('-production', '')
-        app_dict['app_name'] = __xc_name_no_env__
-        new_list.append(app_dict)
+        with fetch_lb_span(lb_types.http, environment, new, is_new=True):
+            new_list.append(new_http_lb_revision(namespace=namespace, environment=environment, lb_name=new,
+                                                 username=username, timestamp=timestamp, references=references))
+        if progress:
+            progress.advance(lb_types.http, environment, new)
     exist_list = []
     for exist in exist_lb:
-        exist_dict = {}
-        get_app_data = _get_http_lb(namespace=namespace, app_name=exist)
-        app_data = get_app_data['replace_form']
-        exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-        # Default values that will later be replaced if they exist
-        exist_dict['origin_resource_version'] = 0
-        exist_dict['waf_resource_version'] = 0
-        # Get Origin Pools from App Data
-        origin_pool = []
-        # Check if Origin Pool exists to prevent errors
-        if 'default_route_pools' in app_data['spec']:
-            # Check if it has anything. Just in case.
-            if app_data['spec']['default_route_pools']:
-                for _pool in app_data['spec']['default_route_pools']:
-                    __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
-                    origin_pool.append(__origin__)
-        # Get Application Firewall from App Data
-        firewall = {}
-        # If WAF isn't set up, it won't show up on JSON, so we have to check it
-        if 'app_firewall' in app_data['spec']:
-            firewall = get_app_firewall(namespace=namespace, firewall_name=app_data['spec']['app_firewall']['name'])
-        __xc_app_name_no_env__ = exist.replace("-staging", '').replace("-production", '')
-        __xc_environment__ = "production"
-        if exist.endswith('-staging'):
-            __xc_environment__ = "staging"
-
-        # Get current version from app
-        with Session(engine) as session:
-            get_version_schema = session.exec(
-                select(HttpLBVersionSchema).where(HttpLBVersionSchema.app_name == __xc_app_name_no_env__).where(
-                    HttpLBVersionSchema.environment == environment)).first()
-            # print(f"tb_ver: {get_version_schema}")
-            # Get configuration from revisions by specific version
-            get_revision_schema = session.exec(select(q1).where(q1.app_name == __xc_app_name_no_env__).where(
-                q1.version == get_version_schema.current_version)).first()
-            # print(get_revision_schema)
-            if not get_revision_schema:
-                print(f"{__xc_app_name_no_env__} missing?")
-                continue
-        lb_resource_ver = 0
-        if get_revision_schema.lb_resource_version:
-            lb_resource_ver = get_revision_schema.lb_resource_version
-        # print(
-        #     f"Current version: {get_version_schema.current_version}, LB resource version: {lb_resource_ver}")
-        is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
-        # Check if App Firewall is the latest
-        is_waf_latest_in_xc = False
-        if firewall:
-            is_waf_latest_in_xc = get_revision_schema.waf_resource_version < int(firewall['resource_version'])
-        # Check if Origin Pool is the latest
-        is_origin_latest_in_xc = False
-        # Check if origin pool is empty first
-        if origin_pool:
-            if get_revision_schema.origin_config:
-                # print(origin_pool)
-                current_origin_list = {i['resource_version']: i for i in get_revision_schema.origin_config}
-                j: int
-                if len(origin_pool) > len(current_origin_list):
-                    j = len(origin_pool)
-                else:
-                    j = len(current_origin_list)
-                for each in range(j):
-                    # print(f"current_origin_list: {origin_pool[each]}")
-                    if get_revision_schema.origin_config[each]['replace_form']['metadata']['name'] == \
-                            origin_pool[each]['replace_form']['metadata'][
-                                'name'] and get_revision_schema.origin_config[each]['resource_version'] < \
-                            origin_pool[each][
-                                'resource_version']:
-                        # print(
-                        #     f"origin_need_update! {get_revision_schema.origin_config[each]['replace_form']['metadata']['name']} to "
-                        #     f"{origin_pool[each]['resource_version']}")
-                        is_origin_latest_in_xc = True
-                        continue
-                # if origin_pool != current_origin_list:
-                #     is_origin_latest_in_xc = True
-            else:
-                is_origin_latest_in_xc = True
-        # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
-        # print(
-        #     f"app: {__xc_app_name_no_env__}:{environment}, update-lb: {is_lb_latest_in_xc}, update-waf: {is_waf_latest_in_xc}, update_origin: {is_origin_latest_in_xc}")
-        sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
-        if sum_update == 0:
-            continue
-        # Start changing database from here
-        # Update LB
-        if is_lb_latest_in_xc:
-            # print(f"{get_version_schema.app_name} LB requires update")
-            lb_value = get_app_data
-        # If LB is not updated, the db will copy the old one.
-        else:
-            lb_value = get_revision_schema.lb_config
-        # Update Origin
-        if is_origin_latest_in_xc:
-            origin_value = origin_pool
-        # If Origin is not updated, the db will copy the old one.
-        else:
-            origin_value = get_revision_schema.origin_config
-        # Update WAF
-        if is_waf_latest_in_xc:
-            waf_value = firewall
-            exist_dict['waf_resource_version'] = firewall['resource_version']
-        else:
-            waf_value = get_revision_schema.waf_config
-            if 'resource_version' in get_revision_schema.waf_config:
-                exist_dict['waf_resource_version'] = get_revision_schema.waf_config['resource_version']
-            else:
-                exist_dict['waf_resource_version'] = 0
-            # exist_dict['waf_resource_version'] = get_revision_schema.waf_config['resource_version']
-        with Session(engine) as session:
-            stmt = select(q1).where(
-                q1.app_name == __xc_app_name_no_env__).order_by(q1.version.desc())
-            get_ver = session.exec(stmt).first()
-            # print(f"{__xc_app_name_no_env__} highest version: {get_ver.version}")
-            if not get_ver:
-                print("Get_ver missing???")
-
-        exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.app_name,
-                                         environment=environment,
-                                         highest_version=get_version_schema.current_version, timestamp=timestamp)
-        exist_dict['app_name'] = get_version_schema.app_name
-        exist_dict['version'] = get_ver.version + 1
-        exist_dict['timestamp'] = timestamp
-        exist_dict['previous_version'] = get_version_schema.current_version
-        exist_dict['original_app_name'] = get_app_data['replace_form']['metadata']['name']
-        exist_dict['generated_by'] = username  # todo: update to get the current user
-        exist_dict['lb_config'] = lb_value
-        exist_dict['waf_config'] = waf_value
-        exist_dict['origin_config'] = origin_value
-        exist_dict['ddos_config'] = {}
-        exist_dict['bot_config'] = {}
-        exist_list.append(exist_dict)
-    # todo: add previous version
+        with fetch_lb_span(lb_types.http, environment, exist, is_new=False):
+            exist_dict = exist_http_lb_revision(namespace=namespace, environment=environment, lb_name=exist,
+                                                username=username, timestamp=timestamp, references=references)
+        if exist_dict:
+            exist_list.append(exist_dict)
+        if progress:
+            progress.advance(lb_types.http, environment, exist)
+    refresh_dependency_index(lb_types.http, each_lb_name_xc, references)
     return new_list, exist_list
 
 
-def get_tcp_lb_data(namespace: str, environment: str, tcp_lb_list: list, username: str = "autogenerated"):
+def new_tcp_lb_revision(namespace: str, environment: str, lb_name: str, username: str, timestamp: int,
+                        references: list | None = None) -> dict:
+    """
+    Gets a new TCP LB from XC, along with its Origin Pools, as the first revision.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the TCP Load Balancer
+    :param lb_name: Name of the TCP Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database
+    """
+    app_dict = {}
+    get_app_data = _get_tcp_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data["replace_form"]
+    if references is not None:
+        references.extend(lb_references(lb_types.tcp, environment, app_data))
+    logger.debug("%s data: %s", lb_name, app_data)
+    app_dict['uid'] = generate_uid(uid_type='rev', app_name=app_data['metadata']['name'],
+                                   environment=environment,
+                                   highest_version=0, timestamp=timestamp)
+    app_dict['timestamp'] = timestamp
+    app_dict['original_tcp_lb_name'] = get_app_data['replace_form']['metadata']['name']
+    app_dict['generated_by'] = username  # todo: get the username
+    app_dict['timestamp'] = timestamp
+    app_dict['version'] = 1
+    app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    app_dict['lb_config'] = get_app_data
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists
+    if 'origin_pools_weights' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['origin_pools_weights']:
+            for _pool in app_data['spec']['origin_pools_weights']:
+                __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+    app_dict['origin_config'] = origin_pool
+    __xc_name_no_env__: str = ((app_data['metadata']['name'])
+                               .replace('-staging', '').replace('-production', ''))
+    app_dict['tcp_lb_name'] = __xc_name_no_env__
+    app_dict['remarks'] = "System-generated"
+    return app_dict
+
+
+def exist_tcp_lb_revision(namespace: str, environment: str, lb_name: str, username: str,
+                          timestamp: int, references: list | None = None) -> dict | None:
+    """
+    Gets an existing TCP LB from XC and compares it with the current revision in the database.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the TCP Load Balancer
+    :param lb_name: Name of the TCP Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database, or None if nothing has changed
+    """
+    if environment == "staging":
+        q1 = TcpLbStagingRevSchema
+    else:
+        q1 = TcpLbProductionRevSchema
+    exist_dict = {}
+    get_app_data = _get_tcp_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data['replace_form']
+    if references is not None:
+        references.extend(lb_references(lb_types.tcp, environment, app_data))
+    exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists to prevent errors
+    if 'origin_pools_weights' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['origin_pools_weights']:
+            for _pool in app_data['spec']['origin_pools_weights']:
+                __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+    __xc_app_name_no_env__ = lb_name.replace("-staging", '').replace("-production", '')
+
+    # Get current version from app
+    with Session(engine) as session:
+        get_version_schema = session.exec(
+            select(TcpLbVersionSchema).where(
+                TcpLbVersionSchema.tcp_lb_name == __xc_app_name_no_env__).where(
+                TcpLbVersionSchema.environment == environment)).first()
+        logger.debug("Version of %s: %s", __xc_app_name_no_env__, get_version_schema)
+        # Get configuration from revisions by specific version
+        get_revision_schema = session.exec(select(q1).where(q1.tcp_lb_name == __xc_app_name_no_env__).where(
+            q1.version == get_version_schema.current_version)).first()
+        logger.debug("Current revision of %s: %s", __xc_app_name_no_env__, get_revision_schema)
+        if not get_revision_schema:
+            logger.warning("%s on %s has no revision for its current version", __xc_app_name_no_env__,
+                           environment)
+            return None
+
+    lb_resource_ver = 0
+    if get_revision_schema.lb_resource_version:
+        lb_resource_ver = get_revision_schema.lb_resource_version
+    logger.debug("Current version: %s, LB resource version: %s", get_version_schema.current_version, lb_resource_ver)
+    is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
+    # TCP LB doesn't have an App Firewall
+    is_waf_latest_in_xc = False
+    # Check if Origin Pool is the latest
+    is_origin_latest_in_xc = is_origin_updated(get_revision_schema.origin_config, origin_pool)
+    # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
+    logger.debug("app: %s:%s, update-lb: %s, update-waf: %s, update_origin: %s", __xc_app_name_no_env__, environment,
+                 is_lb_latest_in_xc, is_waf_latest_in_xc, is_origin_latest_in_xc)
+    sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
+    if sum_update == 0:
+        return None
+    # Start changing database from here
+    # Update LB
+    if is_lb_latest_in_xc:
+        logger.debug("%s LB requires update", get_version_schema.tcp_lb_name)
+        lb_value = get_app_data
+    # If LB is not updated, the db will copy the old one.
+    else:
+        lb_value = get_revision_schema.lb_config
+    # Update Origin
+    if is_origin_latest_in_xc:
+        origin_value = origin_pool
+    # If Origin is not updated, the db will copy the old one.
+    else:
+        origin_value = get_revision_schema.origin_config
+    # Get the highest version number
+    with Session(engine) as session:
+        stmt = select(q1).where(
+            q1.tcp_lb_name == __xc_app_name_no_env__).order_by(q1.version.desc())
+        get_ver = session.exec(stmt).first()
+        logger.debug("%s highest version: %s", __xc_app_name_no_env__, get_ver.version)
+
+    exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.tcp_lb_name,
+                                     environment=environment,
+                                     highest_version=get_version_schema.current_version,
+                                     timestamp=timestamp)
+    exist_dict['tcp_lb_name'] = get_version_schema.tcp_lb_name
+    exist_dict['version'] = get_ver.version + 1
+    exist_dict['previous_version'] = get_version_schema.current_version
+    exist_dict['timestamp'] = timestamp
+    exist_dict['original_tcp_lb_name'] = get_app_data['replace_form']['metadata']['name']
+    exist_dict['generated_by'] = username  # todo: update to get the current user
+    exist_dict['lb_config'] = lb_value
+    exist_dict['origin_config'] = origin_value
+    exist_dict['remarks'] = "System-generated"
+    return exist_dict
+
+
+def get_tcp_lb_data(namespace: str, environment: str, tcp_lb_list: dict, username: str = "autogenerated",
+                    progress=None):
     """
         Gets the TCP LB data from XC to be stored to the database.
         :param username: Username of the requester. Defaults to autogenerated.
         :param namespace: Namespace of the XC
         :param environment: Environment of the HTTP Load Balancer
         :param tcp_lb_list: List of HTTP Load Balancers name to retrieve from XC.
+        :param progress: (Optional) SnapshotProgress, notified for each LB retrieved from XC.
         :return: List of new HTTP LB and list of existing HTTP LB to be updated.
         """
     timestamp = int(round(time.time()))
-    each_lb_name_xc = []
     # Get all LB Name from the list
-    for each in tcp_lb_list['items']:
-        app_name: str = each['name']
-        match environment:
-            case "staging":
-                if app_name.endswith('-staging'):
-                    each_lb_name_xc.append(app_name)
-            case "production":
-                if app_name.endswith('-staging') is False:
-                    each_lb_name_xc.append(app_name)
-    # Get all data in SQL data according to environment
-    with Session(engine) as session:
-        if environment == "staging":
-            q1 = TcpLbStagingRevSchema
-        else:
-            q1 = TcpLbProductionRevSchema
-        sql = session.exec(select(q1).order_by(q1.version.desc())).all()
-    # Get only the names from SQL data
-    query_lb_name = []
-    if sql:
-        for _sql in sql:
-            query_lb_name.append(_sql.tcp_lb_name)
-    # Check if LB exists in SQL data
-    new_lb, exist_lb = [], []
-    for each in each_lb_name_xc:
-        name = each.replace('-staging', '').replace('-production', '')
-        if name not in query_lb_name:
-            new_lb.append(each)
-        else:
-            exist_lb.append(each)
-        # Query XC to get the new data
+    each_lb_name_xc = filter_lb_names(tcp_lb_list, environment)
+    # Check if LB exists in SQL data according to environment
+    if environment == "staging":
+        q1 = TcpLbStagingRevSchema
+    else:
+        q1 = TcpLbProductionRevSchema
+    new_lb, exist_lb = partition_lb_names(q1.tcp_lb_name, each_lb_name_xc)
+    if progress:
+        progress.start(lb_types.tcp, environment, len(each_lb_name_xc))
+    # Query XC to get the new data
+    references = []
     new_list = []
-    if new_lb:
-        for new in new_lb:
-            app_dict = {}
-            # print(f"tcp lb app name to get: {new}")
-            get_app_data = _get_tcp_lb(namespace=namespace, app_name=new)
-            app_data = get_app_data["replace_form"]
-            print(f"{new} data: {app_data}")
-            app_dict['uid'] = generate_uid(uid_type='rev', app_name=app_data['metadata']['name'],
-                                           environment=environment,
-                                           highest_version=0, timestamp=timestamp)
-            app_dict['timestamp'] = timestamp
-            app_dict['original_tcp_lb_name'] = get_app_data['replace_form']['metadata']['name']
-            app_dict['generated_by'] = username  # todo: get the username
-            app_dict['timestamp'] = timestamp
-            app_dict['version'] = 1
-            app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-            app_dict['lb_config'] = get_app_data
-            # Get Origin Pools from App Data
-            origin_pool = []
-            # Check if Origin Pool exists
-            if 'origin_pools_weights' in app_data['spec']:
-                # Check if it has anything. Just in case.
-                if app_data['spec']['origin_pools_weights']:
-                    for _pool in app_data['spec']['origin_pools_weights']:
-                        __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
-                        origin_pool.append(__origin__)
-            app_dict['origin_config'] = origin_pool
-            __xc_name_no_env__: str = ((app_data['metadata']['name'])
-                                       .replace('-staging', '').replace('-production', ''))
-            app_dict['tcp_lb_name'] = __xc_name_no_env__
-            app_dict['remarks'] = "System-generated"
-            new_list.append(app_dict)
+    for new in new_lb:
+        with fetch_lb_span(lb_types.tcp, environment, new, is_new=True):
+            new_list.append(new_tcp_lb_revision(namespace=namespace, environment=environment, lb_name=new,
+                                                username=username, timestamp=timestamp, references=references))
+        if progress:
+            progress.advance(lb_types.tcp, environment, new)
     exist_list = []
-    if exist_lb:
-        for exist in exist_lb:
-            exist_dict = {}
-            get_app_data = _get_tcp_lb(namespace=namespace, app_name=exist)
-            app_data = get_app_data['replace_form']
-            exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-            # Default values that will later be replaced if they exist
-            # Get Origin Pools from App Data
-            origin_pool = []
-            # Check if Origin Pool exists to prevent errors
-            if 'origin_pools_weights' in app_data['spec']:
-                # Check if it has anything. Just in case.
-                if app_data['spec']['origin_pools_weights']:
-                    for _pool in app_data['spec']['origin_pools_weights']:
-                        __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
-                        origin_pool.append(__origin__)
-            __xc_app_name_no_env__ = exist.replace("-staging", '').replace("-production", '')
-            __xc_environment__ = "production"
-            if exist.endswith('-staging'):
-                __xc_environment__ = "staging"
-
-            # Get current version from app
-            with Session(engine) as session:
-                get_version_schema = session.exec(
-                    select(TcpLbVersionSchema).where(
-                        TcpLbVersionSchema.tcp_lb_name == __xc_app_name_no_env__).where(
-                        TcpLbVersionSchema.environment == environment)).first()
-                print(f"tb_ver: {get_version_schema}")
-                # Get configuration from revisions by specific version
-                get_revision_schema = session.exec(select(q1).where(q1.tcp_lb_name == __xc_app_name_no_env__).where(
-                    q1.version == get_version_schema.current_version)).first()
-                print(get_revision_schema)
-                if not get_revision_schema:
-                    print(f"{__xc_app_name_no_env__} missing?")
-                    continue
-
-            lb_resource_ver = 0
-            if get_revision_schema.lb_resource_version:
-                lb_resource_ver = get_revision_schema.lb_resource_version
-            print(
-                f"Current version: {get_version_schema.current_version}, LB resource version: {lb_resource_ver}")
-            is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
-            # Check if App Firewall is the latest
-            is_waf_latest_in_xc = False
-            # Check if Origin Pool is the latest
-            is_origin_latest_in_xc = False
-            # Check if origin pool is empty first
-            if origin_pool:
-                if get_revision_schema.origin_config:
-                    print(origin_pool)
-                    current_origin_list = {i['resource_version']: i for i in get_revision_schema.origin_config}
-                    j: int
-                    if len(origin_pool) > len(current_origin_list):
-                        j = len(origin_pool)
-                    else:
-                        j = len(current_origin_list)
-                    for each in range(j):
-                        print(f"current_origin_list: {origin_pool[each]}")
-                        if get_revision_schema.origin_config[each]['replace_form']['metadata']['name'] == \
-                                origin_pool[each]['replace_form']['metadata'][
-                                    'name'] and get_revision_schema.origin_config[each]['resource_version'] < \
-                                origin_pool[each][
-                                    'resource_version']:
-                            print(
-                                f"origin_need_update! {get_revision_schema.origin_config[each]['replace_form']['metadata']['name']} to "
-                                f"{origin_pool[each]['resource_version']}")
-                            is_origin_latest_in_xc = True
-                            continue
-                    # if origin_pool != current_origin_list:
-                    #     is_origin_latest_in_xc = True
-                else:
-                    is_origin_latest_in_xc = True
-            # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
-            print(
-                f"app: {__xc_app_name_no_env__}:{environment}, update-lb: {is_lb_latest_in_xc}, update-waf: {is_waf_latest_in_xc}, update_origin: {is_origin_latest_in_xc}")
-            sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
-            if sum_update == 0:
-                continue
-            # Start changing database from here
-            # Update LB
-            if is_lb_latest_in_xc:
-                print(f"{get_version_schema.app_name} LB requires update")
-                lb_value = get_app_data
-            # If LB is not updated, the db will copy the old one.
-            else:
-                lb_value = get_revision_schema.lb_config
-            # Update Origin
-            if is_origin_latest_in_xc:
-                origin_value = origin_pool
-            # If Origin is not updated, the db will copy the old one.
-            else:
-                origin_value = get_revision_schema.origin_config
-            # Get the highest version number
-            with Session(engine) as session:
-                stmt = select(q1).where(
-                    q1.tcp_lb_name == __xc_app_name_no_env__).order_by(q1.version.desc())
-                get_ver = session.exec(stmt).first()
-                print(f"{__xc_app_name_no_env__} highest version: {get_ver.version}")
-                if not get_ver:
-                    print("Get_ver missing???")
-
-            exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.tcp_lb_name,
-                                             environment=environment,
-                                             highest_version=get_version_schema.current_version,
-                                             timestamp=timestamp)
-            exist_dict['tcp_lb_name'] = get_version_schema.tcp_lb_name
-            exist_dict['version'] = get_ver.version + 1
-            exist_dict['previous_version'] = get_version_schema
-            exist_dict['timestamp'] = timestamp
-            exist_dict['original_tcp_lb_name'] = get_app_data['replace_form']['metadata']['name']
-            exist_dict['generated_by'] = username  # todo: update to get the current user
-            exist_dict['lb_config'] = lb_value
-            exist_dict['origin_config'] = origin_value
-            exist_dict['remarks'] = "System-generated"
+    for exist in exist_lb:
+        with fetch_lb_span(lb_types.tcp, environment, exist, is_new=False):
+            exist_dict = exist_tcp_lb_revision(namespace=namespace, environment=environment, lb_name=exist,
+                                               username=username, timestamp=timestamp, references=references)
+        if exist_dict:
             exist_list.append(exist_dict)
+        if progress:
+            progress.advance(lb_types.tcp, environment, exist)
+    refresh_dependency_index(lb_types.tcp, each_lb_name_xc, references)
     return new_list, exist_list
 
 
-def get_cdn_lb_data(namespace: str, environment: str, cdn_lb_list: list, username: str = "autogenerated"):
+def new_cdn_lb_revision(namespace: str, environment: str, lb_name: str, username: str, timestamp: int,
+                        references: list | None = None) -> dict:
+    """
+    Gets a new CDN LB from XC, along with its Origin Pools and App Firewall, as the first revision.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the CDN Load Balancer
+    :param lb_name: Name of the CDN Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database
+    """
+    app_dict = {}
+    get_app_data = _get_cdn_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data["replace_form"]
+    if references is not None:
+        references.extend(lb_references(lb_types.cdn, environment, app_data))
+    __xc_name_no_env__: str = (app_data['metadata']['name']).replace('-staging', '').replace('-production', '')
+    logger.debug("cdn xc name: %s", __xc_name_no_env__)
+    app_dict['uid'] = generate_uid(uid_type='rev', app_name=__xc_name_no_env__,
+                                   environment=environment,
+                                   highest_version=0, timestamp=timestamp)
+    app_dict['timestamp'] = timestamp
+    app_dict['cdn_lb_name'] = __xc_name_no_env__
+    app_dict['original_cdn_lb_name'] = app_data['metadata']['name']
+    app_dict['generated_by'] = username  # todo: get the username
+    app_dict['timestamp'] = timestamp
+    app_dict['version'] = 1
+    app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    # Default values that will later be replaced if they exist
+    app_dict['waf_resource_version'] = 0
+    app_dict['lb_config'] = get_app_data
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists
+    if 'default_route_pools' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['default_route_pools']:
+            for _pool in app_data['spec']['default_route_pools']:
+                __origin__ = _get_origin_pool(namespace=namespace,
+                                              origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+                app_dict['origin_resource_version'] = __origin__['resource_version']
+    app_dict['origin_config'] = origin_pool
+    app_dict['remarks'] = "System-generated"
+    firewall = {}
+    # If WAF isn't set up, it won't show up on JSON, so we have to check it
+    if 'app_firewall' in app_data['spec']:
+        firewall = get_app_firewall(namespace=namespace,
+                                    firewall_name=app_data['spec']['app_firewall']['name'])
+        app_dict['waf_resource_version'] = firewall['resource_version']
+    app_dict['waf_config'] = firewall
+    return app_dict
+
+
+def exist_cdn_lb_revision(namespace: str, environment: str, lb_name: str, username: str,
+                          timestamp: int, references: list | None = None) -> dict | None:
+    """
+    Gets an existing CDN LB from XC and compares it with the current revision in the database.
+    :param namespace: Namespace of the XC
+    :param environment: Environment of the CDN Load Balancer
+    :param lb_name: Name of the CDN Load Balancer in XC
+    :param username: Username of the requester
+    :param timestamp: Timestamp of the snapshot
+    :param references: If given, the Origin Pools and App Firewall referenced by the LB are added here
+    :return: Revision data to be inserted to the database, or None if nothing has changed
+    """
+    if environment == "staging":
+        q1 = CDNLBStagingRevSchema
+    else:
+        q1 = CDNLBProductionRevSchema
+    exist_dict = {}
+    get_app_data = _get_cdn_lb(namespace=namespace, app_name=lb_name)
+    app_data = get_app_data['replace_form']
+    if references is not None:
+        references.extend(lb_references(lb_types.cdn, environment, app_data))
+    exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
+    exist_dict['waf_resource_version'] = 0
+    # Get Origin Pools from App Data
+    origin_pool = []
+    # Check if Origin Pool exists to prevent errors
+    if 'default_route_pools' in app_data['spec']:
+        # Check if it has anything. Just in case.
+        if app_data['spec']['default_route_pools']:
+            for _pool in app_data['spec']['default_route_pools']:
+                __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
+                origin_pool.append(__origin__)
+    # Get Application Firewall from App Data
+    firewall = {}
+    # If WAF isn't set up, it won't show up on JSON, so we have to check it
+    if 'app_firewall' in app_data['spec']:
+        firewall = get_app_firewall(namespace=namespace,
+                                    firewall_name=app_data['spec']['app_firewall']['name'])
+    __xc_app_name_no_env__ = lb_name.replace("-staging", '').replace("-production", '')
+
+    # Get current version from app
+    with Session(engine) as session:
+        get_version_schema = session.exec(
+            select(CDNLBVersionSchema).where(CDNLBVersionSchema.cdn_lb_name == __xc_app_name_no_env__).where(
+                CDNLBVersionSchema.environment == environment)).first()
+        logger.debug("Version of %s: %s", __xc_app_name_no_env__, get_version_schema)
+        # Get configuration from revisions by specific version
+        get_revision_schema = session.exec(select(q1).where(q1.cdn_lb_name == __xc_app_name_no_env__).where(
+            q1.version == get_version_schema.current_version)).first()
+        logger.debug("Current revision of %s: %s", __xc_app_name_no_env__, get_revision_schema)
+        if not get_revision_schema:
+            logger.warning("%s on %s has no revision for its current version", __xc_app_name_no_env__,
+                           environment)
+            return None
+    lb_resource_ver = 0
+    if get_revision_schema.lb_resource_version:
+        lb_resource_ver = get_revision_schema.lb_resource_version
+    logger.debug("Current version: %s, LB resource version: %s", get_version_schema.current_version, lb_resource_ver)
+    is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
+    # Check if App Firewall is the latest
+    is_waf_latest_in_xc = False
+    if firewall:
+        is_waf_latest_in_xc = get_revision_schema.waf_resource_version < int(firewall['resource_version'])
+    # Check if Origin Pool is the latest
+    is_origin_latest_in_xc = is_origin_updated(get_revision_schema.origin_config, origin_pool)
+    # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
+    logger.debug("app: %s:%s, update-lb: %s, update-waf: %s, update_origin: %s", __xc_app_name_no_env__, environment,
+                 is_lb_latest_in_xc, is_waf_latest_in_xc, is_origin_latest_in_xc)
+    sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
+    if sum_update == 0:
+        return None
+    # Start changing database from here
+    # Update LB
+    if is_lb_latest_in_xc:
+        logger.debug("%s LB requires update", get_version_schema.cdn_lb_name)
+        lb_value = get_app_data
+    # If LB is not updated, the db will copy the old one.
+    else:
+        lb_value = get_revision_schema.lb_config
+    # Update Origin
+    if is_origin_latest_in_xc:
+        origin_value = origin_pool
+    # If Origin is not updated, the db will copy the old one.
+    else:
+        origin_value = get_revision_schema.origin_config
+    # Update WAF
+    if is_waf_latest_in_xc:
+        waf_value = firewall
+        exist_dict['waf_resource_version'] = firewall['resource_version']
+    else:
+        waf_value = get_revision_schema.waf_config
+        exist_dict['waf_resource_version'] = get_revision_schema.waf_config.get('resource_version', 0)
+    with Session(engine) as session:
+        stmt = select(q1).where(
+            q1.cdn_lb_name == __xc_app_name_no_env__).order_by(q1.version.desc())
+        get_ver = session.exec(stmt).first()
+        logger.debug("%s highest version: %s", __xc_app_name_no_env__, get_ver.version)
+
+    exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.cdn_lb_name,
+                                     environment=environment,
+                                     highest_version=get_version_schema.current_version,
+                                     timestamp=timestamp)
+    exist_dict['cdn_lb_name'] = get_version_schema.cdn_lb_name
+    exist_dict['version'] = get_ver.version + 1
+    exist_dict['timestamp'] = timestamp
+    exist_dict['previous_version'] = get_version_schema.current_version
+    exist_dict['original_cdn_lb_name'] = get_app_data['replace_form']['metadata']['name']
+    exist_dict['generated_by'] = username  # todo: update to get the current user
+    exist_dict['lb_config'] = lb_value
+    exist_dict['waf_config'] = waf_value
+    exist_dict['origin_config'] = origin_value
+    exist_dict['ddos_config'] = {}
+    exist_dict['bot_config'] = {}
+    return exist_dict
+
+
+def get_cdn_lb_data(namespace: str, environment: str, cdn_lb_list: dict, username: str = "autogenerated",
+                    progress=None):
     """
         Gets the CDN LB data from XC to be stored to the database.
         :param username: Username of the requester. Defaults to autogenerated.
         :param namespace: Namespace of the XC
         :param environment: Environment of the HTTP Load Balancer
         :param cdn_lb_list: List of HTTP Load Balancers name to retrieve from XC.
+        :param progress: (Optional) SnapshotProgress, notified for each LB retrieved from XC.
         :return: List of new HTTP LB and list of existing HTTP LB to be updated.
         todo: CDN doesn't have a separate Origin Pool. Erase when able
         todo: Health check should also be stored somewhere.
         """
     timestamp = int(round(time.time()))
-    each_lb_name_xc = []
     # Get all LB Name from the list
-    for each in cdn_lb_list['items']:
-        app_name: str = each['name']
-        match environment:
-            case "staging":
-                if app_name.endswith('-staging'):
-                    each_lb_name_xc.append(app_name)
-            case "production":
-                if app_name.endswith('-staging') is False:
-                    each_lb_name_xc.append(app_name)
-    # Get all data in SQL data according to environment
-    with Session(engine) as session:
-        if environment == "staging":
-            q1 = CDNLBStagingRevSchema
-        else:
-            q1 = CDNLBProductionRevSchema
-        sql = session.exec(select(q1).order_by(q1.version.desc())).all()
-    # Get only the names from SQL data
-    query_lb_name = []
-    if sql:
-        for _sql in sql:
-            query_lb_name.append(_sql.cdn_lb_name)
-    # Check if LB exists in SQL data
-    new_lb, exist_lb = [], []
-    for each in each_lb_name_xc:
-        name = each.replace('-staging', '').replace('-production', '')
-        if name not in query_lb_name:
-            new_lb.append(each)
-        else:
-            exist_lb.append(each)
+    each_lb_name_xc = filter_lb_names(cdn_lb_list, environment)
+    # Check if LB exists in SQL data according to environment
+    if environment == "staging":
+        q1 = CDNLBStagingRevSchema
+    else:
+        q1 = CDNLBProductionRevSchema
+    new_lb, exist_lb = partition_lb_names(q1.cdn_lb_name, each_lb_name_xc)
+    if progress:
+        progress.start(lb_types.cdn, environment, len(each_lb_name_xc))
     # Query XC to get the new data
+    references = []
     new_list = []
-    if new_lb:
-        for new in new_lb:
-            app_dict = {}
-            get_app_data = _get_cdn_lb(namespace=namespace, app_name=new)
-            app_data = get_app_data["replace_form"]
-            __xc_name_no_env__: str = (app_data['metadata']['name']).replace('-staging', '').replace('-production', '')
-            print(f"cdn xc name: {__xc_name_no_env__}")
-            app_dict['uid'] = generate_uid(uid_type='rev', app_name=__xc_name_no_env__,
-                                           environment=environment,
-                                           highest_version=0, timestamp=timestamp)
-            app_dict['timestamp'] = timestamp
-            app_dict['cdn_lb_name'] = __xc_name_no_env__
-            app_dict['original_cdn_lb_name'] = app_data['metadata']['name']
-            app_dict['generated_by'] = username  # todo: get the username
-            app_dict['timestamp'] = timestamp
-            app_dict['version'] = 1
-            app_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-            # Default values that will later be replaced if they exist
-
-            app_dict['lb_config'] = get_app_data
-            # Get Origin Pools from App Data
-            origin_pool = []
-            # Check if Origin Pool exists
-            if 'default_route_pools' in app_data['spec']:
-                # Check if it has anything. Just in case.
-                if app_data['spec']['default_route_pools']:
-                    for _pool in app_data['spec']['default_route_pools']:
-                        __origin__ = _get_origin_pool(namespace=namespace,
-                                                      origin_pool_name=_pool['pool']['name'])
-                        origin_pool.append(__origin__)
-                        app_dict['origin_resource_version'] = __origin__['resource_version']
-            app_dict['origin_config'] = origin_pool
-            __xc_name_no_env__: str = ((app_data['metadata']['name'])
-                                       .replace('-staging', '').replace('-production', ''))
-            app_dict['remarks'] = "System-generated"
-            firewall = {}
-            # If WAF isn't set up, it won't show up on JSON, so we have to check it
-            if 'app_firewall' in app_data['spec']:
-                firewall = get_app_firewall(namespace=namespace,
-                                            firewall_name=app_data['spec']['app_firewall']['name'])
-                app_dict['waf_resource_version'] = firewall['resource_version']
-            app_dict['waf_config'] = firewall
-            new_list.append(app_dict)
+    for new in new_lb:
+        with fetch_lb_span(lb_types.cdn, environment, new, is_new=True):
+            new_list.append(new_cdn_lb_revision(namespace=namespace, environment=environment, lb_name=new,
+                                                username=username, timestamp=timestamp, references=references))
+        if progress:
+            progress.advance(lb_types.cdn, environment, new)
     exist_list = []
     for exist in exist_lb:
-        exist_dict = {}
-        get_app_data = _get_cdn_lb(namespace=namespace, app_name=exist)
-        app_data = get_app_data['replace_form']
-        exist_dict['lb_resource_version'] = int(get_app_data['resource_version'])
-        exist_dict['waf_resource_version'] = 0
-        # Get Origin Pools from App Data
-        origin_pool = []
-        # Check if Origin Pool exists to prevent errors
-        if 'default_route_pools' in app_data['spec']:
-            # Check if it has anything. Just in case.
-            if app_data['spec']['default_route_pools']:
-                for _pool in app_data['spec']['default_route_pools']:
-                    __origin__ = _get_origin_pool(namespace=namespace, origin_pool_name=_pool['pool']['name'])
-                    origin_pool.append(__origin__)
-        # Get Application Firewall from App Data
-        firewall = {}
-        # If WAF isn't set up, it won't show up on JSON, so we have to check it
-        if 'app_firewall' in app_data['spec']:
-            firewall = get_app_firewall(namespace=namespace,
-                                        firewall_name=app_data['spec']['app_firewall']['name'])
-        __xc_app_name_no_env__ = exist.replace("-staging", '').replace("-production", '')
-        __xc_environment__ = "production"
-        if exist.endswith('-staging'):
-            __xc_environment__ = "staging"
-
-        # Get current version from app
-        with Session(engine) as session:
-            get_version_schema = session.exec(
-                select(CDNLBVersionSchema).where(CDNLBVersionSchema.cdn_lb_name == __xc_app_name_no_env__).where(
-                    CDNLBVersionSchema.environment == environment)).first()
-            print(f"tb_ver: {get_version_schema}")
-            # Get configuration from revisions by specific version
-            get_revision_schema = session.exec(select(q1).where(q1.cdn_lb_name == __xc_app_name_no_env__).where(
-                q1.version == get_version_schema.current_version)).first()
-            print(get_revision_schema)
-            if not get_revision_schema:
-                print(f"{__xc_app_name_no_env__} missing?")
-                continue
-        lb_resource_ver = 0
-        if get_revision_schema.lb_resource_version:
-            lb_resource_ver = get_revision_schema.lb_resource_version
-        print(
-            f"Current version: {get_version_schema.current_version}, LB resource version: {lb_resource_ver}")
-        is_lb_latest_in_xc = get_revision_schema.lb_resource_version < int(get_app_data['resource_version'])
-        # Check if App Firewall is the latest
-        is_waf_latest_in_xc = False
-        if firewall:
-            is_waf_latest_in_xc = get_revision_schema.waf_resource_version < int(firewall['resource_version'])
-        # Check if Origin Pool is the latest
-        is_origin_latest_in_xc = False
-        # Check if origin pool is empty first
-        if origin_pool:
-            if get_revision_schema.origin_config:
-                print(origin_pool)
-                current_origin_list = {i['resource_version']: i for i in get_revision_schema.origin_config}
-                j: int
-                if len(origin_pool) > len(current_origin_list):
-                    j = len(origin_pool)
-                else:
-                    j = len(current_origin_list)
-                for each in range(j):
-                    print(f"current_origin_list: {origin_pool[each]}")
-                    if get_revision_schema.origin_config[each]['replace_form']['metadata']['name'] == \
-                            origin_pool[each]['replace_form']['metadata'][
-                                'name'] and get_revision_schema.origin_config[each]['resource_version'] < \
-                            origin_pool[each][
-                                'resource_version']:
-                        print(
-                            f"origin_need_update! {get_revision_schema.origin_config[each]['replace_form']['metadata']['name']} to "
-                            f"{origin_pool[each]['resource_version']}")
-                        is_origin_latest_in_xc = True
-                        continue
-                # if origin_pool != current_origin_list:
-                #     is_origin_latest_in_xc = True
-            else:
-                is_origin_latest_in_xc = True
-        # These bool are being summed to check if any is True, and if none of them is being updated, they'll be skipped
-        print(
-            f"app: {__xc_app_name_no_env__}:{environment}, update-lb: {is_lb_latest_in_xc}, update-waf: {is_waf_latest_in_xc}, update_origin: {is_origin_latest_in_xc}")
-        sum_update = is_lb_latest_in_xc + is_waf_latest_in_xc + is_origin_latest_in_xc
-        if sum_update == 0:
-            continue
-        # Start changing database from here
-        # Update LB
-        if is_lb_latest_in_xc:
-            print(f"{get_version_schema.cdn_lb_name} LB requires update")
-            lb_value = get_app_data
-        # If LB is not updated, the db will copy the old one.
-        else:
-            lb_value = get_revision_schema.lb_config
-        # Update Origin
-        if is_origin_latest_in_xc:
-            origin_value = origin_pool
-        # If Origin is not updated, the db will copy the old one.
-        else:
-            origin_value = get_revision_schema.origin_config
-        # Update WAF
-        if is_waf_latest_in_xc:
-            waf_value = firewall
-            exist_dict['waf_resource_version'] = firewall['resource_version']
-        else:
-            waf_value = get_revision_schema.waf_config
-            exist_dict['waf_resource_version'] = get_revision_schema.waf_config['resource_version']
-        with Session(engine) as session:
-            stmt = select(q1).where(
-                q1.cdn_lb_name == __xc_app_name_no_env__).order_by(q1.version.desc())
-            get_ver = session.exec(stmt).first()
-            print(f"{__xc_app_name_no_env__} highest version: {get_ver.version}")
-            if not get_ver:
-                print("Get_ver missing???")
-
-        exist_dict['uid'] = generate_uid(uid_type='rev', app_name=get_version_schema.cdn_lb_name,
-                                         environment=environment,
-                                         highest_version=get_version_schema.current_version,
-                                         timestamp=timestamp)
-        exist_dict['cdn_lb_name'] = get_version_schema.cdn_lb_name
-        exist_dict['version'] = get_ver.version + 1
-        exist_dict['timestamp'] = timestamp
-        exist_dict['previous_version'] = get_version_schema.current_version
-        exist_dict['original_cdn_lb_name'] = get_app_data['replace_form']['metadata']['name']
-        exist_dict['generated_by'] = username  # todo: update to get the current user
-        exist_dict['lb_config'] = lb_value
-        exist_dict['waf_config'] = waf_value
-        exist_dict['origin_config'] = origin_value
-        exist_dict['ddos_config'] = {}
-        exist_dict['bot_config'] = {}
-        exist_list.append(exist_dict)
+        with fetch_lb_span(lb_types.cdn, environment, exist, is_new=False):
+            exist_dict = exist_cdn_lb_revision(namespace=namespace, environment=environment, lb_name=exist,
+                                               username=username, timestamp=timestamp, references=references)
+        if exist_dict:
+            exist_list.append(exist_dict)
+        if progress:
+            progress.advance(lb_types.cdn, environment, exist)
+    refresh_dependency_index(lb_types.cdn, each_lb_name_xc, references)
     return new_list, exist_list
 
 
 def get_app_firewall(namespace: str, firewall_name: str):
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace}/app_firewalls/{firewall_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_parameters = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, headers=headers, params=query_parameters)
-    if req.status_code > 200:
-        return HTTPException(status_code=req.status_code, detail=req.json())
-    return req.json()
+    req = xc_request("GET", address, params=query_parameters)
+    return raise_for_xc_status(req).json()
 
 
 def _get_origin_pool(namespace: str, origin_pool_name: str):
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace}/origin_pools/{origin_pool_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_parameters = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, headers=headers, params=query_parameters)
-    if req.status_code > 200:
-        return HTTPException(status_code=req.status_code, detail=req.json())
-    return req.json()
+    req = xc_request("GET", address, params=query_parameters)
+    return raise_for_xc_status(req).json()
 
 
 def _get_http_lb(namespace: str, app_name: str):
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace}/http_loadbalancers/{app_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_request("GET", address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def _get_tcp_lb(namespace: str, app_name: str):
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace}/tcp_loadbalancers/{app_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_request("GET", address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def _get_cdn_lb(namespace: str, app_name: str):
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace}/cdn_loadbalancers/{app_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_request("GET", address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def xc_put_http_load_balancers(load_balancer_name: str, configuration):
@@ -954,12 +1339,9 @@ def xc_put_http_load_balancers(load_balancer_name: str, configuration):
     :return: Requests data.
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/http_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     body: str = json.dumps(configuration)
-    print(f"jsondump: {body}")
-    req = requests.put(url=address, headers=headers, data=body)
+    logger.debug("PUT HTTP LB %s: %s", load_balancer_name, body)
+    req = xc_request("PUT", address, data=body)
     return req
 
 
@@ -971,11 +1353,8 @@ def xc_put_tcp_load_balancers(load_balancer_name: str, configuration):
     :return: Requests data.
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/tcp_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     body: str = json.dumps(configuration)
-    req = requests.put(url=address, headers=headers, data=body)
+    req = xc_request("PUT", address, data=body)
     return req
 
 
@@ -987,11 +1366,8 @@ def xc_put_cdn_load_balancers(load_balancer_name: str, configuration):
     :return: Requests data.
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/cdn_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     body: str = json.dumps(configuration)
-    req = requests.put(url=address, headers=headers, data=body)
+    req = xc_request("PUT", address, data=body)
     return req
 
 
@@ -1001,16 +1377,13 @@ def xc_put_origin_pools(origin_pools: []):
     :param origin_pools: Array of all the origin pools that will be replaced.
     :return: Errors if found.
     """
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     errors = []
     for each in origin_pools:
-        print(each)
         origin_pool_name = each['metadata']['name']
+        logger.debug("PUT Origin Pool %s: %s", origin_pool_name, each)
         address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/origin_pools/{origin_pool_name}"
         body: str = json.dumps(each)
-        req = requests.put(url=address, headers=headers, data=body)
+        req = xc_request("PUT", address, data=body)
         if req.status_code > 200:
             errors.append(f"Error while handling {origin_pool_name}, error: {req.json()}")
     return errors
@@ -1024,11 +1397,8 @@ def put_app_firewall(configuration: dict):
     """
     firewall_name = configuration['metadata']['name']
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/app_firewalls/{firewall_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     body: str = json.dumps(configuration)
-    req = requests.put(url=address, headers=headers, data=body)
+    req = xc_request("PUT", address, data=body)
     return req
 
 
@@ -1039,14 +1409,9 @@ def get_http_load_balancer(load_balancer_name: str):
     :return: JSON oof Load Balancer
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/http_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_hedged_get(address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def get_tcp_load_balancer(load_balancer_name: str):
@@ -1056,14 +1421,9 @@ def get_tcp_load_balancer(load_balancer_name: str):
     :return: JSON of Load Balancer
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/tcp_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_hedged_get(address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def get_cdn_load_balancer(load_balancer_name: str):
@@ -1073,14 +1433,9 @@ def get_cdn_load_balancer(load_balancer_name: str):
     :return: JSON oof Load Balancer
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/cdn_loadbalancers/{load_balancer_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_params = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, params=query_params, headers=headers)
-    if req.status_code > 200:
-        return HTTPException(req.status_code, req.json())
-    return req.json()
+    req = xc_hedged_get(address, params=query_params)
+    return raise_for_xc_status(req).json()
 
 
 def get_all_origin_pools(origin_pool_name: str):
@@ -1090,14 +1445,9 @@ def get_all_origin_pools(origin_pool_name: str):
     :return: JSON of the Origin Pool.
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/origin_pools/{origin_pool_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_parameters = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, headers=headers, params=query_parameters)
-    if req.status_code > 200:
-        return HTTPException(status_code=req.status_code, detail=req.json())
-    return req.json()
+    req = xc_hedged_get(address, params=query_parameters)
+    return raise_for_xc_status(req).json()
 
 
 def get_application_firewall(app_firewall_name: str):
@@ -1107,11 +1457,6 @@ def get_application_firewall(app_firewall_name: str):
     :return: JSON of App Firewall data
     """
     address = f"{os.getenv('XC_URL')}/api/config/namespaces/{os.getenv('XC_NAMESPACE')}/app_firewalls/{app_firewall_name}"
-    headers = {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
-               "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
-               "Access-Control-Allow-Origin": "*"}
     query_parameters = {"response_format": "GET_RSP_FORMAT_FOR_REPLACE"}
-    req = requests.get(address, headers=headers, params=query_parameters)
-    if req.status_code > 200:
-        return HTTPException(status_code=req.status_code, detail=req.json())
-    return req.json()
+    req = xc_hedged_get(address, params=query_parameters)
+    return raise_for_xc_status(req).json()
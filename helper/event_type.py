@@ -7,3 +7,5 @@ TCP_SNAPSHOT = 'tcp_snapshot'
 CDN_REPLACE = 'cdn_replace'
 CDN_SNAPSHOT = 'cdn_snapshot'
 MANUAL_SNAPSHOT = 'manual_snapshot'
+TARGETED_SNAPSHOT = 'targeted_snapshot'
+FLEET_ROLLBACK = 'fleet_rollback'
@@ -3,4 +3,8 @@ tcp = "tcp_lb"
 cdn = "cdn_lb"
 health = "health_check"
 
-types = [http, tcp, cdn, health]
\ No newline at end of file
+types = [http, tcp, cdn, health]
+
+# Objects referenced by the Load Balancers
+origin_pool = "origin_pool"
+app_firewall = "app_firewall"
@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+from dotenv import load_dotenv
+
+from helper import metrics
+
+load_dotenv()
+# Lowest level written: DEBUG | INFO | WARNING | ERROR. DEBUG includes the configurations received from XC.
+log_level = os.getenv("LOG_LEVEL", "INFO").upper()
+# json (one object per line) | text
+log_format = os.getenv("LOG_FORMAT", "json")
+# Messages longer than this are truncated, e.g. a whole LB configuration
+log_max_length = int(os.getenv("LOG_MAX_LENGTH", "2000"))
+# Fraction of the DEBUG messages written, between 0 and 1
+log_debug_sample = float(os.getenv("LOG_DEBUG_SAMPLE", "1"))
+# Messages waiting for the writer thread. When it is full, new messages are dropped instead of blocking.
+log_queue_size = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+root_logger_name = 'revision_tool'
+# Attributes of every LogRecord, the other attributes are the fields given with extra=
+_record_attributes = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+_listener: QueueListener | None = None
+_handler: 'NonBlockingQueueHandler | None' = None
+_setup_lock = threading.Lock()
+
+
+def truncate(message: str, limit: int = log_max_length) -> str:
+    """
+    :return: The message, cut to limit characters
+    """
+    if limit <= 0 or len(message) <= limit:
+        return message
+    return f"{message[:limit]}... ({len(message) - limit} more characters)"
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keep a fraction of the DEBUG messages.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or log_debug_sample >= 1 or random.random() < log_debug_sample
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """
+    Put the messages in a bounded queue, written to stdout by the listener thread.
+    The message is merged with its arguments and truncated in the calling thread, so the arguments can change after.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = super().prepare(record)
+        record.msg = truncate(record.msg)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.log_messages_dropped.inc()
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: time, level, logger, message and the fields given with extra=.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) +
+                         f'.{int(record.msecs):03d}Z',
+                 'level': record.levelname, 'logger': record.name, 'message': record.getMessage()}
+        entry.update({key: value for key, value in vars(record).items() if key not in _record_attributes})
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    def format(self, record: logging.LogRecord) -> str:
+        fields = ' '.join(f'{key}={value}' for key, value in vars(record).items() if key not in _record_attributes)
+        message = super().format(record)
+        return f'{message} [{fields}]' if fields else message
+
+
+def setup_logging():
+    """
+    Send the messages of every logger under revision_tool through the queue. Called on the first get_logger().
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            return
+        log_queue = queue.Queue(maxsize=log_queue_size)
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(TextFormatter() if log_format == 'text' else JsonFormatter())
+        _handler = NonBlockingQueueHandler(log_queue)
+        _handler.addFilter(SamplingFilter())
+        root = logging.getLogger(root_logger_name)
+        root.setLevel(log_level)
+        root.addHandler(_handler)
+        root.propagate = False
+        _listener = QueueListener(log_queue, stream)
+        _listener.start()
+        atexit.register(shutdown_logging)
+
+
+def shutdown_logging():
+    """
+    Write the messages still queued and stop the listener thread.
+    """
+    global _listener, _handler
+    with _setup_lock:
+        if _listener is not None:
+            logging.getLogger(root_logger_name).removeHandler(_handler)
+            _listener.stop()
+            _listener = _handler = None
+
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    :param name: Name of the module, e.g. __name__
+    :return: Logger writing through the non-blocking queue
+    """
+    setup_logging()
+    return logging.getLogger(f'{root_logger_name}.{name}')
@@ -0,0 +1,80 @@
+import time
+from urllib.parse import urlsplit
+
+from prometheus_client import Counter, Histogram
+from sqlalchemy import event
+
+# Latency buckets in seconds, from a fast SQL query to a slow XC list
+latency_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+snapshot_buckets = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1200, 3600)
+
+xc_request_seconds = Histogram('xc_request_seconds', 'Latency of each request sent to the XC config API, retries '
+                                                     'included', ['kind', 'verb', 'status'], buckets=latency_buckets)
+db_query_seconds = Histogram('db_query_seconds', 'Latency of the SQL statements', ['statement'],
+                             buckets=latency_buckets)
+http_request_seconds = Histogram('http_request_seconds', 'Latency of the API requests', ['method', 'route', 'status'],
+                                 buckets=latency_buckets)
+snapshot_phase_seconds = Histogram('snapshot_phase_seconds', 'Duration of each snapshot phase. fetch and store are '
+                                                             'observed per batch, total per LB type.',
+                                   ['lb_type', 'phase'], buckets=snapshot_buckets)
+snapshot_run_seconds = Histogram('snapshot_run_seconds', 'Duration of the snapshot runs', ['kind'],
+                                 buckets=snapshot_buckets)
+snapshot_lbs = Counter('snapshot_lbs', 'LB seen by the snapshots', ['lb_type', 'environment', 'result'])
+sql_queries_per_request = Histogram('sql_queries_per_request', 'SQL statements sent by each API request or snapshot '
+                                                               'job', ['endpoint'],
+                                    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 5000, 10000))
+sql_seconds_per_request = Histogram('sql_seconds_per_request', 'Time spent in SQL statements by each API request or '
+                                                               'snapshot job', ['endpoint'], buckets=latency_buckets)
+sql_repeated_statements = Counter('sql_repeated_statements', 'API requests or snapshot jobs sending the same SQL '
+                                                             'statement more than SQL_REPEATED_QUERY_LIMIT times',
+                                  ['endpoint'])
+sql_slow_queries = Counter('sql_slow_queries', 'SQL statements slower than SQL_SLOW_QUERY_SECONDS', ['statement'])
+log_messages_dropped = Counter('log_messages_dropped', 'Log messages dropped because the log queue was full')
+replace_objects = Counter('replace_objects', 'Objects of the replaced LB, pushed to XC or skipped because XC '
+                                             'already had the same configuration', ['kind', 'result'])
+
+
+def xc_kind(method: str, address: str) -> tuple[str, str]:
+    """
+    :param method: HTTP method of the XC request
+    :param address: Address of the XC request, e.g. <XC_URL>/api/config/namespaces/<ns>/origin_pools/<name>
+    :return: Kind of object (e.g. origin_pools) and verb (list | get | put | ...)
+    """
+    segments = urlsplit(address).path.strip('/').split('/')
+    if 'namespaces' not in segments:
+        return 'other', method.lower()
+    after_namespace = segments[segments.index('namespaces') + 2:]
+    kind = after_namespace[0] if after_namespace else 'namespace'
+    if method.upper() == 'GET' and len(after_namespace) == 1:
+        return kind, 'list'
+    return kind, method.lower()
+
+
+def observe_xc_request(method: str, address: str, status, seconds: float):
+    """
+    :param status: Status code of the response, or timeout | error if there was none
+    """
+    kind, verb = xc_kind(method, address)
+    xc_request_seconds.labels(kind, verb, str(status)).observe(seconds)
+
+
+def instrument_engine(engine):
+    """
+    Observe the latency of every SQL statement sent through the engine.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_start'].pop()
+        db_query_seconds.labels(statement.lstrip().split(None, 1)[0].upper()).observe(seconds)
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_query(context):
+        # The statement failed, after_cursor_execute won't be called
+        starts = context.connection.info.get('query_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
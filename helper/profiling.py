@@ -0,0 +1,224 @@
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+# Seconds between two samples of the thread stacks
+profile_interval = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# Number of functions and allocation sites kept in a report
+profile_top = int(os.getenv("PROFILE_TOP", "30"))
+# Number of distinct stacks kept in a report, the most sampled first
+profile_max_stacks = int(os.getenv("PROFILE_MAX_STACKS", "2000"))
+# Frames recorded by tracemalloc for each allocation
+profile_tracemalloc_frames = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+# Header and query parameter requesting a profile of the request
+profile_header = 'X-Profile'
+profile_query = 'profile'
+
+root_directory = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) + os.sep
+_tracemalloc_users = 0
+_tracemalloc_started = False
+_tracemalloc_guard = threading.Lock()
+
+
+def is_requested(headers, query_params) -> bool:
+    """
+    :return: True if the request asks to be profiled, with the X-Profile header or the profile query parameter
+    """
+    value = headers.get(profile_header) or query_params.get(profile_query) or ''
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def short_path(filename: str) -> str:
+    """
+    :return: Path relative to the repository or to site-packages, e.g. snapshot_pipeline.py or requests/sessions.py
+    """
+    if filename.startswith(root_directory):
+        return filename[len(root_directory):]
+    if 'site-packages' + os.sep in filename:
+        return filename.split('site-packages' + os.sep, 1)[1]
+    return os.sep.join(filename.split(os.sep)[-2:])
+
+
+def function_label(code) -> str:
+    """
+    :return: File and function name, e.g. snapshot_pipeline.py:snapshot_lb_type
+    """
+    return f'{short_path(code.co_filename)}:{code.co_name}'
+
+
+def thread_cpu_time(ident: int) -> float | None:
+    """
+    :return: CPU seconds used by the thread, or None if the platform can't tell
+    """
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        return None
+
+
+class SamplingProfiler:
+    """
+    Sample the stacks of the threads running this repository's code at a fixed interval.
+    Each sample is weighted by the CPU time its thread used since the previous sample,
+    so threads waiting on XC or the database add wall samples but no CPU time.
+    """
+
+    def __init__(self, interval: float = profile_interval, entry_points=None):
+        """
+        :param interval: Seconds between two samples
+        :param entry_points: (Optional) Functions. Only the threads running one of them are sampled.
+        """
+        self.interval = interval
+        self.entry_codes = {function.__code__ for function in self._unwrap(entry_points or [])}
+        self.samples = Counter()
+        self.cpu = Counter()
+        self.sample_count = 0
+        self.duration = 0.0
+        self._cpu_times: dict[int, float] = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+
+    @staticmethod
+    def _unwrap(functions):
+        for function in functions:
+            while function is not None:
+                if hasattr(function, '__code__'):
+                    yield function
+                function = getattr(function, '__wrapped__', None)
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._start
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        own = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            # CPU time is read for every thread, so a thread that just entered the sampled code
+            # isn't charged for what it ran before
+            cpu_time = thread_cpu_time(ident)
+            previous = self._cpu_times.get(ident)
+            if cpu_time is not None:
+                self._cpu_times[ident] = cpu_time
+            codes = []
+            while frame is not None:
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if not any(code.co_filename.startswith(root_directory) for code in codes):
+                continue
+            if self.entry_codes and not self.entry_codes.intersection(codes):
+                continue
+            stack = ';'.join(function_label(code) for code in reversed(codes))
+            self.samples[stack] += 1
+            self.sample_count += 1
+            if cpu_time is not None and previous is not None:
+                self.cpu[stack] += cpu_time - previous
+
+    def report(self) -> dict:
+        """
+        :return: Most expensive functions, by the time spent in the function itself (self) and in the function
+        and its callees (total), in samples and CPU seconds. The sampled stacks are
+        root first and separated by ';' like the collapsed format of flame graph tools
+        """
+        functions = {}
+        for stack, count in self.samples.items():
+            labels = stack.split(';')
+            cpu = self.cpu.get(stack, 0.0)
+            for label in set(labels):
+                entry = functions.setdefault(label, {'function': label, 'self_samples': 0, 'total_samples': 0,
+                                                     'self_cpu': 0.0, 'total_cpu': 0.0})
+                entry['total_samples'] += count
+                entry['total_cpu'] += cpu
+            functions[labels[-1]]['self_samples'] += count
+            functions[labels[-1]]['self_cpu'] += cpu
+        for entry in functions.values():
+            entry['self_cpu'] = round(entry['self_cpu'], 6)
+            entry['total_cpu'] = round(entry['total_cpu'], 6)
+        by_self = sorted(functions.values(), key=lambda each: (each['self_cpu'], each['self_samples']), reverse=True)
+        by_total = sorted(functions.values(), key=lambda each: (each['total_cpu'], each['total_samples']),
+                          reverse=True)
+        return {'interval': self.interval, 'duration': round(self.duration, 6), 'samples': self.sample_count,
+                'cpu_seconds': round(sum(self.cpu.values()), 6), 'functions_by_self': by_self[:profile_top],
+                'functions_by_total': by_total[:profile_top],
+                'stacks': [{'stack': stack, 'samples': count, 'cpu': round(self.cpu.get(stack, 0.0), 6)}
+                           for stack, count in self.samples.most_common(profile_max_stacks)]}
+
+
+def start_tracemalloc():
+    """
+    Start tracing allocations, shared by the profiles running at the same time.
+    """
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_guard:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(profile_tracemalloc_frames)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def stop_tracemalloc():
+    """
+    Stop tracing allocations when the last profile ends, unless it was started outside of the profiles
+    (e.g. PYTHONTRACEMALLOC).
+    """
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_guard:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+def allocation_report(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> list[dict]:
+    """
+    :return: Allocation sites that grew the most between the snapshots
+    """
+    ignored = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    differences = after.filter_traces(ignored).compare_to(before.filter_traces(ignored), 'lineno')
+    top = [each for each in differences if each.size_diff > 0][:profile_top]
+    return [{'location': f"{short_path(each.traceback[0].filename)}:{each.traceback[0].lineno}",
+             'size_kb': round(each.size_diff / 1024, 1), 'count': each.count_diff} for each in top]
+
+
+@contextmanager
+def profile(entry_points=None):
+    """
+    Profile the code run inside the block: sampled CPU profile and allocations (tracemalloc).
+    Allocations of every thread are counted, including concurrent requests.
+    :param entry_points: (Optional) Functions. Only the threads running one of them are sampled.
+    :return: Dictionary filled with the report when the block exits
+    """
+    report = {}
+    start_tracemalloc()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        sampler = SamplingProfiler(entry_points=entry_points)
+        sampler.start()
+        try:
+            yield report
+        finally:
+            sampler.stop()
+            after = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            report.update(sampler.report(), allocations=allocation_report(before, after),
+                          traced_peak_kb=round(peak / 1024, 1))
+    finally:
+        stop_tracemalloc()
@@ -0,0 +1,149 @@
+import contextvars
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from sqlalchemy import event
+
+from helper import log, metrics
+from helper.profiling import root_directory, short_path
+
+load_dotenv()
+logger = log.get_logger(__name__)
+# SQL statements slower than this (in seconds) are logged with the code that sent them
+slow_query_seconds = float(os.getenv("SQL_SLOW_QUERY_SECONDS", "0.5"))
+# A request sending the same statement more than this many times is logged as a likely N+1 query
+repeated_query_limit = int(os.getenv("SQL_REPEATED_QUERY_LIMIT", "20"))
+
+# Statements counted in the rows written
+write_statements = ('INSERT', 'UPDATE', 'DELETE', 'REPLACE')
+
+_current: contextvars.ContextVar['QueryStats | None'] = contextvars.ContextVar('query_stats', default=None)
+# Lists of bind parameters, e.g. IN (%s, %s, %s) or VALUES (?, ?), (?, ?)
+_bind_list = re.compile(r"\(\s*(?:%s|\?|%\(\w+\)s|:\w+)(?:\s*,\s*(?:%s|\?|%\(\w+\)s|:\w+))*\s*\)")
+_repeated_bind_list = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+
+
+def statement_shape(statement: str) -> str:
+    """
+    :return: The statement without its layout and with lists of parameters collapsed, so the same query
+    sent with a different number of parameters has the same shape
+    """
+    shape = _bind_list.sub('(?)', ' '.join(statement.split()))
+    return _repeated_bind_list.sub('(?), ...', shape)
+
+
+def call_site(depth: int = 2) -> str:
+    """
+    :param depth: Number of frames to return
+    :return: File, line and function of the innermost frames of this repository's code in the current stack,
+    the innermost first, e.g. dependency.py:144 in log_stuff < dependency.py:178 in push_http_lb_to_db
+    """
+    sites = []
+    frame = sys._getframe(1)
+    while frame is not None and len(sites) < depth:
+        filename = frame.f_code.co_filename
+        if filename.startswith(root_directory) and filename != __file__:
+            sites.append(f'{short_path(filename)}:{frame.f_lineno} in {frame.f_code.co_name}')
+        frame = frame.f_back
+    return ' < '.join(sites) or 'unknown'
+
+
+class QueryStats:
+    """
+    SQL statements sent while handling a request or running a snapshot job, including the threads it started.
+    """
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.count = 0
+        self.seconds = 0.0
+        # Rows inserted, updated or deleted
+        self.rows_written = 0
+        self.shapes = Counter()
+        # Where each repeated statement was first flagged
+        self.call_sites: dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def add(self, statement: str, seconds: float, rows_written: int = 0):
+        shape = statement_shape(statement)
+        with self._lock:
+            self.count += 1
+            self.seconds += seconds
+            self.rows_written += rows_written
+            self.shapes[shape] += 1
+            flagged = self.shapes[shape] == repeated_query_limit + 1
+        if flagged:
+            self.call_sites[shape] = call_site()
+
+    def repeated(self) -> list[tuple[str, int]]:
+        """
+        :return: Statements sent more than SQL_REPEATED_QUERY_LIMIT times, the most repeated first
+        """
+        return [(shape, count) for shape, count in self.shapes.most_common() if count > repeated_query_limit]
+
+    def finish(self):
+        """
+        Observe the summary of the request and log its repeated statements.
+        """
+        metrics.sql_queries_per_request.labels(self.endpoint).observe(self.count)
+        metrics.sql_seconds_per_request.labels(self.endpoint).observe(self.seconds)
+        repeated = self.repeated()
+        if repeated:
+            metrics.sql_repeated_statements.labels(self.endpoint).inc()
+        for shape, count in repeated:
+            site = self.call_sites.get(shape, 'unknown')
+            logger.warning("%s sent the same SQL statement %s times, from %s: %s", self.endpoint, count, site, shape,
+                           extra={'endpoint': self.endpoint, 'count': count, 'call_site': site})
+
+
+@contextmanager
+def track_queries(endpoint: str):
+    """
+    Count the SQL statements sent inside the block, by this thread and by the threads started with the same context
+    (FastAPI thread pool, tracing.in_current_context).
+    :param endpoint: Label of the summary, e.g. GET /xc/http-lb/ or snapshot job. Can be changed inside the block.
+    :return: QueryStats of the block
+    """
+    stats = QueryStats(endpoint)
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+        stats.finish()
+
+
+def instrument_engine(engine):
+    """
+    Count the statements of the current request and log the slow statements.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def start_query(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_stats_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def end_query(conn, cursor, statement, parameters, context, executemany):
+        seconds = time.perf_counter() - conn.info['query_stats_start'].pop()
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        stats = _current.get()
+        if stats is not None:
+            rows_written = cursor.rowcount if verb in write_statements and cursor.rowcount > 0 else 0
+            stats.add(statement, seconds, rows_written)
+        if seconds >= slow_query_seconds:
+            metrics.sql_slow_queries.labels(verb).inc()
+            site = call_site()
+            logger.warning("Slow SQL statement (%.3fs) from %s: %s", seconds, site, statement_shape(statement),
+                           extra={'seconds': round(seconds, 6), 'call_site': site})
+
+    @event.listens_for(engine, 'handle_error')
+    def failed_query(context):
+        starts = context.connection.info.get('query_stats_start') if context.connection is not None else None
+        if starts:
+            starts.pop()
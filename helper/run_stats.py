@@ -0,0 +1,75 @@
+import contextvars
+import threading
+from contextlib import contextmanager
+
+_current: contextvars.ContextVar['RunStats | None'] = contextvars.ContextVar('run_stats', default=None)
+
+
+class RunStats:
+    """
+    Counters of a snapshot run, fed by the snapshot pipeline and the XC client of every thread started with the
+    run's context (tracing.in_current_context).
+    """
+
+    def __init__(self):
+        # LB type: phase: seconds. fetch and store are summed over the batches.
+        self.phases: dict[str, dict[str, float]] = {}
+        self.xc = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0,
+                   'hedged': 0, 'bytes': 0}
+        # LB type: environment: new | updated | skipped: count
+        self.lbs: dict[str, dict[str, dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    def add_phase(self, lb_type: str, phase: str, seconds: float):
+        with self._lock:
+            phases = self.phases.setdefault(lb_type, {})
+            phases[phase] = phases.get(phase, 0.0) + seconds
+
+    def add_xc(self, key: str, amount: int = 1):
+        with self._lock:
+            self.xc[key] = self.xc.get(key, 0) + amount
+
+    def add_lbs(self, lb_type: str, environment: str, new: int, updated: int, skipped: int):
+        with self._lock:
+            counter = self.lbs.setdefault(lb_type, {}).setdefault(environment, {'new': 0, 'updated': 0, 'skipped': 0})
+            counter['new'] += new
+            counter['updated'] += updated
+            counter['skipped'] += skipped
+
+    def report(self) -> dict:
+        with self._lock:
+            return {'phases': {lb_type: {phase: round(seconds, 6) for phase, seconds in phases.items()}
+                               for lb_type, phases in self.phases.items()},
+                    'xc': dict(self.xc),
+                    'lbs': {lb_type: {env: dict(counter) for env, counter in envs.items()}
+                            for lb_type, envs in self.lbs.items()}}
+
+
+@contextmanager
+def collect_run_stats():
+    """
+    Collect the counters of the snapshot run inside the block.
+    :return: RunStats of the block
+    """
+    stats = RunStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def current() -> RunStats | None:
+    """
+    :return: RunStats of the snapshot run in progress in this context, if any
+    """
+    return _current.get()
+
+
+def count_xc(key: str, amount: int = 1):
+    """
+    Count an XC request, retry, error or received bytes in the snapshot run in progress, if any.
+    """
+    stats = _current.get()
+    if stats is not None:
+        stats.add_xc(key, amount)
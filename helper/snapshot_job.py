@@ -0,0 +1,16 @@
+# Job types
+full = "full"
+targeted = "targeted"
+
+# Triggers
+manual = "manual"
+scheduler = "scheduler"
+webhook = "webhook"
+
+# Status
+queued = "queued"
+running = "running"
+succeeded = "succeeded"
+failed = "failed"
+
+finished = [succeeded, failed]
@@ -0,0 +1,62 @@
+import contextvars
+import os
+from functools import wraps
+
+from dotenv import load_dotenv
+from opentelemetry import trace
+
+load_dotenv()
+# Where spans are exported: none | file | otlp. With none, no tracer provider is set and spans are no-ops.
+tracing_exporter = os.getenv("TRACING_EXPORTER", "none")
+# File receiving one JSON span per line, with TRACING_EXPORTER=file
+tracing_file = os.getenv("TRACING_FILE", "traces.jsonl")
+# The otlp exporter reads the collector address from OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+service_name = os.getenv("OTEL_SERVICE_NAME", "f5xc-revision-tool")
+
+tracer = trace.get_tracer("f5xc-revision-tool")
+_provider = None
+
+
+def setup_tracing():
+    """
+    Set the tracer provider according to TRACING_EXPORTER. The SDK is only imported when tracing is enabled.
+    """
+    global _provider
+    if tracing_exporter == "none" or _provider is not None:
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+    if tracing_exporter == "file":
+        exporter = ConsoleSpanExporter(out=open(tracing_file, 'a'),
+                                       formatter=lambda span: span.to_json(indent=None) + '\n')
+    elif tracing_exporter == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        exporter = OTLPSpanExporter()
+    else:
+        raise ValueError(f"Unknown TRACING_EXPORTER {tracing_exporter}, expected none, file or otlp")
+    _provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    _provider.add_span_processor(BatchSpanProcessor(exporter))
+    trace.set_tracer_provider(_provider)
+
+
+def shutdown_tracing():
+    """
+    Export the spans still buffered.
+    """
+    if _provider is not None:
+        _provider.shutdown()
+
+
+def in_current_context(function):
+    """
+    Run the function in a copy of the current context, so spans created in another thread (e.g. in an executor)
+    keep their parent span.
+    """
+    context = contextvars.copy_context()
+
+    @wraps(function)
+    def run(*args, **kwargs):
+        return context.run(function, *args, **kwargs)
+
+    return run
@@ -0,0 +1,463 @@
+import codecs
+import email.utils
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from typing import Iterator
+
+import requests
+from dotenv import load_dotenv
+from fastapi import HTTPException
+
+from helper import log, metrics, run_stats, tracing
+
+load_dotenv()
+logger = log.get_logger(__name__)
+# Requests per second allowed to XC, and how many can be sent at once after being idle. These limits and the
+# concurrency below are per process: with SNAPSHOT_WORKER=process, the API worker and its snapshot worker process
+# split them according to SNAPSHOT_WORKER_XC_SHARE.
+xc_rate_limit = float(os.getenv("XC_RATE_LIMIT", 20))
+xc_rate_burst = int(os.getenv("XC_RATE_BURST", 20))
+# Bounds of the concurrent requests to XC, shared by every snapshot and replace running in this process.
+# The limit starts at the maximum, halves when XC throttles, and grows back by one per successful round.
+xc_max_concurrency = int(os.getenv("XC_MAX_CONCURRENCY", 8))
+xc_min_concurrency = int(os.getenv("XC_MIN_CONCURRENCY", 1))
+# Retries of a GET request that failed with 429, 5xx, a timeout or a connection error
+xc_max_retries = int(os.getenv("XC_MAX_RETRIES", 4))
+xc_backoff_base = float(os.getenv("XC_BACKOFF_BASE", 0.5))
+xc_backoff_cap = float(os.getenv("XC_BACKOFF_CAP", 30))
+# Seconds to connect to XC, and to wait for its response
+xc_connect_timeout = float(os.getenv("XC_CONNECT_TIMEOUT", 5))
+xc_read_timeout = float(os.getenv("XC_READ_TIMEOUT", 30))
+# Consecutive failures (5xx, timeouts, connection errors) before failing fast, and for how many seconds
+xc_breaker_threshold = int(os.getenv("XC_BREAKER_THRESHOLD", 5))
+xc_breaker_cooldown = float(os.getenv("XC_BREAKER_COOLDOWN", 30))
+# Seconds before a hedged GET is sent a second time. 0 disables hedging.
+xc_hedge_delay = float(os.getenv("XC_HEDGE_DELAY", 1))
+# Status codes meaning XC is overloaded or rate limiting the tenant
+throttle_status = (429, 503)
+retry_status = (429, 500, 502, 503, 504)
+# Errors of requests worth retrying. The others (invalid URL, too many redirects, etc.) fail at once.
+retry_errors = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+
+
+class XCRequestError(HTTPException):
+    """
+    XC answered with an error. Handled by FastAPI like any other HTTPException.
+    """
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter. Every request takes a token, tokens are refilled at a fixed rate.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self._last_refill = time.monotonic()
+        # Nothing is sent before this time, set when XC asks to retry later
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a token is available and take it.
+        """
+        while True:
+            with self._lock:
+                current = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (current - self._last_refill) * self.rate)
+                self._last_refill = current
+                if current >= self._paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self._paused_until - current, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """
+        Stop sending requests for a while, e.g. for the Retry-After of XC.
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class AdaptiveLimiter:
+    """
+    Limit of concurrent requests that adapts to XC (AIMD): additive increase on success,
+    multiplicative decrease when XC throttles.
+    """
+
+    def __init__(self, minimum: int, maximum: int):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = float(maximum)
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *args):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def success(self):
+        with self._condition:
+            grown = min(self.maximum, self.limit + 1 / self.limit)
+            if int(grown) > int(self.limit):
+                self._condition.notify()
+            self.limit = grown
+
+    def throttled(self):
+        with self._condition:
+            current = time.monotonic()
+            # Requests sent at the same time are throttled together, count them as a single decrease
+            if current - self._last_decrease < 1:
+                return
+            self._last_decrease = current
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+class CircuitBreaker:
+    """
+    Fails fast while XC is unhealthy. Opens after consecutive failures, then lets a single request through
+    once the cooldown is over: the breaker closes if it succeeds, and opens again if it fails.
+    """
+
+    def __init__(self, threshold: int, cooldown: float):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.state = 'closed'
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.cooldown:
+                # Trial request
+                self.state = 'half-open'
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.state = 'closed'
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == 'half-open' or self.failures >= self.threshold:
+                if self.state != 'open':
+                    logger.warning("XC circuit breaker opened after %s failures", self.failures)
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+
+xc_rate = TokenBucket(xc_rate_limit, xc_rate_burst)
+xc_concurrency = AdaptiveLimiter(xc_min_concurrency, xc_max_concurrency)
+xc_breaker = CircuitBreaker(xc_breaker_threshold, xc_breaker_cooldown)
+# Runs both requests of a hedged GET
+_hedge_executor = ThreadPoolExecutor(max_workers=2 * xc_max_concurrency, thread_name_prefix='xc-hedge')
+_stats = {'requests': 0, 'retries': 0, 'throttled': 0, 'errors': 0, 'timeouts': 0, 'rejected': 0, 'hedged': 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+    run_stats.count_xc(key)
+
+
+def xc_stats() -> dict:
+    """
+    Counters of the XC client since the process started.
+    :return: Requests sent, retries, throttled responses, errors, and the current limits
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    return {**stats, 'concurrency_limit': int(xc_concurrency.limit), 'in_flight': xc_concurrency.in_flight,
+            'rate_limit': xc_rate.rate, 'tokens': round(xc_rate.tokens, 2), 'breaker': xc_breaker.state}
+
+
+def share_budget(share: float):
+    """
+    Keep a share of the XC budget for this process, when another process of the same worker sends requests too
+    (the snapshot worker process). The rate, the burst and the maximum concurrency are scaled.
+    :param share: Between 0 and 1
+    """
+    with xc_rate._lock:
+        xc_rate.rate = max(0.1, xc_rate_limit * share)
+        xc_rate.burst = max(1, int(xc_rate_burst * share))
+        xc_rate.tokens = min(xc_rate.tokens, xc_rate.burst)
+    with xc_concurrency._condition:
+        xc_concurrency.maximum = max(xc_concurrency.minimum, int(xc_max_concurrency * share))
+        xc_concurrency.limit = min(xc_concurrency.limit, xc_concurrency.maximum)
+
+
+def xc_headers() -> dict:
+    """
+    Headers used to authenticate to XC.
+    :return: Headers with the API Token and tenant
+    """
+    return {"Authorization": f"APIToken {os.getenv('XC_APITOKEN')}",
+            "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}", "accept": "application/json",
+            "Access-Control-Allow-Origin": "*"}
+
+
+def xc_address(path: str, namespace: str | None = None) -> str:
+    """
+    Build the address of an XC config object.
+    :param path: Path after the namespace, e.g. http_loadbalancers/<name>
+    :param namespace: Namespace of the XC. Defaults to XC_NAMESPACE.
+    :return: Full address of the object
+    """
+    return f"{os.getenv('XC_URL')}/api/config/namespaces/{namespace or os.getenv('XC_NAMESPACE')}/{path}"
+
+
+def retry_after(response: requests.Response) -> float | None:
+    """
+    Read the Retry-After header, given either in seconds or as a date.
+    :return: Seconds to wait, or None if the header is missing
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter.
+    :param attempt: Number of the retry, starting at 0
+    :return: Seconds to wait before the retry
+    """
+    return random.uniform(0, min(xc_backoff_cap, xc_backoff_base * 2 ** attempt))
+
+
+def xc_request(method: str, address: str, **kwargs) -> requests.Response:
+    """
+    Send a request to XC, within the rate limit and the concurrency limit.
+    GET requests are retried with backoff on 429, 5xx, timeouts, connection errors and responses cut short. Other
+    requests are only retried on 429, since XC didn't process them.
+    :param method: HTTP method
+    :param address: Address of the XC object
+    :param kwargs: Passed to requests (params, data, etc.)
+    :return: Response from XC
+    :except XCRequestError: Raised with status 503 while the circuit breaker is open,
+    502 or 504 if XC can't be reached after every retry or the request fails
+    """
+    idempotent = method.upper() == "GET"
+    kwargs.setdefault('timeout', (xc_connect_timeout, xc_read_timeout))
+    attempt = 0
+    while True:
+        if not xc_breaker.allow():
+            _count('rejected')
+            raise XCRequestError(status_code=503, detail="XC is unavailable, retry later.")
+        # The outcome is always given to the breaker, or a trial request would leave it half-open for good
+        recorded = False
+        try:
+            xc_rate.acquire()
+            _count('requests')
+            start = time.perf_counter()
+            kind, verb = metrics.xc_kind(method, address)
+            try:
+                with xc_concurrency, tracing.tracer.start_as_current_span(
+                        f'XC {verb} {kind}', attributes={'xc.kind': kind, 'xc.verb': verb, 'xc.attempt': attempt,
+                                                         'url.full': address}) as span:
+                    response = requests.request(method, address, headers=xc_headers(), **kwargs)
+                    span.set_attribute('http.response.status_code', response.status_code)
+            except requests.RequestException as e:
+                xc_breaker.failure()
+                recorded = True
+                timeout = isinstance(e, requests.Timeout)
+                _count('timeouts' if timeout else 'errors')
+                metrics.observe_xc_request(method, address, 'timeout' if timeout else 'error',
+                                           time.perf_counter() - start)
+                if not idempotent or attempt >= xc_max_retries or not isinstance(e, retry_errors):
+                    raise XCRequestError(status_code=504 if timeout else 502,
+                                         detail=f"XC can't be reached: {e}") from e
+                wait = backoff(attempt)
+            else:
+                if response.status_code >= 500 and response.status_code not in throttle_status:
+                    xc_breaker.failure()
+                else:
+                    xc_breaker.success()
+                recorded = True
+                metrics.observe_xc_request(method, address, response.status_code, time.perf_counter() - start)
+                if response.status_code in throttle_status:
+                    _count('throttled')
+                    xc_concurrency.throttled()
+                elif response.status_code < 500:
+                    xc_concurrency.success()
+                retryable = response.status_code in retry_status if idempotent else response.status_code == 429
+                if not retryable or attempt >= xc_max_retries:
+                    if not kwargs.get('stream'):
+                        run_stats.count_xc('bytes', len(response.content))
+                    return response
+                wait = max(backoff(attempt), retry_after(response) or 0)
+                # Streamed responses keep the connection until closed
+                response.close()
+                if response.status_code in throttle_status:
+                    # Every request waits, not only this one
+                    xc_rate.pause(wait)
+        finally:
+            if not recorded:
+                xc_breaker.failure()
+        _count('retries')
+        attempt += 1
+        time.sleep(wait)
+
+
+def xc_hedged_get(address: str, **kwargs) -> requests.Response:
+    """
+    GET request sent a second time if XC hasn't answered within XC_HEDGE_DELAY. The first answer is used.
+    Meant for reads where latency matters, like re-reading the objects after a replace.
+    :param address: Address of the XC object
+    :param kwargs: Passed to requests (params, etc.)
+    :return: Response from XC
+    """
+    if xc_hedge_delay <= 0:
+        return xc_request("GET", address, **kwargs)
+    first = _hedge_executor.submit(tracing.in_current_context(xc_request), "GET", address, **kwargs)
+    try:
+        return first.result(timeout=xc_hedge_delay)
+    except FutureTimeoutError:
+        pass
+    _count('hedged')
+    second = _hedge_executor.submit(tracing.in_current_context(xc_request), "GET", address, **kwargs)
+    error = None
+    for future in as_completed([first, second]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+def raise_for_xc_status(response: requests.Response) -> requests.Response:
+    """
+    :param response: Response from XC
+    :return: The response, if XC didn't answer with an error
+    :except XCRequestError: Raised with the status and error of XC
+    """
+    if response.status_code > 200:
+        try:
+            detail = response.json()
+        except ValueError:
+            detail = response.text
+        raise XCRequestError(status_code=response.status_code, detail=detail)
+    return response
+
+
+def iter_json_items(chunks: Iterator[bytes], key: str = 'items') -> Iterator:
+    """
+    Parse a JSON object incrementally and yield each element of one of its arrays as soon as it is complete,
+    without holding the whole document in memory.
+    :param chunks: Bytes of the JSON document, e.g. Response.iter_content()
+    :param key: Key of the array at the top level of the document
+    :return: Elements of the array
+    :except ValueError: Raised if the document is not valid JSON
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+
+    def fill() -> bool:
+        nonlocal buffer, position
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        # Drop what has already been parsed
+        buffer = buffer[position:] + text_decoder.decode(chunk)
+        position = 0
+        return True
+
+    def skip(characters: str = '') -> str:
+        # Skip whitespace and the given separators, and return the next character
+        nonlocal position
+        while True:
+            while position < len(buffer) and (buffer[position].isspace() or buffer[position] in characters):
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not fill():
+                raise ValueError("Unexpected end of the JSON document")
+
+    def value():
+        # Decode the next value, reading more of the document until it is complete
+        nonlocal position
+        while True:
+            try:
+                decoded, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not fill():
+                    raise
+                continue
+            # A number ending with the buffer may go on in the next chunk, e.g. 1234 cut after 1 or -1.5 after -1.
+            if isinstance(decoded, (int, float)) and not buffer[end:].strip('0123456789+-.eE') and fill():
+                continue
+            position = end
+            return decoded
+
+    if skip() != '{':
+        raise ValueError("The JSON document is not an object")
+    position += 1
+    while skip(',') != '}':
+        name = value()
+        following = skip(':')
+        if name != key:
+            # Other values are small (e.g. errors), they are decoded and dropped
+            value()
+            continue
+        if following != '[':
+            raise ValueError(f"{key} is not an array")
+        position += 1
+        while skip(',') != ']':
+            yield value()
+        position += 1
+
+
+def xc_list(collection: str, namespace: str | None = None, chunk_size: int = 65536) -> Iterator[dict]:
+    """
+    List the objects of a collection in XC. The response is parsed as it arrives, so the first objects
+    can be processed before the whole list is received.
+    XC doesn't paginate lists, so streaming keeps memory flat on namespaces with thousands of objects.
+    :param collection: Collection in XC, e.g. http_loadbalancers
+    :param namespace: Namespace of the XC. Defaults to XC_NAMESPACE.
+    :param chunk_size: Bytes read at a time
+    :return: Items of the list (name, namespace, labels, etc.)
+    :except XCRequestError: Raised if XC can't list the collection (expired API Token, wrong namespace, etc.)
+    """
+    def counted(chunks: Iterator[bytes]) -> Iterator[bytes]:
+        for chunk in chunks:
+            run_stats.count_xc('bytes', len(chunk))
+            yield chunk
+
+    with xc_request("GET", xc_address(collection, namespace), stream=True) as response:
+        raise_for_xc_status(response)
+        yield from iter_json_items(counted(response.iter_content(chunk_size=chunk_size)))
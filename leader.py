@@ -0,0 +1,88 @@
+import os
+import socket
+import threading
+import time
+import uuid
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session
+
+import dependency
+from helper import log
+from model.generic_model import SchedulerLeaderSchema
+
+engine = dependency.engine
+logger = log.get_logger(__name__)
+# Seconds between each renewal of the lease
+heartbeat_interval = int(os.getenv("LEADER_HEARTBEAT_SECONDS", 5))
+# Seconds without heartbeat before another worker takes over
+lease_duration = int(os.getenv("LEADER_LEASE_SECONDS", 15))
+# Identifies this worker process in tb_scheduler_leader
+holder_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+_lease_until = 0.0
+_leader_lock = threading.Lock()
+
+
+def heartbeat() -> bool:
+    """
+    Take the leadership if the lease is free or expired, or renew it if this worker is already the leader.
+    Only the leader runs the scheduler and the snapshot jobs. The other workers only serve the API.
+    :return: True if this worker is the leader
+    """
+    global _lease_until
+    current = time.time()
+    lease_until = int(current) + lease_duration
+    with _leader_lock, Session(engine) as session:
+        acquired = session.exec(update(SchedulerLeaderSchema).where(SchedulerLeaderSchema.id == 1).where(
+            (SchedulerLeaderSchema.holder == holder_id) | (SchedulerLeaderSchema.lease_until <= int(current))).values(
+            holder=holder_id, lease_until=lease_until, heartbeat_time=int(current))).rowcount == 1
+        session.commit()
+        if not acquired and not session.get(SchedulerLeaderSchema, 1):
+            # First worker to ever start
+            session.add(SchedulerLeaderSchema(id=1, holder=holder_id, lease_until=lease_until,
+                                              heartbeat_time=int(current)))
+            try:
+                session.commit()
+                acquired = True
+            except IntegrityError:
+                session.rollback()
+        was_leader = is_leader()
+        # Expires a second before the stored lease, so this worker stops before another one may take over
+        _lease_until = current + lease_duration - 1 if acquired else 0.0
+    if is_leader() != was_leader:
+        logger.info("Worker %s %s the leader", holder_id, 'is now' if is_leader() else 'is no longer')
+    return is_leader()
+
+
+def safe_heartbeat():
+    """
+    Heartbeat run by the scheduler. Leadership is given up if the database can't be reached.
+    """
+    global _lease_until
+    try:
+        heartbeat()
+    except Exception as e:
+        _lease_until = 0.0
+        logger.error("Leader election can't access the database: %s", e)
+
+
+def is_leader() -> bool:
+    """
+    :return: True if this worker holds a lease that hasn't expired
+    """
+    return _lease_until > time.time()
+
+
+def resign():
+    """
+    Release the lease on shutdown, so another worker takes over without waiting for the lease to expire.
+    """
+    global _lease_until
+    if not is_leader():
+        return
+    with _leader_lock, Session(engine) as session:
+        session.exec(update(SchedulerLeaderSchema).where(SchedulerLeaderSchema.id == 1).where(
+            SchedulerLeaderSchema.holder == holder_id).values(lease_until=0))
+        session.commit()
+        _lease_until = 0.0
@@ -1,32 +1,45 @@
-import asyncio
-import os
 import time
+import uuid
 from contextlib import asynccontextmanager
 
 import uvicorn
 from apscheduler.schedulers.background import BackgroundScheduler
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from requests import Response
+from fastapi.responses import JSONResponse
+from opentelemetry.trace import SpanKind
 from sqlmodel import Session, select
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
 
 import dependency
+import leader
 import metadata
-import model.user_model
-import routes.users
+import snapshot_jobs
+import snapshot_worker
+from helper import event_type, log, metrics, profiling, query_stats, snapshot_job, tracing
 from model.generic_model import SchedulerModel
+from model.log_stuff_model import EventLogSchema
+from model.profile_model import ProfileSchema
 from routes.cdn_lb import router as cdn_router
+from routes.history import router as history_router
 from routes.http_lb import router as app_mgmt_router
+from routes.metrics import router as metrics_router
+from routes.profiles import router as profile_router
+from routes.rollback import router as rollback_router
 from routes.snapshot import router as snapshot_router
 from routes.tcp_lb import router as tcp_router
 from routes.users import router as user_router, get_current_user, verify_administrator
 from routes.event_logs import router as websock_router
 
 load_dotenv()
+logger = log.get_logger(__name__)
 
 
 def access_db():
+    if not leader.is_leader():
+        return
     current: int = int(round(time.time()))
     engine = dependency.engine
     with Session(engine) as session:
@@ -36,30 +49,51 @@ def access_db():
         if stmt.is_started:
             return
         elif stmt.scheduled_time > current:
-            if os.getenv("DEMO") == 1: print(f"Scheduler in {stmt.scheduled_time - current}")
+            logger.debug("Scheduler in %s", stmt.scheduled_time - current)
         else:
             stmt.scheduled_time = 0
             session.commit()
-            if os.getenv("DEMO") == 1: print("Scheduler reset")
-            asyncio.run(auto_snapshot())
+            logger.debug("Scheduler reset")
+            auto_snapshot()
 
 
-async def auto_snapshot():
-    # Get token to create a snapshot
-    auto_token = await routes.users.login_for_access_token(
-        form_data=model.user_model.UserLogin(username="admin", password=os.getenv("AUTOGEN_PASSWORD")))
-    if os.getenv("DEMO") == 1: print(auto_token.access_token)
-    user = await get_current_user(auto_token.access_token)
-    routes.snapshot.manual_snapshot(token=await verify_administrator(user), response=Response())
-    if os.getenv("DEMO") == 1: print("manual snapshot completed")
+def access_snapshot_queue():
+    if not leader.is_leader():
+        return
+    targets = dependency.dequeue_snapshot_targets()
+    if not targets:
+        return
+    dependency.log_stuff(
+        EventLogSchema(event_type=event_type.TARGETED_SNAPSHOT, timestamp=int(round(time.time())),
+                       description=f'Audit log triggered a snapshot of {len(targets)} Load Balancers.'))
+    snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.webhook, username="autogenerated", targets=targets)
+
+
+def auto_snapshot():
+    job = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.scheduler, username="autogenerated")
+    logger.info("Scheduled snapshot job %s queued", job.job_id, extra={'job_id': job.job_id})
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    tracing.setup_tracing()
+    dependency.create_tables()
+    dependency.backfill_version_history()
+    # Every worker runs the scheduler, but only the leader runs the jobs. Another worker takes over if it stops.
+    leader.safe_heartbeat()
     scheduler = BackgroundScheduler()
+    scheduler.add_job(leader.safe_heartbeat, "interval", seconds=leader.heartbeat_interval)
     scheduler.add_job(access_db, "interval", seconds=5)
+    scheduler.add_job(access_snapshot_queue, "interval", seconds=5)
+    # The snapshots run in a separate process (SNAPSHOT_WORKER), this worker only queues them
+    snapshot_worker.start()
+    scheduler.add_job(snapshot_worker.supervise, "interval", seconds=leader.heartbeat_interval)
     scheduler.start()
     yield
+    snapshot_worker.stop()
+    scheduler.shutdown(wait=False)
+    leader.resign()
+    tracing.shutdown_tracing()
 
 
 def create_app():
@@ -68,16 +102,76 @@ def create_app():
     # todo: update to allow the correct address
     api.add_middleware(CORSMiddleware, allow_origins=['http://localhost', 'http://localhost:25000'],
                        allow_credentials=True, allow_methods=["*"], allow_headers=['*'])
+
+    @api.middleware('http')
+    async def observe_request(request: Request, call_next):
+        start = time.perf_counter()
+        with tracing.tracer.start_as_current_span(request.method, kind=SpanKind.SERVER) as span, \
+                query_stats.track_queries(request.method) as queries:
+            response = await call_next(request)
+            # The route template keeps the number of series low, e.g. /xc/http-lb/{app_name}/{environment}
+            route = request.scope.get('route')
+            route_path = route.path if route else 'unmatched'
+            queries.endpoint = f'{request.method} {route_path}'
+            span.update_name(queries.endpoint)
+            span.set_attributes({'http.request.method': request.method, 'http.route': route_path,
+                                 'http.response.status_code': response.status_code, 'db.queries': queries.count,
+                                 'db.seconds': queries.seconds})
+        metrics.http_request_seconds.labels(request.method, route_path,
+                                            str(response.status_code)).observe(time.perf_counter() - start)
+        return response
+
+    @api.middleware('http')
+    async def profile_request(request: Request, call_next):
+        """
+        Profile the request if an administrator asks for it with the X-Profile header or the profile query parameter.
+        The profile is stored in the database, its ID is returned in the X-Profile-Id header.
+        """
+        if not profiling.is_requested(request.headers, request.query_params):
+            return await call_next(request)
+        try:
+            _, _, token = request.headers.get('Authorization', '').partition(' ')
+            user = await verify_administrator(await get_current_user(token))
+        except HTTPException as e:
+            return JSONResponse(status_code=e.status_code, content={'detail': e.detail}, headers=e.headers)
+        profile = ProfileSchema(profile_id=uuid.uuid4().hex, target=f'{request.method} {request.url.path}',
+                                requested_by=user.username, created_time=int(round(time.time())))
+        # Read by the endpoints starting background work, e.g. POST /xc/snapshot/now also profiles its job
+        request.state.profile_id = profile.profile_id
+        with profiling.profile(entry_points=route_endpoints(request)) as report:
+            response = await call_next(request)
+        profile.finished_time = int(round(time.time()))
+        profile.status_code = response.status_code
+        profile.report = report
+        await run_in_threadpool(dependency.save_profile, profile)
+        response.headers['X-Profile-Id'] = profile.profile_id
+        return response
+
     return api
 
 
+def route_endpoints(request: Request) -> list:
+    """
+    :return: Endpoint of the route matching the request, the profile only samples the threads running it
+    """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return [route.endpoint] if hasattr(route, 'endpoint') else []
+    return []
+
+
 my_app = create_app()
 my_app.include_router(snapshot_router)
 my_app.include_router(user_router)
 my_app.include_router(app_mgmt_router)
 my_app.include_router(tcp_router)
 my_app.include_router(cdn_router)
+my_app.include_router(rollback_router)
+my_app.include_router(history_router)
 my_app.include_router(websock_router)
+my_app.include_router(metrics_router)
+my_app.include_router(profile_router)
 
 if __name__ == "__main__":
     uvicorn.run('main:my_app', host='0.0.0.0')
@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from sqlalchemy import Index
 from sqlmodel import SQLModel, Field
 
 
@@ -23,3 +24,57 @@ class SnapshotRemarksUpdate(BaseModel):
     version: int | None
     environment: str | None
     remarks: str | None
+
+
+class DependencyIndexSchema(SQLModel, table=True):
+    __tablename__ = "tb_dependency_index"
+    uid: str = Field(primary_key=True)
+    object_kind: str = Field(index=True)
+    object_name: str = Field(index=True)
+    lb_type: str
+    lb_name: str
+    environment: str
+    timestamp: int
+
+
+class SnapshotQueueSchema(SQLModel, table=True):
+    __tablename__ = "tb_snapshot_queue"
+    uid: str = Field(primary_key=True)
+    lb_type: str
+    environment: str
+    lb_name: str
+    queued_time: int
+    due_time: int = Field(index=True)
+
+
+class SchedulerLeaderSchema(SQLModel, table=True):
+    __tablename__ = "tb_scheduler_leader"
+    id: int = Field(primary_key=True)
+    holder: str
+    lease_until: int
+    heartbeat_time: int
+
+
+class VersionHistorySchema(SQLModel, table=True):
+    __tablename__ = "tb_version_history"
+    __table_args__ = (Index("ix_tb_version_history_interval", "valid_from", "valid_to"),)
+    id: int | None = Field(default=None, primary_key=True)
+    lb_type: str
+    environment: str
+    app_name: str = Field(index=True)
+    version: int
+    # The version is current from valid_from (included) to valid_to (excluded). valid_to is empty while it is current.
+    valid_from: int
+    valid_to: int | None = None
+    # snapshot | replace
+    activated_by: str
+
+
+class VersionStateModel(BaseModel):
+    lb_type: str
+    environment: str
+    app_name: str
+    version: int
+    valid_from: int
+    valid_to: int | None = None
+    activated_by: str
@@ -0,0 +1,31 @@
+from typing import Dict
+
+from pydantic import BaseModel
+from sqlalchemy import JSON, Column
+from sqlmodel import Field, SQLModel
+
+
+class ProfileSchema(SQLModel, table=True):
+    __tablename__ = "tb_profiles"
+    profile_id: str = Field(primary_key=True)
+    # e.g. GET /xc/http-lb/compare-version or snapshot job <job_id>
+    target: str
+    # Set for the profile of a snapshot job, empty until the job has run
+    job_id: str | None = Field(default=None, index=True)
+    requested_by: str
+    created_time: int = Field(index=True)
+    finished_time: int | None = None
+    status_code: int | None = None
+    report: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+
+
+class ProfileSummaryModel(BaseModel):
+    profile_id: str
+    target: str
+    job_id: str | None = None
+    requested_by: str
+    created_time: int
+    finished_time: int | None = None
+    status_code: int | None = None
+    duration: float | None = None
+    cpu_seconds: float | None = None
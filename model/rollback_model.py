@@ -0,0 +1,36 @@
+from pydantic import BaseModel
+
+
+class RollbackTarget(BaseModel):
+    lb_type: str
+    app_name: str
+    environment: str
+    target_version: int
+
+
+class RollbackRequest(BaseModel):
+    # Either roll every LB back to the version running at a timestamp, or roll back a list of LB
+    timestamp: int | None = None
+    targets: list[RollbackTarget] | None = None
+    # Only used with timestamp. Every LB type and environment if empty.
+    lb_types: list[str] | None = None
+    environments: list[str] | None = None
+
+
+class RollbackItem(BaseModel):
+    lb_type: str
+    app_name: str
+    environment: str
+    target_version: int | None = None
+    previous_version: int | None = None
+    # replaced | skipped | failed
+    status: str
+    detail: str | None = None
+
+
+class RollbackModel(BaseModel):
+    result: str
+    replaced: int
+    skipped: int
+    failed: int
+    items: list[RollbackItem]
@@ -0,0 +1,86 @@
+from typing import Dict
+
+from pydantic import BaseModel
+from sqlalchemy import JSON, Column
+from sqlmodel import Field, SQLModel
+
+from model.http_model import SnapshotModel
+
+
+class SnapshotJobSchema(SQLModel, table=True):
+    __tablename__ = "tb_snapshot_jobs"
+    job_id: str = Field(primary_key=True)
+    job_type: str
+    trigger: str
+    requested_by: str
+    status: str = Field(index=True)
+    created_time: int
+    started_time: int | None = None
+    finished_time: int | None = None
+    targets: list[list[str]] = Field(default_factory=list, sa_column=Column(JSON))
+    progress: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    result: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    error: str | None = None
+
+
+class SnapshotJobModel(BaseModel):
+    job_id: str
+    job_type: str
+    trigger: str
+    requested_by: str
+    status: str
+    created_time: int
+    started_time: int | None = None
+    finished_time: int | None = None
+    progress: Dict | None = None
+    result: SnapshotModel | None = None
+    error: str | None = None
+
+
+class SnapshotRunSchema(SQLModel, table=True):
+    __tablename__ = "tb_snapshot_runs"
+    # Same as the job ID
+    run_id: str = Field(primary_key=True)
+    job_type: str
+    trigger: str = Field(index=True)
+    requested_by: str
+    status: str
+    started_time: int = Field(index=True)
+    finished_time: int
+    duration: float
+    # LB type: phase (total | fetch | store): seconds
+    phases: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    # Requests, retries, throttled, errors, timeouts, rejected, hedged, bytes received
+    xc: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    # Queries, seconds, rows written
+    db: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    # LB type: environment: new | updated | skipped: count
+    lbs: Dict = Field(default_factory=dict, sa_column=Column(JSON))
+    errors: list[str] = Field(default_factory=list, sa_column=Column(JSON))
+
+
+class SnapshotCheckpointSchema(SQLModel, table=True):
+    __tablename__ = "tb_snapshot_checkpoints"
+    # <sweep_id>:<lb_type>:<environment>:<lb_name>
+    uid: str = Field(primary_key=True)
+    # Job ID of the full snapshot that started the sweep, kept by the jobs resuming it
+    sweep_id: str = Field(index=True)
+    lb_type: str
+    environment: str
+    # Name of the LB as written in XC
+    lb_name: str
+    checkpoint_time: int = Field(index=True)
+
+
+class SnapshotRunChange(BaseModel):
+    metric: str
+    base: float | None = None
+    target: float | None = None
+    change: float | None = None
+    change_percent: float | None = None
+
+
+class SnapshotRunComparisonModel(BaseModel):
+    base: SnapshotRunSchema
+    target: SnapshotRunSchema
+    changes: list[SnapshotRunChange]
@@ -0,0 +1,134 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import dependency
+from helper import lb_types, metrics, tracing
+from helper.xc_client import XCRequestError, xc_max_concurrency
+
+# LB Type: (get the live LB from XC, put the LB to XC, read the LB back after the replace)
+replace_handlers = {
+    lb_types.http: (dependency._get_http_lb, dependency.xc_put_http_load_balancers, dependency.get_http_load_balancer),
+    lb_types.tcp: (dependency._get_tcp_lb, dependency.xc_put_tcp_load_balancers, dependency.get_tcp_load_balancer),
+    lb_types.cdn: (dependency._get_cdn_lb, dependency.xc_put_cdn_load_balancers, dependency.get_cdn_load_balancer),
+}
+# Runs the XC requests of a replace concurrently. XC requests are still limited by the XC client.
+_executor = ThreadPoolExecutor(max_workers=xc_max_concurrency, thread_name_prefix='replace')
+
+
+def replace_span(lb_type: str, environment: str, app_name: str, target_version: int):
+    """
+    Span of a replace-version request. Locking, comparing, pushing, reading back and storing are its children.
+    """
+    return tracing.tracer.start_as_current_span('replace version', attributes={
+        'lb.type': lb_type, 'lb.name': app_name, 'environment': environment, 'version.target': target_version})
+
+
+def submit(function, *args):
+    """
+    Run the function in the executor, as a child of the current span.
+    """
+    return _executor.submit(tracing.in_current_context(function), *args)
+
+
+def live_object(get_object, *args) -> dict | None:
+    """
+    :param get_object: Function getting the object from XC
+    :return: The object as stored in XC, or None if it can't be read (e.g. it was deleted)
+    """
+    try:
+        return get_object(*args)
+    except XCRequestError:
+        return None
+
+
+def is_unchanged(live: dict | None, target: dict) -> bool:
+    """
+    :param live: Object as stored in XC
+    :param target: Replace form of the stored version
+    :return: True if pushing the target would not change anything in XC
+    """
+    return live is not None and live.get('replace_form') == target
+
+
+def count_replaced_objects(lb_type: str, target_origin: list, changed_origin: list, target_waf: dict,
+                           changed_waf: bool, changed_lb: bool):
+    """
+    Count the objects pushed to XC and the ones skipped because they were unchanged, in the metrics.
+    """
+    def count(kind: str, changed: int, total: int):
+        metrics.replace_objects.labels(kind, 'pushed').inc(changed)
+        metrics.replace_objects.labels(kind, 'unchanged').inc(total - changed)
+
+    count(lb_type, int(changed_lb), 1)
+    count(lb_types.origin_pool, len(changed_origin), len(target_origin))
+    if target_waf:
+        count(lb_types.app_firewall, int(changed_waf), 1)
+
+
+def replace_lb(lb_type: str, lb_name: str, target_lb: dict, target_origin: list,
+               target_waf: dict) -> tuple[dict, list, dict]:
+    """
+    Push a stored version of an LB to XC, along with its Origin Pools and App Firewall.
+    Each object is compared with XC first, and only the objects that differ are pushed. Origin Pools and
+    App Firewall are pushed concurrently, before the LB referencing them. Pushed objects are then read back
+    concurrently.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param lb_name: Name of the LB as written in XC
+    :param target_lb: Replace form of the LB
+    :param target_origin: Replace forms of the Origin Pools
+    :param target_waf: Replace form of the App Firewall, empty if the LB has none
+    :return: LB, Origin Pools and App Firewall as stored in XC after the replace
+    :except HTTPException: Raised if XC refuses one of the objects. Objects pushed before are not reverted.
+    """
+    get_live_lb, put_lb, read_lb = replace_handlers[lb_type]
+    namespace = os.getenv('XC_NAMESPACE')
+    tracer = tracing.tracer
+    # Compare every object with XC
+    with tracer.start_as_current_span('compare with XC', attributes={'lb.type': lb_type, 'lb.name': lb_name,
+                                                                     'origin_pools': len(target_origin)}):
+        live_lb = submit(live_object, get_live_lb, namespace, lb_name)
+        live_origin = [submit(live_object, dependency._get_origin_pool, namespace, each['metadata']['name'])
+                       for each in target_origin]
+        live_waf = submit(live_object, dependency.get_app_firewall, namespace,
+                          target_waf['metadata']['name']) if target_waf else None
+        live_lb = live_lb.result()
+        live_origin = [each.result() for each in live_origin]
+        live_waf = live_waf.result() if live_waf else {}
+
+    # Origin Pools and App Firewall first, the LB may reference a new one
+    changed_origin = [index for index, each in enumerate(target_origin) if not is_unchanged(live_origin[index], each)]
+    changed_waf = bool(target_waf) and not is_unchanged(live_waf, target_waf)
+    with tracer.start_as_current_span('push Origin Pools and App Firewall', attributes={
+            'origin_pools.changed': len(changed_origin), 'app_firewall.changed': changed_waf}):
+        set_origin = [submit(dependency.xc_put_origin_pools, [target_origin[index]]) for index in changed_origin]
+        set_waf = submit(dependency.put_app_firewall, target_waf) if changed_waf else None
+        origin_errors = [error for each in set_origin for error in each.result()]
+        if origin_errors:
+            raise HTTPException(status_code=400,
+                                detail=f"Error found during pushing Origin Pools. Errors: {origin_errors}")
+        if set_waf:
+            set_waf = set_waf.result()
+            if set_waf.status_code > 200:
+                raise HTTPException(status_code=set_waf.status_code, detail=set_waf.json())
+
+    changed_lb = not is_unchanged(live_lb, target_lb)
+    count_replaced_objects(lb_type, target_origin, changed_origin, target_waf, changed_waf, changed_lb)
+    if changed_lb:
+        with tracer.start_as_current_span('push LB', attributes={'lb.type': lb_type, 'lb.name': lb_name}):
+            set_lb = put_lb(lb_name, target_lb)
+            if set_lb.status_code > 200:
+                raise HTTPException(status_code=set_lb.status_code,
+                                    detail=f"Error found during pushing Load Balancers. Error: {set_lb.json()}")
+
+    # Read back the pushed objects. The others are unchanged since they were compared.
+    with tracer.start_as_current_span('read back from XC'):
+        get_lb = submit(read_lb, lb_name) if changed_lb else None
+        for index in changed_origin:
+            live_origin[index] = submit(dependency.get_all_origin_pools, target_origin[index]['metadata']['name'])
+        if changed_waf:
+            live_waf = submit(dependency.get_application_firewall, target_waf['metadata']['name'])
+        return (get_lb.result() if get_lb else live_lb,
+                [each.result() if index in changed_origin else each for index, each in enumerate(live_origin)],
+                live_waf.result() if changed_waf else live_waf)
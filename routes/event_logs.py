@@ -1,4 +1,5 @@
 import json
+import os
 import time
 from typing import Annotated, Sequence
 
@@ -8,6 +9,7 @@ from sqlmodel import select, Session
 from starlette import status
 
 import dependency
+from helper import lb_types, log
 from model.generic_model import SchedulerModel
 from model.log_stuff_model import EventLogSchema
 from model.user_model import UserSchema
@@ -15,7 +17,9 @@ from routes.users import get_current_user
 
 router = APIRouter(prefix='/xc/logs', tags=['Event Log Management'])
 engine = dependency.engine
+logger = log.get_logger(__name__)
 delay_in_seconds = 300
+debounce_in_seconds = int(os.getenv("SNAPSHOT_DEBOUNCE_SECONDS", 30))
 
 
 def snapshot_scheduler():
@@ -25,11 +29,59 @@ def snapshot_scheduler():
         stmt: Select = select(SchedulerModel).where(SchedulerModel.id == 1)
         sched: SchedulerModel = session.exec(stmt).first()
         data = sched
-        print(sched.scheduled_time)
         sched.scheduled_time = this_time + delay_in_seconds
         session.commit()
         session.refresh(data)
-    print(data.scheduled_time)
+    logger.debug("Snapshot scheduled at %s", data.scheduled_time)
+
+
+def audit_object_name(json_lines: dict) -> str | None:
+    """
+    Get the name of the changed object from an audit log.
+    :param json_lines: Audit log
+    :return: Name of the object, or None if it can't be found
+    """
+    # Replace and Delete have the name in the path, e.g. /api/config/namespaces/<ns>/origin_pools/<name>
+    path_segments = json_lines.get('req_path', '').split('?')[0].strip('/').split('/')
+    if 'namespaces' in path_segments:
+        namespace_segments = path_segments[path_segments.index('namespaces') + 1:]
+        if len(namespace_segments) >= 3:
+            return namespace_segments[2]
+    # Create only has the name in the request body
+    req_body = json_lines.get('req_body')
+    if isinstance(req_body, str):
+        try:
+            req_body = json.loads(req_body)
+        except ValueError:
+            return None
+    if isinstance(req_body, dict):
+        return req_body.get('metadata', {}).get('name')
+    return None
+
+
+def incremental_snapshot_scheduler(changes: list[tuple[str, str]]):
+    """
+    Queue a snapshot of the Load Balancers affected by the changes found on the audit logs.
+    An Origin Pool or App Firewall that no indexed LB references (e.g. not snapshot yet since it was attached)
+    schedules a full snapshot instead, so the change isn't missed.
+    :param changes: List of (object kind, object name)
+    """
+    targets = []
+    full_snapshot = False
+    for object_kind, object_name in changes:
+        if object_kind in (lb_types.origin_pool, lb_types.app_firewall):
+            dependent_lbs = dependency.find_dependent_lbs(object_kind=object_kind, object_name=object_name)
+            if not dependent_lbs:
+                logger.debug("No LB found referencing %s %s, scheduling a full snapshot", object_kind, object_name)
+                full_snapshot = True
+            targets.extend(dependent_lbs)
+        else:
+            environment = "staging" if object_name.endswith('-staging') else "production"
+            targets.append((object_kind, environment, object_name))
+    if full_snapshot:
+        snapshot_scheduler()
+    if targets:
+        dependency.enqueue_snapshot_targets(targets=targets, debounce=debounce_in_seconds)
 
 
 @router.get('/', description="Get Revision Tool event logs.", response_model=list[EventLogSchema])
@@ -48,10 +100,37 @@ def get_tool_logs(token: Annotated[UserSchema, Depends(get_current_user)]) -> Se
 
 @router.post("/audit", status_code=status.HTTP_202_ACCEPTED, tags=['XC Audit Log Webhook', 'Snapshot'])
 async def webhook_endpoint(request: Request, background_tasks: BackgroundTasks):
+    changes = []
+    deleted_lbs = []
+    full_snapshot = False
     for each in (await request.body()).decode('utf-8').splitlines():
-        print(each)
+        if not each.strip():
+            continue
         json_lines = json.loads(each)
-        if 'rpc' in json_lines and json_lines['rpc'] in dependency.list_rpc:
-            background_tasks.add_task(snapshot_scheduler)
-            return {}
+        if 'rpc' not in json_lines:
+            continue
+        rpc = dependency.match_rpc(json_lines['rpc'])
+        if not rpc:
+            continue
+        if json_lines.get('namespace', os.getenv('XC_NAMESPACE')) != os.getenv('XC_NAMESPACE'):
+            continue
+        object_name = audit_object_name(json_lines)
+        # Objects that are not indexed (e.g. health checks) still require a full snapshot
+        if rpc not in dependency.rpc_object_kinds or not object_name:
+            full_snapshot = True
+            continue
+        object_kind = dependency.rpc_object_kinds[rpc]
+        # A deleted LB can't be snapshot, the objects it referenced no longer depend on it
+        if object_kind in (lb_types.http, lb_types.tcp, lb_types.cdn) and json_lines['rpc'].endswith('.Delete'):
+            deleted_lbs.append((object_kind, object_name))
+            continue
+        changes.append((object_kind, object_name))
+    for object_kind, object_name in deleted_lbs:
+        background_tasks.add_task(dependency.refresh_dependency_index, object_kind, [object_name], [])
+    if full_snapshot:
+        background_tasks.add_task(snapshot_scheduler)
+    if changes:
+        background_tasks.add_task(incremental_snapshot_scheduler, changes)
+    if full_snapshot or changes or deleted_lbs:
+        return {}
     return {"res": "ok"}
@@ -0,0 +1,25 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends
+
+import dependency
+from model.generic_model import VersionStateModel
+from model.user_model import UserSchema
+from routes.users import get_current_user
+
+router = APIRouter(prefix='/xc/history', tags=['Version History'])
+
+
+@router.get('/', response_model=list[VersionStateModel], response_model_exclude_none=True)
+def state_at(token: Annotated[UserSchema, Depends(get_current_user)], timestamp: int, lb_type: str | None = None,
+             environment: str | None = None):
+    """
+    Version of every LB that was running at a point in time.
+    :param token: Verify if user is authenticated
+    :param timestamp: Point in time
+    :param lb_type: (Optional) Only this type of LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: (Optional) Only this environment (staging | production)
+    :return: Version of each LB, and since when it was running
+    """
+    return [VersionStateModel(**history.model_dump())
+            for history in dependency.versions_at(timestamp, lb_type=lb_type, environment=environment)]
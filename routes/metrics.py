@@ -0,0 +1,108 @@
+import os
+from typing import Annotated
+
+from fastapi import APIRouter, Header, HTTPException, Response
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from sqlalchemy import func
+from sqlalchemy.exc import SQLAlchemyError
+from sqlmodel import Session, select
+from starlette import status
+
+import dependency
+import snapshot_worker
+from helper import snapshot_job
+from helper.xc_client import xc_stats
+from model.generic_model import SnapshotQueueSchema
+from model.snapshot_model import SnapshotJobSchema
+
+router = APIRouter(tags=['Metrics'])
+# Bearer token required by /metrics. Empty means the endpoint is open, e.g. behind a private network.
+metrics_token = os.getenv("METRICS_TOKEN", "")
+# Numeric value of the circuit breaker states
+breaker_states = {'closed': 0, 'half-open': 1, 'open': 2}
+
+
+class XCClientCollector:
+    """
+    Counters and limits of the XC client, read from xc_stats() when scraped. The process label tells the API worker
+    from its snapshot worker process, each has its own share of the XC budget.
+    """
+
+    def collect(self):
+        processes = {'api': xc_stats()}
+        worker_stats = snapshot_worker.worker_xc_stats()
+        if worker_stats is not None:
+            processes['snapshot_worker'] = worker_stats
+        for name in ('requests', 'retries', 'throttled', 'errors', 'timeouts', 'rejected', 'hedged'):
+            counter = CounterMetricFamily(f'xc_client_{name}', f'XC client {name} since the process started',
+                                          labels=['process'])
+            for process, stats in processes.items():
+                counter.add_metric([process], stats[name])
+            yield counter
+        gauges = {'concurrency_limit': ('xc_client_concurrency_limit', 'Current limit of concurrent XC requests'),
+                  'in_flight': ('xc_client_in_flight', 'XC requests in flight'),
+                  'rate_limit': ('xc_client_rate_limit', 'XC requests per second allowed to the process'),
+                  'tokens': ('xc_client_rate_tokens', 'Tokens left in the XC rate limiter'),
+                  'breaker': ('xc_client_breaker_state', 'Circuit breaker state (0 closed, 1 half-open, 2 open)')}
+        for field, (metric, documentation) in gauges.items():
+            gauge = GaugeMetricFamily(metric, documentation, labels=['process'])
+            for process, stats in processes.items():
+                value = breaker_states.get(stats[field], -1) if field == 'breaker' else stats[field]
+                gauge.add_metric([process], value)
+            yield gauge
+
+
+class QueueCollector:
+    """
+    Depth of the snapshot queues, counted in the database when scraped.
+    """
+
+    def collect(self):
+        try:
+            with Session(dependency.engine) as session:
+                targets = session.exec(select(func.count()).select_from(SnapshotQueueSchema)).one()
+                jobs = dict(session.exec(select(SnapshotJobSchema.status, func.count()).where(
+                    SnapshotJobSchema.status.in_([snapshot_job.queued, snapshot_job.running])).group_by(
+                    SnapshotJobSchema.status)).all())
+        except SQLAlchemyError:
+            # The other metrics are still useful while the database is unreachable
+            return
+        yield GaugeMetricFamily('snapshot_queue_targets', 'LB queued by the audit log webhook, waiting for their '
+                                                          'debounce window', value=targets)
+        gauge = GaugeMetricFamily('snapshot_jobs', 'Snapshot jobs by status', labels=['status'])
+        for job_status in (snapshot_job.queued, snapshot_job.running):
+            gauge.add_metric([job_status], jobs.get(job_status, 0))
+        yield gauge
+
+
+REGISTRY.register(XCClientCollector())
+REGISTRY.register(QueueCollector())
+
+
+def _registry() -> CollectorRegistry:
+    """
+    :return: The default registry, or with PROMETHEUS_MULTIPROC_DIR the metrics written by every process of the
+    directory (the API workers and their snapshot worker processes) plus the collectors read when scraped
+    """
+    if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    registry.register(XCClientCollector())
+    registry.register(QueueCollector())
+    return registry
+
+
+@router.get('/metrics', include_in_schema=False)
+def prometheus_metrics(authorization: Annotated[str | None, Header()] = None):
+    """
+    Metrics of this worker in the Prometheus text format.
+    :param authorization: Bearer METRICS_TOKEN, if it is set
+    :return: XC, database, API and snapshot metrics
+    :except HTTPException: Raised if METRICS_TOKEN is set and the token doesn't match
+    """
+    if metrics_token and authorization != f'Bearer {metrics_token}':
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid metrics token',
+                            headers={"WWW-Authenticate": "Bearer"})
+    return Response(content=generate_latest(_registry()), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,74 @@
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import PlainTextResponse
+from sqlmodel import Session, select
+from starlette import status
+
+from dependency import engine
+from model.profile_model import ProfileSchema, ProfileSummaryModel
+from model.user_model import UserSchema
+from routes.users import verify_administrator
+
+router = APIRouter(prefix='/mgmt/profiles', tags=['Profiling'])
+
+
+def get_profile(profile_id: str) -> ProfileSchema:
+    with Session(engine) as session:
+        profile = session.get(ProfileSchema, profile_id)
+    if not profile:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Profile is not found.")
+    return profile
+
+
+@router.get('/', response_model=list[ProfileSummaryModel], response_model_exclude_none=True)
+def list_profiles(token: Annotated[UserSchema, Depends(verify_administrator)], job_id: str | None = None,
+                  limit: int = 20):
+    """
+    List the most recent profiles. Add the X-Profile: 1 header or the profile=1 query parameter to any request
+    to profile it. Profiling POST /xc/snapshot/now also profiles the snapshot job it queues.
+    :param token: Verify if user is an administrator
+    :param job_id: (Optional) Only the profile of this snapshot job
+    :param limit: Number of profiles to list
+    :return: Profiles without their report, the newest first
+    """
+    with Session(engine) as session:
+        stmt = select(ProfileSchema).order_by(ProfileSchema.created_time.desc()).limit(limit)
+        if job_id:
+            stmt = stmt.where(ProfileSchema.job_id == job_id)
+        profiles = session.exec(stmt).all()
+    return [ProfileSummaryModel(**profile.model_dump(exclude={'report'}),
+                                duration=profile.report.get('duration'), cpu_seconds=profile.report.get('cpu_seconds'))
+            for profile in profiles]
+
+
+@router.get('/{profile_id}', response_model=ProfileSchema)
+def show_profile(token: Annotated[UserSchema, Depends(verify_administrator)], profile_id: str):
+    """
+    Show a profile: the most expensive functions, the sampled stacks and the allocations.
+    The report is empty until the profiled snapshot job has run.
+    :param token: Verify if user is an administrator
+    :param profile_id: ID of the profile, returned in the X-Profile-Id header of the profiled request
+    :return: Profile and its report
+    :except HTTPException: Raised if the profile is not found
+    """
+    return get_profile(profile_id)
+
+
+@router.get('/{profile_id}/collapsed', response_class=PlainTextResponse)
+def collapsed_stacks(token: Annotated[UserSchema, Depends(verify_administrator)], profile_id: str,
+                     weight: str = 'cpu'):
+    """
+    Sampled stacks in the collapsed format read by flame graph tools (flamegraph.pl, speedscope).
+    :param token: Verify if user is an administrator
+    :param profile_id: ID of the profile
+    :param weight: cpu (CPU microseconds) | samples (wall clock samples)
+    :return: One line per stack: the functions separated by ';', then its weight
+    :except HTTPException: Raised if the profile is not found or the weight is invalid
+    """
+    if weight not in ('cpu', 'samples'):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Bad weight. Options: (cpu | samples)")
+    stacks = get_profile(profile_id).report.get('stacks', [])
+    lines = [f"{each['stack']} {round(each['cpu'] * 1000000) if weight == 'cpu' else each['samples']}"
+             for each in stacks]
+    return '\n'.join(line for line in lines if not line.endswith(' 0')) + '\n'
@@ -0,0 +1,134 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Annotated
+
+from fastapi import APIRouter, HTTPException, Depends, Response
+from sqlmodel import Session, select
+from starlette import status
+
+import dependency
+from helper import event_type, environments, lb_types, log, tracing
+from model.cdn_model import CDNLBVersionSchema, ReplaceCDNLbPolicySchema
+from model.http_model import HttpLBVersionSchema, ReplaceHttpLbPolicySchema
+from model.log_stuff_model import EventLogSchema
+from model.rollback_model import RollbackRequest, RollbackTarget, RollbackItem, RollbackModel
+from model.tcp_model import TcpLbVersionSchema, ReplaceTcpLbPolicySchema
+from model.user_model import UserSchema
+from routes import cdn_lb, http_lb, tcp_lb
+from routes.users import verify_administrator
+
+router = APIRouter(prefix='/xc/rollback', tags=['Replace Version'])
+engine = dependency.engine
+logger = log.get_logger(__name__)
+# Number of LB replaced at the same time
+max_parallel_rollbacks = int(os.getenv("ROLLBACK_MAX_PARALLEL", 4))
+# LB Type: (replace of replace-version, without pausing the scheduled snapshot, replace form, version table,
+# name column)
+rollback_handlers = {
+    lb_types.http: (http_lb.replace_lb_version, ReplaceHttpLbPolicySchema, HttpLBVersionSchema, 'app_name'),
+    lb_types.tcp: (tcp_lb.replace_lb_version, ReplaceTcpLbPolicySchema, TcpLbVersionSchema, 'tcp_lb_name'),
+    lb_types.cdn: (cdn_lb.replace_lb_version, ReplaceCDNLbPolicySchema, CDNLBVersionSchema, 'cdn_lb_name'),
+}
+
+
+def current_versions(lb_type: str, environment: str) -> dict[str, int]:
+    """
+    :return: LB name: version currently running
+    """
+    _, _, version_schema, name_column = rollback_handlers[lb_type]
+    with Session(engine) as session:
+        rows = session.exec(select(getattr(version_schema, name_column), version_schema.current_version).where(
+            version_schema.environment == environment)).all()
+    return dict(rows)
+
+
+def plan_rollback(form: RollbackRequest) -> tuple[list[RollbackTarget], list[RollbackItem]]:
+    """
+    List the LB to roll back.
+    :param form: Rollback request
+    :return: LB to replace, and LB skipped because they are already running the target version or didn't exist
+    """
+    if form.targets is not None:
+        return form.targets, []
+    targets = []
+    skipped = []
+    for lb_type in form.lb_types or rollback_handlers.keys():
+        for environment in form.environments or environments.environments:
+            target_versions = {history.app_name: history.version
+                               for history in dependency.versions_at(form.timestamp, lb_type, environment)}
+            for app_name, current_version in current_versions(lb_type, environment).items():
+                target_version = target_versions.get(app_name)
+                if target_version is None:
+                    skipped.append(RollbackItem(lb_type=lb_type, app_name=app_name, environment=environment,
+                                                previous_version=current_version, status='skipped',
+                                                detail='No version was running at the timestamp'))
+                elif target_version == current_version:
+                    skipped.append(RollbackItem(lb_type=lb_type, app_name=app_name, environment=environment,
+                                                target_version=target_version, previous_version=current_version,
+                                                status='skipped', detail='Already running this version'))
+                else:
+                    targets.append(RollbackTarget(lb_type=lb_type, app_name=app_name, environment=environment,
+                                                  target_version=target_version))
+    return targets, skipped
+
+
+def rollback_target(token: UserSchema, target: RollbackTarget) -> RollbackItem:
+    """
+    Replace a single LB like replace-version. The scheduled snapshot is paused by fleet_rollback for every LB at
+    once. Errors are reported in the result instead of raised.
+    """
+    replace, replace_form = rollback_handlers[target.lb_type][:2]
+    item = RollbackItem(**target.model_dump(), status='replaced')
+    try:
+        with Session(engine) as session:
+            replace(token=token, session=session,
+                    form=replace_form(app_name=target.app_name, environment=target.environment,
+                                      target_version=target.target_version))
+    except HTTPException as e:
+        item.status = 'failed'
+        item.detail = str(e.detail)
+    except Exception as e:
+        logger.warning("Rollback of %s %s on %s failed: %s", target.lb_type, target.app_name, target.environment, e,
+                       extra={'lb_type': target.lb_type, 'app_name': target.app_name,
+                              'environment': target.environment})
+        item.status = 'failed'
+        item.detail = str(e)
+    return item
+
+
+@router.post('/', response_model=RollbackModel, response_model_exclude_none=True)
+def fleet_rollback(token: Annotated[UserSchema, Depends(verify_administrator)], form: RollbackRequest,
+                   response: Response):
+    """
+    Roll back several LB at once, either to the version each one was running at a timestamp,
+    or to the versions listed in targets. LB are replaced concurrently, a failing LB doesn't stop the others.
+    :param token: Verify if user is an administrator
+    :param form: Timestamp or targets. lb_types and environments narrow down a rollback to a timestamp.
+    :param response: Status is 207 if some of the LB failed
+    :return: Result of each LB
+    """
+    if (form.timestamp is None) == (form.targets is None):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail='Either timestamp or targets is required.')
+    for lb_type in [each.lb_type for each in form.targets or []] + (form.lb_types or []):
+        if lb_type not in rollback_handlers:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Unknown LB type {lb_type}.')
+    targets, skipped = plan_rollback(form)
+    # Paused until every LB is replaced, not resumed by the first one done
+    with tracing.tracer.start_as_current_span('fleet rollback', attributes={'targets': len(targets)}), \
+            dependency.auto_snapshot_paused(), \
+            ThreadPoolExecutor(max_workers=max_parallel_rollbacks, thread_name_prefix='rollback') as executor:
+        futures = [executor.submit(tracing.in_current_context(rollback_target), token, target) for target in targets]
+        items = [future.result() for future in futures]
+    replaced = sum(each.status == 'replaced' for each in items)
+    failed = len(items) - replaced
+    dependency.log_stuff(
+        EventLogSchema(event_type=event_type.FLEET_ROLLBACK, timestamp=int(round(time.time())),
+                       description=f'User {token.username} rolled back {replaced} Load Balancers'
+                                   f'{f" to {form.timestamp}" if form.timestamp is not None else ""}, '
+                                   f'{failed} failed.'))
+    if failed:
+        response.status_code = status.HTTP_207_MULTI_STATUS
+    return RollbackModel(result='Rollback completed.' if not failed else 'Rollback partially failed.',
+                         replaced=replaced, skipped=len(skipped), failed=failed, items=items + skipped)
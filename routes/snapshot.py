@@ -1,161 +1,210 @@
-import os
+import asyncio
 import time
 from typing import Annotated
 
-import requests
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from sqlmodel import select, SQLModel, Session
 from starlette import status
-from starlette.responses import Response
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
 
 import dependency
+import snapshot_jobs
+import snapshot_worker
 from dependency import engine, log_stuff
-from helper import event_type, environments, lb_types
+from helper import event_type, environments, lb_types, log, snapshot_job
+from helper.xc_client import xc_stats
 from model.cdn_model import CDNLBProductionRevSchema, CDNLBStagingRevSchema
 from model.generic_model import SnapRemarksUid
 from model.http_model import SnapshotModel, SnapshotContents, SnapshotValueModel, HttpLbProductionRevisionSchema, \
     HttpLbStagingRevisionSchema
 from model.log_stuff_model import EventLogSchema
+from model.snapshot_model import SnapshotJobModel, SnapshotRunSchema, SnapshotRunComparisonModel
 from model.tcp_model import TcpLbProductionRevSchema, TcpLbStagingRevSchema
 from model.user_model import UserSchema
-from routes.users import verify_administrator
+from routes.users import verify_administrator, get_current_user
+from snapshot_pipeline import run_targeted_snapshot, snapshot_handlers
 
 router = APIRouter(prefix='/xc', tags=['Snapshot'])
+logger = log.get_logger(__name__)
 
 
 # Start Snapshot
-@router.post('/snapshot/now', status_code=201, response_model=SnapshotModel,
+@router.post('/snapshot/now', status_code=status.HTTP_202_ACCEPTED, response_model=SnapshotJobModel,
              response_model_exclude_none=True)
-def manual_snapshot(token: Annotated[str, Depends(verify_administrator)], response: Response):
+def manual_snapshot(token: Annotated[UserSchema, Depends(verify_administrator)], request: Request,
+                    response: Response):
     """
-    Starts a manual snapshot of all LB.
-    :param response: Response if Snapshot didn't find an update.
+    Queues a manual snapshot of all LB. The snapshot runs in the background,
+    follow it with /xc/snapshot/jobs/{job_id} or /xc/snapshot/jobs/{job_id}/stream.
+    If a snapshot of all LB is already queued or running, that job is returned instead.
+    If the request is profiled (X-Profile header or profile query parameter), the queued job is profiled too,
+    its profile ID is returned in the X-Job-Profile-Id header.
     :param token: Verify if user is an administrator
-    :return: Snapshot model data
-    :rtype: SnapshotModel
+    :param request: Request, tells if it is profiled
+    :param response: Response, receives the X-Job-Profile-Id header
+    :return: The queued snapshot job
+    :rtype: SnapshotJobModel
     """
-    # List all HTTP Load Balancer
     dependency.log_stuff(
         EventLogSchema(event_type=event_type.MANUAL_SNAPSHOT, timestamp=int(round(time.time())),
                        description=f'User {token.username} triggered a snapshot.'
                        ))
-    http_lb_url = f'{os.getenv("XC_URL")}/api/config/namespaces/{os.getenv("XC_NAMESPACE")}/http_loadbalancers?report_fields=string'
-    api_token = os.getenv('XC_APITOKEN')
-    headers = {"Authorization": f"APIToken {api_token}", "x-volterra-apigw-tenant": f"{os.getenv('XC_TENANT')}",
-               "accept": "application/json", "Access-Control-Allow-Origin": "*"}
-    lb_http_req = requests.get(http_lb_url, headers=headers)
-    # If APIToken is expired, or accessing the wrong namespace/endpoint
-    if lb_http_req.status_code > 200:
-        return HTTPException(status_code=lb_http_req.status_code, detail=lb_http_req.json())
-    map_lb_http = lb_http_req.json()
-    # Get production first
-    http_new_prd, http_exist_prd = dependency.get_http_lb_data(username=token.username,
-                                                               namespace=os.getenv('XC_NAMESPACE'),
-                                                               environment="production",
-                                                               load_balancer_list=map_lb_http)
-    if dependency.echo: print(f'new data in prod: {http_new_prd}\nexist data: {http_exist_prd}')
-    dependency.push_http_lb_to_db(environment="production", new_data=http_new_prd, exist_data=http_exist_prd)
-    # Get staging
-    http_new_stg, http_exist_stg = dependency.get_http_lb_data(username=token.username,
-                                                               namespace=os.getenv('XC_NAMESPACE'),
-                                                               environment="staging",
-                                                               load_balancer_list=map_lb_http)
-    dependency.push_http_lb_to_db(environment="staging", new_data=http_new_stg, exist_data=http_exist_stg)
-    if dependency.echo: print(f'new data in stg: {http_new_stg}\nexist update in stg: {http_exist_stg}')
-    # TCP LB
-    tcp_lb_url = f'{os.getenv("XC_URL")}/api/config/namespaces/{os.getenv("XC_NAMESPACE")}/tcp_loadbalancers?report_fields=string'
-    tcp_lb_req = requests.get(url=tcp_lb_url, headers=headers)
-    if tcp_lb_req.status_code > 200:
-        return HTTPException(status_code=tcp_lb_req.status_code, detail=tcp_lb_req.json())
-    map_lb_tcp = tcp_lb_req.json()
-    tcp_new_prd, tcp_exist_prd = dependency.get_tcp_lb_data(username=token.username,
-                                                            namespace=os.getenv('XC_NAMESPACE'),
-                                                            environment="production",
-                                                            tcp_lb_list=map_lb_tcp)
-    dependency.push_tcp_lb_to_db(environment="production", new_data=tcp_new_prd, exist_data=tcp_exist_prd)
-    tcp_new_stg, tcp_exist_stg = dependency.get_tcp_lb_data(username=token.username,
-                                                            namespace=os.getenv('XC_NAMESPACE'),
-                                                            environment="staging",
-                                                            tcp_lb_list=map_lb_tcp)
-    dependency.push_tcp_lb_to_db(environment="staging", new_data=tcp_new_stg, exist_data=tcp_exist_stg)
-
-    # Get CDN Load Balancers
-    cdn_lb_url = f'{os.getenv("XC_URL")}/api/config/namespaces/{os.getenv("XC_NAMESPACE")}/cdn_loadbalancers?report_fields=string'
-    cdn_lb_req = requests.get(cdn_lb_url, headers=headers)
-    map_lb_cdn = cdn_lb_req.json()
-    cdn_new_prd, cdn_exist_prd = dependency.get_cdn_lb_data(username=token.username,
-                                                            namespace=os.getenv('XC_NAMESPACE'),
-                                                            environment="production",
-                                                            cdn_lb_list=map_lb_cdn)
-    cdn_new_stg, cdn_exist_stg = dependency.get_cdn_lb_data(username=token.username,
-                                                            namespace=os.getenv('XC_NAMESPACE'),
-                                                            environment="staging",
-                                                            cdn_lb_list=map_lb_cdn)
-    dependency.push_cdn_lb_to_db(environment="production", new_data=cdn_new_prd, exist_data=cdn_exist_prd)
-    dependency.push_cdn_lb_to_db(environment="staging", new_data=cdn_new_stg, exist_data=cdn_exist_stg)
-    # todo: get healthcheck and service policy push to DB
-    # todo: request a remark from the user after a manual snapshot.
-    # If all of them are empty
-    http_lb_empty = not http_new_prd and not http_new_stg and not http_exist_prd and not http_exist_stg
-    tcp_lb_empty = not tcp_new_prd and not tcp_new_stg and not tcp_exist_prd and not tcp_exist_stg
-    cdn_lb_empty = not cdn_new_prd and not cdn_new_stg and not cdn_exist_prd and not cdn_exist_stg
-
-    if http_lb_empty and tcp_lb_empty and cdn_lb_empty:
-        return SnapshotModel(result='No updates found')
-
-    snapshot_http_new_prd = list_app_and_version(app_list=http_new_prd, lb_type='http')
-    snapshot_http_exist_prd = list_app_and_version(http_exist_prd, lb_type='http')
-    snapshot_http_new_stg = list_app_and_version(http_new_stg, lb_type='http')
-    snapshot_http_exist_stg = list_app_and_version(http_exist_stg, lb_type='http')
-    snapshot_model_http = SnapshotValueModel(new_prod=snapshot_http_new_prd, new_staging=snapshot_http_new_stg,
-                                             update_prod=snapshot_http_exist_prd,
-                                             update_staging=snapshot_http_exist_stg)
-
-    snapshot_tcp_new_prd = list_app_and_version(tcp_new_prd, lb_type='tcp')
-    snapshot_tcp_exist_prd = list_app_and_version(tcp_exist_prd, lb_type='tcp')
-    snapshot_tcp_new_stg = list_app_and_version(tcp_new_stg, lb_type='tcp')
-    snapshot_tcp_exist_stg = list_app_and_version(tcp_exist_stg, lb_type='tcp')
-    snapshot_model_tcp = SnapshotValueModel(new_prod=snapshot_tcp_new_prd, new_staging=snapshot_tcp_new_stg,
-                                            update_prod=snapshot_tcp_exist_prd,
-                                            update_staging=snapshot_tcp_exist_stg)
-
-    snapshot_cdn_new_prd = list_app_and_version(cdn_new_prd, lb_type='cdn')
-    snapshot_cdn_exist_prd = list_app_and_version(cdn_exist_prd, lb_type='cdn')
-    snapshot_cdn_new_stg = list_app_and_version(cdn_new_stg, lb_type='cdn')
-    snapshot_cdn_exist_stg = list_app_and_version(cdn_exist_stg, lb_type='cdn')
-    snapshot_model_cdn = SnapshotValueModel(new_prod=snapshot_cdn_new_prd, new_staging=snapshot_cdn_new_stg,
-                                            update_prod=snapshot_cdn_exist_prd,
-                                            update_staging=snapshot_cdn_exist_stg)
-
-    return SnapshotModel(result="Updates found.",
-                         http_lb=snapshot_model_http,
-                         tcp_lb=snapshot_model_tcp,
-                         cdn_lb=snapshot_model_cdn)
-
-
-def list_app_and_version(app_list: list, lb_type: str):
-    #     name: str
-    #     new_version: int
-    #     previous_version: int = 0
-    if lb_type == "tcp":
-        lb_name = "tcp_lb_name"
-    elif lb_type == "cdn":
-        lb_name = "cdn_lb_name"
-    else:
-        lb_name = "app_name"
-    apps: list[SnapshotContents] = []
-
-    for each in app_list:
-        apps.append(SnapshotContents(name=each[lb_name], new_version=each['version'],
-                                     previous_version=(
-                                         each['previous_version']) if 'previous_version' in each else None))
-    return apps
+    job = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.manual, username=token.username)
+    if getattr(request.state, 'profile_id', None):
+        profile = snapshot_jobs.request_job_profile(job, token.username)
+        if profile:
+            response.headers['X-Job-Profile-Id'] = profile.profile_id
+    return snapshot_jobs.job_model(job)
+
+
+@router.get('/snapshot/jobs', response_model=list[SnapshotJobModel], response_model_exclude_none=True)
+def list_snapshot_jobs(token: Annotated[UserSchema, Depends(get_current_user)], limit: int = 20):
+    """
+    List the most recent snapshot jobs.
+    :param token: Verify if user is authenticated
+    :param limit: Number of jobs to list
+    :return: List of snapshot jobs, the newest first
+    """
+    return [snapshot_jobs.job_model(job) for job in snapshot_jobs.list_jobs(limit=limit)]
+
+
+@router.get('/snapshot/jobs/{job_id}', response_model=SnapshotJobModel, response_model_exclude_none=True)
+def get_snapshot_job(token: Annotated[UserSchema, Depends(get_current_user)], job_id: str):
+    """
+    Get the status, progress and result of a snapshot job.
+    :param token: Verify if user is authenticated
+    :param job_id: ID of the snapshot job
+    :return: Snapshot job
+    """
+    job = snapshot_jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot job is not found.")
+    return snapshot_jobs.job_model(job)
+
+
+@router.get('/snapshot/jobs/{job_id}/stream')
+async def stream_snapshot_job(token: Annotated[UserSchema, Depends(get_current_user)], job_id: str):
+    """
+    Stream the progress of a snapshot job as Server-Sent Events, until the job is finished.
+    :param token: Verify if user is authenticated
+    :param job_id: ID of the snapshot job
+    :return: Event stream of the snapshot job
+    """
+    if not await run_in_threadpool(snapshot_jobs.get_job, job_id):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot job is not found.")
+
+    async def job_events():
+        last_event = None
+        while True:
+            job = await run_in_threadpool(snapshot_jobs.get_job, job_id)
+            event = snapshot_jobs.job_model(job).model_dump_json(exclude_none=True)
+            if event != last_event:
+                yield f"data: {event}\n\n"
+                last_event = event
+            if job.status in snapshot_job.finished:
+                return
+            await asyncio.sleep(snapshot_jobs.progress_interval)
+
+    return StreamingResponse(job_events(), media_type='text/event-stream')
+
+
+@router.get('/snapshot/runs', response_model=list[SnapshotRunSchema])
+def list_snapshot_runs(token: Annotated[UserSchema, Depends(get_current_user)], limit: int = 20,
+                       trigger: str | None = None, job_type: str | None = None):
+    """
+    List the reports of the most recent snapshot runs: timings of each phase, XC requests and bytes received,
+    SQL statements and rows written, LB new, updated and skipped, and errors.
+    :param token: Verify if user is authenticated
+    :param limit: Number of runs to list
+    :param trigger: (Optional) Only the runs triggered by manual | scheduler | webhook
+    :param job_type: (Optional) Only the full | targeted runs
+    :return: List of snapshot run reports, the newest first
+    """
+    return snapshot_jobs.list_runs(limit=limit, trigger=trigger, job_type=job_type)
+
+
+@router.get('/snapshot/runs/compare', response_model=SnapshotRunComparisonModel)
+def compare_snapshot_runs(token: Annotated[UserSchema, Depends(get_current_user)], target: str,
+                          base: str | None = None):
+    """
+    Compare the reports of two snapshot runs.
+    :param token: Verify if user is authenticated
+    :param target: ID of the run to compare
+    :param base: (Optional) ID of the run compared against. Defaults to the previous run of the same job type.
+    :return: Both reports and the change of each number from base to target
+    :except HTTPException: Raised if a run is not found
+    """
+    target_run = snapshot_jobs.get_run(target)
+    base_run = (snapshot_jobs.get_run(base) if base else snapshot_jobs.previous_run(target_run)) if target_run else None
+    if not target_run or not base_run:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot run is not found.")
+    return SnapshotRunComparisonModel(base=base_run, target=target_run,
+                                      changes=snapshot_jobs.compare_runs(base_run, target_run))
+
+
+@router.get('/snapshot/runs/{run_id}', response_model=SnapshotRunSchema)
+def get_snapshot_run(token: Annotated[UserSchema, Depends(get_current_user)], run_id: str):
+    """
+    Get the report of a snapshot run. The run ID is the ID of its snapshot job.
+    :param token: Verify if user is authenticated
+    :param run_id: ID of the snapshot run
+    :return: Snapshot run report
+    """
+    run = snapshot_jobs.get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Snapshot run is not found.")
+    return run
+
+
+@router.get('/client/stats')
+def xc_client_stats(token: Annotated[UserSchema, Depends(verify_administrator)]):
+    """
+    Counters and current limits of the XC client in this worker, and in its snapshot worker process under
+    snapshot_worker (SNAPSHOT_WORKER=process).
+    :param token: Verify if user is an administrator
+    :return: Requests sent, retries, throttled responses, errors, concurrency limit and rate limit
+    """
+    stats = xc_stats()
+    worker_stats = snapshot_worker.worker_xc_stats()
+    if worker_stats is not None:
+        stats['snapshot_worker'] = worker_stats
+    return stats
+
+
+@router.post('/snapshot/{lb_type}/{environment}/{lb_name}', status_code=201, response_model=SnapshotModel,
+             response_model_exclude_none=True)
+def targeted_snapshot(token: Annotated[UserSchema, Depends(verify_administrator)], lb_type: str, environment: str,
+                      lb_name: str):
+    """
+    Starts a snapshot of a single LB, along with the Origin Pools and App Firewall it references.
+    :param token: Verify if user is an administrator
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB (staging | production)
+    :param lb_name: Name of the LB as written in XC
+    :return: Snapshot model data
+    :rtype: SnapshotModel
+    """
+    if lb_type not in snapshot_handlers:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Invalid LB Types')
+    if environment not in environments.environments:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail="Bad environment syntax. Options: (staging | production)")
+    if lb_name.endswith('-staging') != (environment == environments.staging):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"{lb_name} does not belong to the {environment} environment")
+    dependency.log_stuff(
+        EventLogSchema(event_type=event_type.TARGETED_SNAPSHOT, timestamp=int(round(time.time())),
+                       environment=environment,
+                       description=f'User {token.username} triggered a snapshot of {lb_type} {lb_name}.'
+                       ))
+    return run_targeted_snapshot(lb_type=lb_type, environment=environment, lb_name=lb_name,
+                                 username=token.username)
 
 
 @router.put('/snapshot/remarks')
 def snapshot_remarks_by_uid(query: SnapRemarksUid, token: Annotated[UserSchema, Depends(verify_administrator)]):
     name, environment, lb_type = '', '', ''
-    print(query.lb_type)
     uid = query.uid
     environment = query.environment
     if query.lb_type not in lb_types.types:
@@ -180,20 +229,16 @@ def snapshot_remarks_by_uid(query: SnapRemarksUid, token: Annotated[UserSchema,
     stmt_uid = select(q2).where(q2.uid == uid)
     with Session(engine) as session:
         act: q2 = session.exec(stmt_uid).first()
-        print(act)
         act.remarks = query.remarks
         session.commit()
         session.refresh(act)
     dump = act.model_dump()
     name = ''
     if 'app_name' in dump:
-        print('app_name')
         name = dump['app_name']
     elif 'tcp_lb_name' in dump:
-        print('tcp_lb_name')
         name = dump['tcp_lb_name']
     elif 'cdn_lb_name' in dump:
-        print('cdn_lb_name')
         name = dump['cdn_lb_name']
     log_stuff(EventLogSchema(event_type=event_type.SNAPSHOT, timestamp=int(round(time.time())),
                              environment=environment,
@@ -204,7 +249,7 @@ def snapshot_remarks_by_uid(query: SnapRemarksUid, token: Annotated[UserSchema,
 
 @router.put('/snapshot/remarks/demo')
 def snapshot_remarks_demo(query: SnapRemarksUid):
-    print(query)
+    logger.debug("Snapshot remarks demo: %s", query)
     return {}
 
 
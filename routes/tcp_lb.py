@@ -11,7 +11,8 @@ from starlette import status
 
 import dependency
 import metadata
-from helper import event_type
+import replace_executor
+from helper import event_type, lb_types, log, tracing
 from model.log_stuff_model import EventLogSchema
 from model.tcp_model import TcpLbVersionSchema, TcpLbStagingRevSchema, TcpLbProductionRevSchema, \
     ReplaceTcpLbPolicySchema
@@ -20,6 +21,7 @@ from routes.users import get_current_user, verify_administrator
 load_dotenv()
 router = APIRouter(prefix='/xc/tcp-lb', tags=['TCP Load Balancer Management'])
 engine = dependency.engine
+logger = log.get_logger(__name__)
 
 
 @router.get('/', description='List HTTP Load Balancers')
@@ -64,33 +66,47 @@ def get_tcp_load_balancer(token: Annotated[str, Depends(get_current_user)], app_
 
 @router.post('/replace-version', tags=['Replace Version'])
 def replace_version_tcp_load_balancer(token: Annotated[str, Depends(verify_administrator)],
-                                      form: ReplaceTcpLbPolicySchema):
-    dependency.auto_snapshot_pause(True)
+                                      form: ReplaceTcpLbPolicySchema,
+                                      session: Annotated[Session, Depends(dependency.get_session)]):
+    with dependency.auto_snapshot_paused():
+        return replace_lb_version(token, form, session)
+
+
+def replace_lb_version(token, form: ReplaceTcpLbPolicySchema, session: Session):
+    """
+    Replace the LB with one of its versions. The scheduled snapshot is paused by the caller.
+    """
+    # Replacing and snapshotting the same LB are serialized, across every worker process
+    with replace_executor.replace_span(lb_types.tcp, form.environment, form.app_name, form.target_version), \
+            dependency.lb_lock(lb_types.tcp, form.environment, form.app_name):
+        return _replace_version_tcp_load_balancer(token, form, session)
+
+
+def _replace_version_tcp_load_balancer(token, form: ReplaceTcpLbPolicySchema, session: Session):
     if form.environment == "staging":
         revision_schema = TcpLbStagingRevSchema
     else:
         revision_schema = TcpLbProductionRevSchema
-    with Session(engine) as session:
-        ver_schema: TcpLbVersionSchema = session.exec(
-            select(TcpLbVersionSchema).where(TcpLbVersionSchema.tcp_lb_name == form.app_name).where(
-                TcpLbVersionSchema.environment == form.environment)).first()
-        # Verify if the user is requesting to roll back to the same version
-        if not ver_schema:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                                 detail='App name, environment, and/or version is not found.')
-        if ver_schema.current_version == form.target_version:
-            return HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
-                                 detail=f"{form.app_name} on {form.environment} is already running on version {form.target_version}")
+    # The rows are read without locking, they are locked once XC is replaced
+    ver_statement = select(TcpLbVersionSchema).where(TcpLbVersionSchema.tcp_lb_name == form.app_name).where(
+        TcpLbVersionSchema.environment == form.environment)
+    ver_schema: TcpLbVersionSchema = session.exec(ver_statement).first()
+    # Verify if the user is requesting to roll back to the same version
+    if not ver_schema:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='App name, environment, and/or version is not found.')
+    if ver_schema.current_version == form.target_version:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST,
+                            detail=f"{form.app_name} on {form.environment} is already running on version {form.target_version}")
     old_version = ver_schema.current_version
-    with Session(engine) as session:
-        # Get revision schema of the target version
-        revision: revision_schema = session.exec(
-            select(revision_schema).where(revision_schema.tcp_lb_name == form.app_name).where(
-                revision_schema.version == form.target_version)).first()
+    # Get revision schema of the target version
+    revision_statement = select(revision_schema).where(revision_schema.tcp_lb_name == form.app_name).where(
+        revision_schema.version == form.target_version)
+    revision: revision_schema = session.exec(revision_statement).first()
     # Check if RevisionSchema query came up empty
     if not revision:
-        return HTTPException(status_code=status.HTTP_404_NOT_FOUND,
-                             detail='App name, environment, and/or version is not found.')
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                            detail='App name, environment, and/or version is not found.')
     # todo: debug
     target_lb = (revision.lb_config['replace_form'])
     target_origin = []
@@ -99,57 +115,41 @@ def replace_version_tcp_load_balancer(token: Annotated[str, Depends(verify_admin
         for each in revision.origin_config:
             target_origin.append(each['replace_form'])
 
-    # Replace config with the stored version
-    set_lb = dependency.xc_put_tcp_load_balancers(load_balancer_name=ver_schema.original_tcp_lb_name,
-                                                  configuration=target_lb)
-    if set_lb.status_code > 200:
-        return HTTPException(status_code=set_lb.status_code,
-                             detail=f"Error found during pushing Load Balancers. Error: {set_lb.json()}")
-    if target_origin:
-        set_origin = dependency.xc_put_origin_pools(origin_pools=target_origin)
-        if set_origin:
-            return HTTPException(status_code=400,
-                                 detail=f"Error found during pushing Origin Pools. Errors: {set_origin}")
-
-    # Update database with the correct version
-    get_lb = dependency.get_tcp_load_balancer(ver_schema.original_tcp_lb_name)
-    get_origin = []
-    if target_origin:
-        for each in target_origin:
-            req = dependency.get_all_origin_pools(origin_pool_name=each['metadata']['name'])
-            get_origin.append(req)
-    with Session(engine) as session:
-        revision: revision_schema = session.exec(
-            select(revision_schema).where(revision_schema.tcp_lb_name == form.app_name).where(
-                revision_schema.version == form.target_version)).first()
-        revision.lb_config = get_lb
-        revision.origin_config = get_origin
-        lb_resource_version = 0
-        if 'resource_version' in get_lb:
-            lb_resource_version = get_lb['resource_version']
-        revision.lb_resource_version = lb_resource_version
-        # Where is origin pool update? It can't be updated here, it has to be individually checked anyway.
-        session.commit()
-        session.refresh(revision)
-
-    with Session(engine) as session:
-        ver_schema: TcpLbVersionSchema = session.exec(
-            select(TcpLbVersionSchema).where(TcpLbVersionSchema.tcp_lb_name == form.app_name).where(
-                TcpLbVersionSchema.environment == form.environment)).first()
-        ver_schema.current_version = form.target_version
-
-        session.commit()
-        session.refresh(ver_schema)
-    dependency.log_stuff(
+    # Replace config with the stored version, and read back what XC stored
+    lb_name = ver_schema.original_tcp_lb_name
+    get_lb, get_origin, _ = replace_executor.replace_lb(lb_types.tcp, lb_name, target_lb, target_origin, {})
+
+    # Lock the rows only now, not across the XC round trips: lb_lock already serializes the replaces of the LB.
+    # They are read again, in case they changed in the meantime.
+    session.rollback()
+    ver_schema = session.exec(ver_statement.with_for_update()).first()
+    revision = session.exec(revision_statement.with_for_update()).first()
+    if not ver_schema or not revision or ver_schema.current_version != old_version:
+        # XC runs the target version now, a snapshot stores it
+        dependency.enqueue_snapshot_targets(targets=[(lb_types.tcp, form.environment, lb_name)], debounce=0)
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail=f"{form.app_name} on {form.environment} changed during the replace, a snapshot "
+                                   f"of the version running on XC is queued")
+
+    # Update database with the correct version, in the same transaction as the event log
+    revision.lb_config = get_lb
+    revision.origin_config = get_origin
+    revision.lb_resource_version = get_lb.get('resource_version', 0)
+    # Where is origin pool update? It can't be updated here, it has to be individually checked anyway.
+    ver_schema.current_version = form.target_version
+    dependency.activate_version(session, lb_types.tcp, form.environment, form.app_name, form.target_version,
+                                int(round(time.time())), 'replace')
+    session.add(
         EventLogSchema(event_type=event_type.TCP_REPLACE, timestamp=int(round(time.time())),
                        description=f'User {token.username} '
                                    f'replaced the version of a TCP Load Balancer '
                                    f'{form.app_name} on environment {form.environment}.',
+                       environment=form.environment,
                        target_version=form.target_version,
-                       previous_version=old_version,
-                       environment=form.environment
+                       previous_version=old_version
                        ))
-    dependency.auto_snapshot_pause(False)
+    with tracing.tracer.start_as_current_span('store version'):
+        session.commit()
     return {}
 
 
@@ -181,7 +181,7 @@ def compare_version_tcp_load_balancer(right_app_name: str, right_environment: st
                           include_paths=["root['tcp_lb_name']", "root['original_tcp_lb_name']"])
     difference = {}
     difference.update({"root_difference": json.loads(root_ddiff.to_json())})
-    print(root_ddiff.values())
+    logger.debug("Root difference: %s", root_ddiff)
     lb_ddiff = DeepDiff(left_revision.lb_config["replace_form"], right_revision.lb_config["replace_form"],
                         ignore_order=True)
     difference.update({"lb_difference": json.loads(lb_ddiff.to_json())})
@@ -17,7 +17,7 @@ from sqlmodel import Session, select
 from starlette import status
 
 import dependency
-from helper import event_type
+from helper import event_type, log
 from model.http_model import GenericResponse
 from model.log_stuff_model import EventLogSchema
 from model.user_model import UserSchema, TokenData, Token, UserToken, UserPublic, UserPatch, UserPost
@@ -28,6 +28,7 @@ pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 engine = dependency.engine
 router = APIRouter(tags=['User Management'])
+logger = log.get_logger(__name__)
 
 
 def get_user(username: str) -> UserSchema:
@@ -105,11 +106,10 @@ async def refresh_token(token: Annotated[str, Depends(oauth2_scheme)]) -> Token:
     """
     try:
         payload = jwt.decode(token, os.getenv("SECRET_KEY"), algorithms=[os.getenv("ALGORITHM")])
-        print(payload.values())
         token = create_access_token(data={"sub": payload.get("sub")},
                                     expires_delta=timedelta(minutes=120))  # todo: change to 15
         user: UserSchema = await get_current_user(token)
-        print(user)
+        logger.debug("Refreshed the token of %s", user.username)
         return Token(access_token=token, token_type="bearer", role=user.role,
                      user=UserToken(username=user.username, full_name=user.full_name, email=user.email))
     except (InvalidTokenError, ValidationError):
@@ -261,7 +261,6 @@ def update_user_data(token: Annotated[str, Depends(get_current_user)], form: Use
     :param form: Data that needs to be patched.
     :return:
     """
-    print(token)
     # Check if user is admin or themselves
     no_auth_except = HTTPException(status_code=status.HTTP_401_UNAUTHORIZED,
                                    detail="You are not authorized to make these changes")
@@ -295,7 +294,6 @@ def token_test(token: Annotated[str, Depends(get_current_user)]):
     :param token: Get current user.
     :return: User, Full Name, and Role.
     """
-    print(token.username)
     return {"user": token.username, "full_name": token.full_name, "role": token.role}
 
 
@@ -0,0 +1,477 @@
+import os
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+
+from fastapi import HTTPException
+from sqlalchemy import delete, insert, update
+from sqlmodel import Session, select
+
+import dependency
+import leader
+import snapshot_pipeline
+from helper import log, profiling, query_stats, run_stats, snapshot_job, tracing
+from model.http_model import SnapshotModel
+from model.profile_model import ProfileSchema
+from model.snapshot_model import SnapshotJobSchema, SnapshotJobModel, SnapshotRunSchema, SnapshotRunChange, \
+    SnapshotCheckpointSchema
+
+engine = dependency.engine
+logger = log.get_logger(__name__)
+# Seconds between each write of the job progress to the database
+progress_interval = 1
+# Seconds the worker waits before checking the database for queued jobs
+poll_interval = 2
+# A full snapshot that didn't finish is resumed by the next one if its last checkpoint is more recent than this.
+# The LB it had already stored are skipped. 0 always starts the sweep from scratch.
+resume_seconds = int(os.getenv("SNAPSHOT_RESUME_SECONDS", 3600))
+# Job type: lock of its lane. Each lane runs one job at a time, so a targeted snapshot doesn't wait for a full sweep.
+worker_lanes = {snapshot_job.full: 'snapshot_worker', snapshot_job.targeted: 'snapshot_worker_targeted'}
+_wake_lanes = {job_type: threading.Event() for job_type in worker_lanes}
+_stop_worker = threading.Event()
+_worker: threading.Thread | None = None
+
+
+class SnapshotProgress:
+    """
+    Progress of a snapshot job, per LB type and environment. Written to the database at most once per second.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.progress = {'total': 0, 'done': 0, 'current': None, 'lb_types': {}, 'errors': []}
+        self._lock = threading.Lock()
+        self._last_write = 0.0
+
+    def start(self, lb_type: str, environment: str, total: int):
+        """
+        Register the number of LB that will be retrieved for an LB type and environment.
+        """
+        with self._lock:
+            counter = self.progress['lb_types'].setdefault(lb_type, {}).setdefault(environment,
+                                                                                   {'total': 0, 'done': 0})
+            counter['total'] += total
+            self.progress['total'] += total
+        self.write()
+
+    def advance(self, lb_type: str, environment: str, lb_name: str):
+        """
+        Mark one LB as retrieved from XC and compared.
+        """
+        with self._lock:
+            self.progress['lb_types'][lb_type][environment]['done'] += 1
+            self.progress['done'] += 1
+            self.progress['current'] = f"{lb_type} {lb_name} on {environment}"
+        self.write()
+
+    def resume(self, sweep_id: str, done: int):
+        """
+        Record the sweep resumed by the job and the number of LB it had already done, skipped by this job.
+        """
+        with self._lock:
+            self.progress['resumed_from'] = sweep_id
+            self.progress['resumed_lbs'] = done
+        self.write(force=True)
+
+    def error(self, message: str):
+        """
+        Record an error that didn't stop the job.
+        """
+        with self._lock:
+            self.progress['errors'].append(message)
+        self.write(force=True)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {**self.progress, 'lb_types': {lb_type: {env: dict(counter) for env, counter in envs.items()}
+                                                  for lb_type, envs in self.progress['lb_types'].items()},
+                    'errors': list(self.progress['errors'])}
+
+    def write(self, force: bool = False):
+        current = time.monotonic()
+        if not force and current - self._last_write < progress_interval:
+            return
+        self._last_write = current
+        with Session(engine) as session:
+            session.exec(update(SnapshotJobSchema).where(SnapshotJobSchema.job_id == self.job_id).values(
+                progress=self.snapshot()))
+            session.commit()
+
+
+class SnapshotCheckpoint:
+    """
+    LB already stored by a sweep of every LB. Each chunk written by the full snapshot is checkpointed,
+    so a full snapshot that fails or is interrupted leaves the LB it has done, and the next one skips them.
+    """
+
+    def __init__(self, sweep_id: str, done: set[tuple[str, str, str]]):
+        self.sweep_id = sweep_id
+        # (LB type, environment, LB name in XC)
+        self.done = done
+
+    def is_done(self, lb_type: str, environment: str, lb_name: str) -> bool:
+        return (lb_type, environment, lb_name) in self.done
+
+    def save(self, lb_type: str, environment: str, lb_names: list[str]):
+        """
+        Checkpoint the LB of a chunk written to the database, the unchanged ones included.
+        """
+        lb_names = [each for each in lb_names if not self.is_done(lb_type, environment, each)]
+        if not lb_names:
+            return
+        checkpoint_time = int(round(time.time()))
+        with Session(engine) as session:
+            session.exec(statement=insert(SnapshotCheckpointSchema), params=[
+                {'uid': f'{self.sweep_id}:{lb_type}:{environment}:{each}', 'sweep_id': self.sweep_id,
+                 'lb_type': lb_type, 'environment': environment, 'lb_name': each, 'checkpoint_time': checkpoint_time}
+                for each in lb_names])
+            session.commit()
+        self.done.update((lb_type, environment, each) for each in lb_names)
+
+    def clear(self):
+        """
+        Remove the checkpoint once the sweep is complete.
+        """
+        with Session(engine) as session:
+            session.exec(delete(SnapshotCheckpointSchema).where(SnapshotCheckpointSchema.sweep_id == self.sweep_id))
+            session.commit()
+
+
+def resume_checkpoint(job_id: str) -> SnapshotCheckpoint:
+    """
+    Find the sweep to resume: the last full snapshot that didn't finish, if it was checkpointed less than
+    resume_seconds ago. The older sweeps are removed.
+    :param job_id: ID of the full snapshot job starting
+    :return: Checkpoint of the resumed sweep, or an empty checkpoint for a new sweep started by this job
+    """
+    with Session(engine) as session:
+        sweep_id = None
+        if resume_seconds > 0:
+            sweep_id = session.exec(select(SnapshotCheckpointSchema.sweep_id).where(
+                SnapshotCheckpointSchema.checkpoint_time >= int(round(time.time())) - resume_seconds).order_by(
+                SnapshotCheckpointSchema.checkpoint_time.desc())).first()
+        stale = delete(SnapshotCheckpointSchema)
+        if sweep_id:
+            stale = stale.where(SnapshotCheckpointSchema.sweep_id != sweep_id)
+        session.exec(stale)
+        session.commit()
+        if not sweep_id:
+            return SnapshotCheckpoint(job_id, set())
+        done = session.exec(select(SnapshotCheckpointSchema.lb_type, SnapshotCheckpointSchema.environment,
+                                   SnapshotCheckpointSchema.lb_name).where(
+            SnapshotCheckpointSchema.sweep_id == sweep_id)).all()
+    return SnapshotCheckpoint(sweep_id, {tuple(each) for each in done})
+
+
+def submit_snapshot_job(trigger: str, username: str, targets: list | None = None) -> SnapshotJobSchema:
+    """
+    Queue a snapshot job. The worker lane of its type will pick it up as soon as it is free.
+    Concurrent requests are coalesced: a full snapshot joins the full snapshot already queued or running,
+    and targets join the queued targeted snapshot. Targets never join a full snapshot, they would wait for
+    the whole sweep.
+    :param trigger: What triggered the snapshot (manual | scheduler | webhook)
+    :param username: Username of the requester
+    :param targets: (Optional) List of (LB type, environment, LB name in XC). Snapshot every LB if empty.
+    :return: The job that will run the snapshot. A worker in another process picks it up within poll_interval.
+    """
+    targets = [list(each) for each in targets or []]
+    # Serializes the check and the insert across every worker process
+    with dependency.advisory_lock('snapshot_submit'), Session(engine) as session:
+        if not targets:
+            full_job = session.exec(select(SnapshotJobSchema).where(SnapshotJobSchema.job_type == snapshot_job.full)
+                                    .where(SnapshotJobSchema.status.in_([snapshot_job.queued, snapshot_job.running]))
+                                    .order_by(SnapshotJobSchema.created_time)).first()
+            if full_job:
+                return full_job
+        else:
+            targeted_job = session.exec(select(SnapshotJobSchema).where(
+                SnapshotJobSchema.job_type == snapshot_job.targeted).where(
+                SnapshotJobSchema.status == snapshot_job.queued).order_by(SnapshotJobSchema.created_time)).first()
+            if targeted_job:
+                merged = targeted_job.targets + [each for each in targets if each not in targeted_job.targets]
+                # Only if the worker hasn't claimed it in the meantime
+                joined = session.exec(update(SnapshotJobSchema).where(
+                    SnapshotJobSchema.job_id == targeted_job.job_id).where(
+                    SnapshotJobSchema.status == snapshot_job.queued).values(targets=merged))
+                session.commit()
+                if joined.rowcount == 1:
+                    session.refresh(targeted_job)
+                    return targeted_job
+        job = SnapshotJobSchema(job_id=uuid.uuid4().hex,
+                                job_type=snapshot_job.targeted if targets else snapshot_job.full,
+                                trigger=trigger, requested_by=username, status=snapshot_job.queued,
+                                created_time=int(round(time.time())), targets=targets)
+        session.add(job)
+        session.commit()
+        session.refresh(job)
+    _wake_lanes[job.job_type].set()
+    return job
+
+
+def get_job(job_id: str) -> SnapshotJobSchema | None:
+    with Session(engine) as session:
+        return session.get(SnapshotJobSchema, job_id)
+
+
+def list_jobs(limit: int = 20) -> list[SnapshotJobSchema]:
+    with Session(engine) as session:
+        return list(session.exec(
+            select(SnapshotJobSchema).order_by(SnapshotJobSchema.created_time.desc()).limit(limit)).all())
+
+
+def job_model(job: SnapshotJobSchema) -> SnapshotJobModel:
+    return SnapshotJobModel(job_id=job.job_id, job_type=job.job_type, trigger=job.trigger,
+                            requested_by=job.requested_by, status=job.status, created_time=job.created_time,
+                            started_time=job.started_time, finished_time=job.finished_time,
+                            progress=job.progress or None,
+                            result=SnapshotModel(**job.result) if job.result else None, error=job.error)
+
+
+def request_job_profile(job: SnapshotJobSchema, username: str) -> ProfileSchema | None:
+    """
+    Profile a queued snapshot job when the worker runs it.
+    :param job: The queued job
+    :param username: Username of the administrator requesting the profile
+    :return: The profile, its report is filled when the job is finished. None if the job is already running.
+    """
+    if job.status != snapshot_job.queued:
+        return None
+    profile = ProfileSchema(profile_id=uuid.uuid4().hex, target=f'snapshot job {job.job_id}', job_id=job.job_id,
+                            requested_by=username, created_time=int(round(time.time())))
+    with Session(engine) as session:
+        session.add(profile)
+        session.commit()
+        # The worker looks for the profile after claiming the job. If it claimed it in the meantime, it won't see it.
+        if session.get(SnapshotJobSchema, job.job_id, populate_existing=True).status != snapshot_job.queued:
+            session.delete(profile)
+            session.commit()
+            return None
+        session.refresh(profile)
+    return profile
+
+
+def _pending_profile(job_id: str) -> ProfileSchema | None:
+    with Session(engine) as session:
+        return session.exec(select(ProfileSchema).where(ProfileSchema.job_id == job_id).where(
+            ProfileSchema.finished_time == None)).first()
+
+
+def _claim_next_job(job_type: str) -> SnapshotJobSchema | None:
+    """
+    Take the oldest queued job of a type. The status is only changed if the job is still queued,
+    so a job is never run twice.
+    """
+    with Session(engine) as session:
+        queued = session.exec(select(SnapshotJobSchema).where(SnapshotJobSchema.status == snapshot_job.queued)
+                              .where(SnapshotJobSchema.job_type == job_type)
+                              .order_by(SnapshotJobSchema.created_time)).first()
+        if not queued:
+            return None
+        claimed = session.exec(update(SnapshotJobSchema).where(SnapshotJobSchema.job_id == queued.job_id).where(
+            SnapshotJobSchema.status == snapshot_job.queued).values(status=snapshot_job.running,
+                                                                    started_time=int(round(time.time()))))
+        session.commit()
+        if claimed.rowcount != 1:
+            return None
+        session.refresh(queued)
+        return queued
+
+
+def run_snapshot(job: SnapshotJobSchema, progress: SnapshotProgress) -> SnapshotModel:
+    """
+    Run the snapshot of a job: its targets, or every LB. A full snapshot resumes the last one that didn't finish.
+    """
+    if job.job_type == snapshot_job.targeted:
+        return snapshot_pipeline.run_targeted_snapshots(targets=job.targets, username=job.requested_by,
+                                                        progress=progress)
+    checkpoint = resume_checkpoint(job.job_id)
+    if checkpoint.sweep_id != job.job_id:
+        logger.info("Snapshot job %s resumes the snapshot of job %s, %s LB already done", job.job_id,
+                    checkpoint.sweep_id, len(checkpoint.done),
+                    extra={'job_id': job.job_id, 'sweep_id': checkpoint.sweep_id})
+        progress.resume(checkpoint.sweep_id, len(checkpoint.done))
+    result = snapshot_pipeline.run_full_snapshot(username=job.requested_by, progress=progress, checkpoint=checkpoint)
+    checkpoint.clear()
+    return result
+
+
+def run_job(job: SnapshotJobSchema):
+    """
+    Run a claimed snapshot job and store its result.
+    """
+    progress = SnapshotProgress(job.job_id)
+    values = {}
+    profile = _pending_profile(job.job_id)
+    report = {}
+    start = time.perf_counter()
+    with run_stats.collect_run_stats() as stats, query_stats.track_queries(f'snapshot job {job.job_type}') as queries:
+        try:
+            with profiling.profile() if profile else nullcontext(report) as report, \
+                    tracing.tracer.start_as_current_span('snapshot job', attributes={
+                        'job.id': job.job_id, 'job.type': job.job_type, 'job.trigger': job.trigger}):
+                result = run_snapshot(job, progress)
+            values.update(status=snapshot_job.succeeded, result=result.model_dump(exclude_none=True))
+        except Exception as e:
+            logger.exception("Snapshot job %s failed: %s", job.job_id, e, extra={'job_id': job.job_id})
+            values.update(status=snapshot_job.failed, error=str(getattr(e, 'detail', None) or e))
+    finished_time = int(round(time.time()))
+    job_progress = progress.snapshot()
+    with Session(engine) as session:
+        session.exec(update(SnapshotJobSchema).where(SnapshotJobSchema.job_id == job.job_id).values(
+            progress=job_progress, finished_time=finished_time, **values))
+        session.add(SnapshotRunSchema(
+            run_id=job.job_id, job_type=job.job_type, trigger=job.trigger, requested_by=job.requested_by,
+            status=values['status'], started_time=job.started_time or finished_time, finished_time=finished_time,
+            duration=round(time.perf_counter() - start, 6), **stats.report(),
+            db={'queries': queries.count, 'seconds': round(queries.seconds, 6), 'rows_written': queries.rows_written},
+            errors=job_progress['errors'] + ([values['error']] if 'error' in values else [])))
+        session.commit()
+    if profile:
+        profile.finished_time = int(round(time.time()))
+        profile.report = report
+        dependency.save_profile(profile)
+
+
+def list_runs(limit: int = 20, trigger: str | None = None, job_type: str | None = None) -> list[SnapshotRunSchema]:
+    with Session(engine) as session:
+        stmt = select(SnapshotRunSchema).order_by(SnapshotRunSchema.started_time.desc()).limit(limit)
+        if trigger:
+            stmt = stmt.where(SnapshotRunSchema.trigger == trigger)
+        if job_type:
+            stmt = stmt.where(SnapshotRunSchema.job_type == job_type)
+        return list(session.exec(stmt).all())
+
+
+def get_run(run_id: str) -> SnapshotRunSchema | None:
+    with Session(engine) as session:
+        return session.get(SnapshotRunSchema, run_id)
+
+
+def previous_run(run: SnapshotRunSchema) -> SnapshotRunSchema | None:
+    """
+    :return: The run of the same job type started just before this one
+    """
+    with Session(engine) as session:
+        return session.exec(select(SnapshotRunSchema).where(SnapshotRunSchema.job_type == run.job_type).where(
+            SnapshotRunSchema.started_time <= run.started_time).where(SnapshotRunSchema.run_id != run.run_id).order_by(
+            SnapshotRunSchema.started_time.desc())).first()
+
+
+def run_metrics(run: SnapshotRunSchema) -> dict[str, float]:
+    """
+    :return: Every number of the run report, keyed by its path, e.g. phases.http_lb.fetch or xc.requests
+    """
+    flat = {'duration': run.duration}
+
+    def walk(prefix: str, value):
+        if isinstance(value, dict):
+            for key, each in value.items():
+                walk(f'{prefix}.{key}', each)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix] = value
+
+    for field in ('phases', 'xc', 'db', 'lbs'):
+        walk(field, getattr(run, field))
+    flat['errors'] = len(run.errors)
+    return flat
+
+
+def compare_runs(base: SnapshotRunSchema, target: SnapshotRunSchema) -> list[SnapshotRunChange]:
+    """
+    Compare every number of two run reports.
+    :param base: Run compared against, usually the older one
+    :param target: Run compared
+    :return: Value of each metric in both runs, with the change from base to target
+    """
+    base_metrics, target_metrics = run_metrics(base), run_metrics(target)
+    changes = []
+    for metric in sorted(base_metrics.keys() | target_metrics.keys()):
+        before, after = base_metrics.get(metric), target_metrics.get(metric)
+        change = round(after - before, 6) if before is not None and after is not None else None
+        percent = round(change / before * 100, 2) if change is not None and before else None
+        changes.append(SnapshotRunChange(metric=metric, base=before, target=after, change=change,
+                                         change_percent=percent))
+    return changes
+
+
+def fail_interrupted_jobs(job_type: str):
+    """
+    Only the worker holding the lock of a lane runs its jobs. Jobs of the lane still running without it were
+    interrupted by a restart.
+    """
+    with Session(engine) as session:
+        session.exec(update(SnapshotJobSchema).where(SnapshotJobSchema.status == snapshot_job.running).where(
+            SnapshotJobSchema.job_type == job_type).values(
+            status=snapshot_job.failed, finished_time=int(round(time.time())),
+            error="Interrupted before the snapshot was completed"))
+        session.commit()
+
+
+def _run_queued_jobs(job_type: str):
+    """
+    Run the queued jobs of a lane until it is empty, while holding the lock of the lane.
+    A single snapshot of each type runs at a time, across every worker process.
+    """
+    try:
+        with dependency.advisory_lock(worker_lanes[job_type], timeout=0):
+            fail_interrupted_jobs(job_type)
+            while not _stop_worker.is_set():
+                job = _claim_next_job(job_type)
+                if not job:
+                    return
+                try:
+                    run_job(job)
+                except Exception as e:
+                    logger.exception("Snapshot worker failed to store job %s: %s", job.job_id, e,
+                                     extra={'job_id': job.job_id})
+    except HTTPException:
+        # Another worker process is running this lane
+        return
+
+
+def _run_lane(job_type: str, may_run):
+    wake = _wake_lanes[job_type]
+    while not _stop_worker.is_set():
+        try:
+            if may_run():
+                _run_queued_jobs(job_type)
+        except Exception as e:
+            logger.error("Snapshot worker can't access the database: %s", e)
+        wake.wait(timeout=poll_interval)
+        wake.clear()
+
+
+def run_worker(may_run=leader.is_leader):
+    """
+    Run the queued snapshot jobs until stop_worker() is called. The full snapshots run in the calling thread,
+    the targeted snapshots in a thread of their own.
+    :param may_run: Tells if this worker may run jobs now, checked before each pass over a queue.
+    Only the leader runs jobs by default.
+    """
+    targeted = threading.Thread(target=_run_lane, args=(snapshot_job.targeted, may_run),
+                                name='snapshot-worker-targeted', daemon=True)
+    targeted.start()
+    _run_lane(snapshot_job.full, may_run)
+    targeted.join()
+
+
+def start_worker():
+    """
+    Start the snapshot worker thread in this process. Snapshot jobs are run by the leader only.
+    """
+    global _worker
+    if _worker and _worker.is_alive():
+        return
+    _stop_worker.clear()
+    _worker = threading.Thread(target=run_worker, name='snapshot-worker', daemon=True)
+    _worker.start()
+
+
+def stop_worker():
+    """
+    Stop the worker once the jobs it is running are finished.
+    """
+    _stop_worker.set()
+    for wake in _wake_lanes.values():
+        wake.set()
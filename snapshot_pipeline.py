@@ -0,0 +1,336 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import islice
+
+import dependency
+from helper import environments, lb_types, log, metrics, run_stats, tracing
+from helper.xc_client import xc_list
+from model.http_model import SnapshotModel, SnapshotContents, SnapshotValueModel
+
+logger = log.get_logger(__name__)
+
+# LB Type: (XC collection, get LB data from XC, push LB data to DB, LB type for list_app_and_version)
+snapshot_handlers = {
+    lb_types.http: ('http_loadbalancers', dependency.get_http_lb_data, dependency.push_http_lb_to_db, 'http'),
+    lb_types.tcp: ('tcp_loadbalancers', dependency.get_tcp_lb_data, dependency.push_tcp_lb_to_db, 'tcp'),
+    lb_types.cdn: ('cdn_loadbalancers', dependency.get_cdn_lb_data, dependency.push_cdn_lb_to_db, 'cdn'),
+}
+# Number of LB names taken from the XC list before they are fetched and pushed to the database
+list_batch_size = int(os.getenv("SNAPSHOT_BATCH_SIZE", 100))
+# Fetched chunks waiting to be written to the database, per LB type. Fetching waits when the queue is full,
+# so at most this many chunks, plus the one being fetched and the one being written, are held in memory.
+write_queue_chunks = int(os.getenv("SNAPSHOT_WRITE_QUEUE", 2))
+
+
+def list_app_and_version(app_list: list, lb_type: str):
+    #     name: str
+    #     new_version: int
+    #     previous_version: int = 0
+    if lb_type == "tcp":
+        lb_name = "tcp_lb_name"
+    elif lb_type == "cdn":
+        lb_name = "cdn_lb_name"
+    else:
+        lb_name = "app_name"
+    apps: list[SnapshotContents] = []
+
+    for each in app_list:
+        apps.append(SnapshotContents(name=each[lb_name], new_version=each['version'],
+                                     previous_version=(
+                                         each['previous_version']) if 'previous_version' in each else None))
+    return apps
+
+
+def snapshot_summary(lb_type: str, data: list) -> list[dict]:
+    """
+    Keep only what the snapshot response needs from the LB pushed to the database, so the configurations
+    aren't held in memory until the end of the snapshot.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param data: New or updated LB data
+    :return: Name, version and previous version of each LB
+    """
+    name_key = {'tcp': 'tcp_lb_name', 'cdn': 'cdn_lb_name'}.get(snapshot_handlers[lb_type][3], 'app_name')
+    return [{key: each[key] for key in (name_key, 'version', 'previous_version') if key in each} for each in data]
+
+
+@contextmanager
+def snapshot_phase(lb_type: str, phase: str, **attributes):
+    """
+    Time a phase of the snapshot in the metrics and in the report of the snapshot run, and trace it as a span.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param phase: total | fetch | store
+    :param attributes: Added to the span
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.tracer.start_as_current_span(f'snapshot {lb_type}' if phase == 'total' else f'{phase} {lb_type}',
+                                                  attributes={'lb.type': lb_type, **attributes}):
+            yield
+    finally:
+        seconds = time.perf_counter() - start
+        metrics.snapshot_phase_seconds.labels(lb_type, phase).observe(seconds)
+        stats = run_stats.current()
+        if stats is not None:
+            stats.add_phase(lb_type, phase, seconds)
+
+
+def count_snapshot_lbs(lb_type: str, environment: str, lb_list: dict, new_data: list, exist_data: list):
+    """
+    Count the new, updated and skipped (unchanged) LB of a snapshot in the metrics and in the report of the
+    snapshot run.
+    :param lb_list: XC list of the LB being snapshot
+    """
+    seen = len(dependency.filter_lb_names(lb_list, environment))
+    skipped = max(0, seen - len(new_data) - len(exist_data))
+    metrics.snapshot_lbs.labels(lb_type, environment, 'new').inc(len(new_data))
+    metrics.snapshot_lbs.labels(lb_type, environment, 'updated').inc(len(exist_data))
+    metrics.snapshot_lbs.labels(lb_type, environment, 'skipped').inc(skipped)
+    stats = run_stats.current()
+    if stats is not None:
+        stats.add_lbs(lb_type, environment, len(new_data), len(exist_data), skipped)
+
+
+def done_lb_names(lb_type: str, environment: str, lb_list: dict, data: list, stored: list[str]) -> list[str]:
+    """
+    LB of a chunk that the snapshot doesn't need to see again: the unchanged ones and the ones stored. An updated LB
+    replaced since it was compared isn't stored, the next snapshot compares it again.
+    :param lb_list: XC list of the chunk
+    :param data: New and updated LB data of the chunk
+    :param stored: Names in XC of the LB stored, returned by push_*_to_db
+    :return: Names in XC
+    """
+    name_key = {'tcp': 'original_tcp_lb_name', 'cdn': 'original_cdn_lb_name'}.get(snapshot_handlers[lb_type][3],
+                                                                                  'original_app_name')
+    changed = {each[name_key] for each in data} - set(stored)
+    return [each for each in dependency.filter_lb_names(lb_list, environment) if each not in changed]
+
+
+class SnapshotWriter:
+    """
+    Write stage of the snapshot of one LB type. Pushes the fetched and compared chunks to the database in its
+    own thread, while the next chunks are fetched from XC. Only the names and versions are kept for the response.
+    """
+
+    def __init__(self, lb_type: str, checkpoint=None):
+        self.lb_type = lb_type
+        self.checkpoint = checkpoint
+        # Environment: new LB, updated LB
+        self.result = {environment: ([], []) for environment in (environments.production, environments.staging)}
+        self._queue = queue.Queue(maxsize=write_queue_chunks)
+        self._error: Exception | None = None
+        self._thread = threading.Thread(target=tracing.in_current_context(self._run),
+                                        name=f'snapshot-writer-{lb_type}', daemon=True)
+        self._thread.start()
+
+    def put(self, environment: str, lb_list: dict, new_data: list, exist_data: list):
+        """
+        Queue a chunk to be written. Waits while the queue is full.
+        :except Exception: The error of the writer, if it failed to write a previous chunk
+        """
+        while True:
+            if self._error:
+                raise self._error
+            try:
+                self._queue.put((environment, lb_list, new_data, exist_data), timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def _run(self):
+        push_lb_to_db = snapshot_handlers[self.lb_type][2]
+        while (chunk := self._queue.get()) is not None:
+            # After a failure, the remaining chunks are dropped so the fetch stops at its next chunk
+            if self._error:
+                continue
+            environment, lb_list, new_data, exist_data = chunk
+            try:
+                with snapshot_phase(self.lb_type, 'store', environment=environment, chunk_size=len(new_data) +
+                                    len(exist_data)):
+                    stored = push_lb_to_db(environment=environment, new_data=new_data, exist_data=exist_data)
+                count_snapshot_lbs(self.lb_type, environment, lb_list, new_data, exist_data)
+                if self.checkpoint:
+                    self.checkpoint.save(self.lb_type, environment,
+                                         done_lb_names(self.lb_type, environment, lb_list, new_data + exist_data,
+                                                       stored))
+                new_list, exist_list = self.result[environment]
+                new_list.extend(snapshot_summary(self.lb_type, new_data))
+                exist_list.extend(snapshot_summary(self.lb_type, exist_data))
+            except Exception as e:
+                self._error = e
+
+    def close(self) -> dict:
+        """
+        Wait until every queued chunk is written.
+        :return: New and updated LB for each environment
+        :except Exception: The error of the writer, if it failed to write a chunk
+        """
+        self._queue.put(None)
+        self._thread.join()
+        if self._error:
+            raise self._error
+        return self.result
+
+
+def snapshot_lb_type(lb_type: str, username: str, progress=None, checkpoint=None) -> dict:
+    """
+    Snapshot every LB of one type on both environments: list, fetch, compare and push to DB.
+    The list is streamed from XC, and LB are fetched and compared in chunks of list_batch_size as their names arrive.
+    Each chunk is written to the database by a SnapshotWriter while the next one is fetched, so the memory used
+    depends on the chunk size rather than on the number of LB, and a failure only loses the chunk being fetched.
+    Once the whole list is snapshot, the dependency index of the LB deleted from XC is removed.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param username: Username of the requester
+    :param progress: (Optional) SnapshotProgress of the snapshot job
+    :param checkpoint: (Optional) SnapshotCheckpoint of the sweep. The LB it has done are skipped, the LB written
+    are added to it.
+    :return: New and updated LB for each environment
+    :except HTTPException: Raised if XC can't list the LB (expired API Token, wrong namespace, etc.)
+    """
+    collection, get_lb_data, _, _ = snapshot_handlers[lb_type]
+    with snapshot_phase(lb_type, 'total'):
+        writer = SnapshotWriter(lb_type, checkpoint)
+        listed = set()
+        try:
+            lb_names = (each['name'] for each in xc_list(collection))
+            while batch := list(islice(lb_names, list_batch_size)):
+                listed.update(batch)
+                # Get production first
+                for environment in writer.result:
+                    lb_list = {'items': [{'name': name} for name in batch
+                                         if not checkpoint or not checkpoint.is_done(lb_type, environment, name)]}
+                    if not lb_list['items']:
+                        continue
+                    with snapshot_phase(lb_type, 'fetch', environment=environment,
+                                        batch_size=len(lb_list['items'])):
+                        new_data, exist_data = get_lb_data(os.getenv('XC_NAMESPACE'), environment, lb_list,
+                                                           username, progress)
+                    logger.debug("new %s in %s: %s, exist data: %s", lb_type, environment, new_data, exist_data)
+                    writer.put(environment, lb_list, new_data, exist_data)
+        except BaseException:
+            # Still write the chunks already fetched
+            try:
+                writer.close()
+            except Exception as e:
+                logger.error("Snapshot of %s failed to write its last chunks: %s", lb_type, e,
+                             extra={'lb_type': lb_type})
+            raise
+        result = writer.close()
+        # The list is complete, so the LB missing from it were deleted from XC
+        dependency.prune_dependency_index(lb_type, listed)
+        return result
+
+
+def snapshot_value_model(lb_type: str, result: dict) -> SnapshotValueModel:
+    """
+    Build the snapshot response of one LB type.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param result: Result of snapshot_lb_type()
+    :return: Snapshot value model
+    """
+    list_type = snapshot_handlers[lb_type][3]
+    new_prd, exist_prd = result.get(environments.production, (None, None))
+    new_stg, exist_stg = result.get(environments.staging, (None, None))
+    return SnapshotValueModel(
+        new_prod=list_app_and_version(new_prd, lb_type=list_type) if new_prd is not None else None,
+        new_staging=list_app_and_version(new_stg, lb_type=list_type) if new_stg is not None else None,
+        update_prod=list_app_and_version(exist_prd, lb_type=list_type) if exist_prd is not None else None,
+        update_staging=list_app_and_version(exist_stg, lb_type=list_type) if exist_stg is not None else None)
+
+
+def snapshot_model(results: dict) -> SnapshotModel:
+    """
+    Merge the results of each LB type into the snapshot response.
+    :param results: LB type: result of snapshot_lb_type()
+    :return: Snapshot model data
+    """
+    # todo: request a remark from the user after a manual snapshot.
+    # If all of them are empty
+    if not any(new_data or exist_data for result in results.values() for new_data, exist_data in result.values()):
+        return SnapshotModel(result='No updates found')
+    return SnapshotModel(result="Updates found.",
+                         **{lb_type: snapshot_value_model(lb_type, result) for lb_type, result in results.items()})
+
+
+def run_full_snapshot(username: str, progress=None, checkpoint=None) -> SnapshotModel:
+    """
+    Snapshot every HTTP, TCP and CDN LB. The three LB types run concurrently, sharing the XC concurrency budget.
+    :param username: Username of the requester
+    :param progress: (Optional) SnapshotProgress of the snapshot job
+    :param checkpoint: (Optional) SnapshotCheckpoint of the sweep, the LB it has done are skipped
+    :return: Snapshot model data
+    :except HTTPException: Raised if XC can't list one of the LB types. The other types are still stored.
+    """
+    with metrics.snapshot_run_seconds.labels('full').time(), tracing.tracer.start_as_current_span('full snapshot'), \
+            ThreadPoolExecutor(max_workers=len(snapshot_handlers), thread_name_prefix='snapshot') as executor:
+        futures = {lb_type: executor.submit(tracing.in_current_context(snapshot_lb_type), lb_type, username, progress,
+                                            checkpoint) for lb_type in snapshot_handlers}
+    # Leaving the executor waits for every LB type, so a failing type doesn't interrupt the others
+    results = {lb_type: future.result() for lb_type, future in futures.items()}
+    # todo: get healthcheck and service policy push to DB
+    return snapshot_model(results)
+
+
+def snapshot_target(lb_type: str, environment: str, lb_name: str, username: str, progress=None):
+    """
+    Snapshot a single LB. Only the LB, its Origin Pools and its App Firewall are retrieved from XC.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB (staging | production)
+    :param lb_name: Name of the LB as written in XC
+    :param username: Username of the requester
+    :param progress: (Optional) SnapshotProgress of the snapshot job
+    :return: List of new LB and list of updated LB
+    """
+    _, get_lb_data, push_lb_to_db, _ = snapshot_handlers[lb_type]
+    lb_list = {'items': [{'name': lb_name}]}
+    with snapshot_phase(lb_type, 'fetch', environment=environment, batch_size=1, **{'lb.name': lb_name}):
+        new_data, exist_data = get_lb_data(os.getenv('XC_NAMESPACE'), environment, lb_list, username, progress)
+    with snapshot_phase(lb_type, 'store', environment=environment):
+        push_lb_to_db(environment=environment, new_data=new_data, exist_data=exist_data)
+    count_snapshot_lbs(lb_type, environment, lb_list, new_data, exist_data)
+    return new_data, exist_data
+
+
+def run_targeted_snapshot(lb_type: str, environment: str, lb_name: str, username: str) -> SnapshotModel:
+    """
+    Snapshot a single LB. Only the LB, its Origin Pools and its App Firewall are retrieved from XC.
+    :param lb_type: Type of the LB (http_lb | tcp_lb | cdn_lb)
+    :param environment: Environment of the LB (staging | production)
+    :param lb_name: Name of the LB as written in XC
+    :param username: Username of the requester
+    :return: Snapshot model data
+    """
+    new_data, exist_data = snapshot_target(lb_type=lb_type, environment=environment, lb_name=lb_name,
+                                           username=username)
+    return snapshot_model({lb_type: {environment: (new_data, exist_data)}})
+
+
+def run_targeted_snapshots(targets: list, username: str, progress=None) -> SnapshotModel:
+    """
+    Snapshot a list of LB, one by one. A failing LB doesn't stop the others.
+    :param targets: List of (LB type, environment, LB name in XC)
+    :param username: Username of the requester
+    :param progress: (Optional) SnapshotProgress of the snapshot job
+    :return: Snapshot model data of every LB
+    """
+    start = time.perf_counter()
+    results = {}
+    with tracing.tracer.start_as_current_span('targeted snapshot', attributes={'targets': len(targets)}):
+        for lb_type, environment, lb_name in targets:
+            try:
+                new_data, exist_data = snapshot_target(lb_type=lb_type, environment=environment, lb_name=lb_name,
+                                                       username=username, progress=progress)
+            except Exception as e:
+                logger.warning("Snapshot of %s %s on %s failed: %s", lb_type, lb_name, environment, e,
+                               extra={'lb_type': lb_type, 'lb_name': lb_name, 'environment': environment})
+                if progress:
+                    progress.error(f"{lb_type} {lb_name} on {environment}: {e}")
+                continue
+            new_list, exist_list = results.setdefault(lb_type, {}).setdefault(environment, ([], []))
+            new_list.extend(new_data)
+            exist_list.extend(exist_data)
+    metrics.snapshot_run_seconds.labels('targeted').observe(time.perf_counter() - start)
+    return snapshot_model(results)
@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import signal
+import threading
+from multiprocessing.sharedctypes import SynchronizedArray
+from multiprocessing.synchronize import Event
+
+from dotenv import load_dotenv
+
+import dependency
+import leader
+import snapshot_jobs
+from helper import log, tracing, xc_client
+
+load_dotenv()
+logger = log.get_logger(__name__)
+# Where the snapshot jobs run:
+# process: a worker process started by each API worker, runs the jobs while its API worker is the leader
+# external: only in the workers started with python snapshot_worker.py, the API only queues the jobs
+# thread: a thread of the API worker, the snapshots compete with the requests for the CPU
+worker_mode = os.getenv("SNAPSHOT_WORKER", "process")
+# Seconds given to the running job to finish when the API stops, before the worker process is killed
+stop_timeout = int(os.getenv("SNAPSHOT_WORKER_STOP_SECONDS", 10))
+# Port of the /metrics endpoint of a worker started with python snapshot_worker.py. 0 disables it.
+metrics_port = int(os.getenv("SNAPSHOT_WORKER_METRICS_PORT", 0))
+# With SNAPSHOT_WORKER=process, share of the XC budget of the worker (XC_RATE_LIMIT, XC_RATE_BURST,
+# XC_MAX_CONCURRENCY) given to its snapshot worker process, between 0 and 1. The API worker keeps the rest.
+xc_share = float(os.getenv("SNAPSHOT_WORKER_XC_SHARE", 0.5))
+# Seconds between each copy of the XC client counters of the worker process to the API worker
+stats_interval = 1
+
+# Counters and limits of xc_stats() copied from the worker process, in this order
+xc_stat_fields = ('requests', 'retries', 'throttled', 'errors', 'timeouts', 'rejected', 'hedged',
+                  'concurrency_limit', 'in_flight', 'rate_limit', 'tokens', 'breaker')
+breaker_states = ('closed', 'half-open', 'open')
+
+_process: multiprocessing.Process | None = None
+# Set while the API worker that started the worker process is the leader
+_may_run: Event | None = None
+# xc_stats() of the worker process
+_xc_stats: SynchronizedArray | None = None
+
+
+def _stop_on_signal():
+    """
+    SIGTERM and SIGINT (Ctrl+C on the API, sent to its worker process too) stop the worker after the running job.
+    """
+    for each in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(each, lambda signum, frame: snapshot_jobs.stop_worker())
+
+
+def serve(may_run=lambda: True):
+    """
+    Run the snapshot jobs in this process until it receives SIGTERM or SIGINT.
+    :param may_run: Tells if this worker may run jobs now. A single worker runs each lane at a time anyway,
+    under the lock of the lane.
+    """
+    _stop_on_signal()
+    tracing.setup_tracing()
+    logger.info("Snapshot worker %s started", os.getpid())
+    try:
+        snapshot_jobs.run_worker(may_run=may_run)
+    finally:
+        logger.info("Snapshot worker %s stopped", os.getpid())
+        tracing.shutdown_tracing()
+        log.shutdown_logging()
+
+
+def _publish_xc_stats(shared: SynchronizedArray):
+    """
+    Copy the XC client counters of the worker process to the API worker, read by /metrics and /xc/client/stats.
+    """
+    while True:
+        stats = xc_client.xc_stats()
+        stats['breaker'] = breaker_states.index(stats['breaker'])
+        with shared.get_lock():
+            shared[:] = [float(stats[field]) for field in xc_stat_fields]
+        threading.Event().wait(stats_interval)
+
+
+def _serve_child(may_run: Event, xc_stats: SynchronizedArray):
+    xc_client.share_budget(xc_share)
+    threading.Thread(target=_publish_xc_stats, args=(xc_stats,), name='xc-stats', daemon=True).start()
+    serve(may_run=may_run.is_set)
+
+
+def worker_xc_stats() -> dict | None:
+    """
+    :return: xc_stats() of the snapshot worker process started by this API worker, None without one
+    """
+    if _xc_stats is None:
+        return None
+    with _xc_stats.get_lock():
+        values = list(_xc_stats)
+    stats = {field: int(value) for field, value in zip(xc_stat_fields, values)}
+    stats.update(rate_limit=values[xc_stat_fields.index('rate_limit')],
+                 tokens=round(values[xc_stat_fields.index('tokens')], 2),
+                 breaker=breaker_states[stats['breaker']])
+    return stats
+
+
+def _process_exited(process: multiprocessing.Process):
+    """
+    Remove the metrics of a worker process that are only valid while it runs (live gauges).
+    """
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(process.pid)
+
+
+def supervise():
+    """
+    Run by the scheduler of the API worker: tell the worker process if it may run jobs, and restart it if it died.
+    """
+    process = _process
+    if process is None:
+        return
+    if leader.is_leader():
+        _may_run.set()
+    else:
+        _may_run.clear()
+    # Not restarted if stop() was called in the meantime
+    if not process.is_alive() and process is _process:
+        logger.error("Snapshot worker process %s exited with code %s, restarting it", process.pid, process.exitcode)
+        _process_exited(process)
+        _start_process()
+
+
+def _start_process():
+    global _process
+    # spawn: the worker doesn't inherit the threads, the database connections and the locks of the API worker
+    context = multiprocessing.get_context('spawn')
+    _process = context.Process(target=_serve_child, args=(_may_run, _xc_stats), name='snapshot-worker',
+                               daemon=True)
+    _process.start()
+
+
+def start():
+    """
+    Start the snapshot worker of this API worker, according to SNAPSHOT_WORKER.
+    """
+    global _may_run, _xc_stats
+    if worker_mode == 'thread':
+        snapshot_jobs.start_worker()
+    elif worker_mode == 'process':
+        if not os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+            logger.warning("PROMETHEUS_MULTIPROC_DIR isn't set, /metrics won't include the snapshot metrics "
+                           "recorded by the snapshot worker process")
+        context = multiprocessing.get_context('spawn')
+        _may_run = context.Event()
+        _xc_stats = context.Array('d', len(xc_stat_fields))
+        xc_client.share_budget(1 - xc_share)
+        _start_process()
+        supervise()
+    elif worker_mode != 'external':
+        raise ValueError(f"Unknown SNAPSHOT_WORKER {worker_mode}, expected process, external or thread")
+
+
+def stop():
+    """
+    Stop the snapshot worker of this API worker. A job still running after SNAPSHOT_WORKER_STOP_SECONDS is
+    interrupted, the next worker marks it as failed.
+    """
+    global _process
+    if worker_mode == 'thread':
+        snapshot_jobs.stop_worker()
+        return
+    process, _process = _process, None
+    if process is None:
+        return
+    _may_run.clear()
+    process.terminate()
+    process.join(timeout=stop_timeout)
+    if process.is_alive():
+        logger.warning("Snapshot worker process %s didn't stop in %ss, killing it", process.pid, stop_timeout)
+        process.kill()
+        process.join()
+    _process_exited(process)
+
+
+if __name__ == "__main__":
+    dependency.create_tables()
+    if metrics_port:
+        from prometheus_client import start_http_server
+        # Registers the XC client and queue collectors
+        import routes.metrics
+        start_http_server(metrics_port)
+    serve()
@@ -0,0 +1,28 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# The settings are read when the modules are imported, so they are set before any import of the tool
+_database = os.path.join(tempfile.mkdtemp(prefix='xc-revision-tests-'), 'tests.db')
+os.environ.setdefault('SQL_URL', f'sqlite:///{_database}')
+os.environ.setdefault('XC_URL', 'http://xc.invalid')
+os.environ.setdefault('XC_NAMESPACE', 'tests')
+os.environ.setdefault('XC_APITOKEN', 'tests')
+os.environ.setdefault('XC_TENANT', 'tests')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def database():
+    """
+    Every table of the tool, created empty for the test.
+    """
+    from sqlmodel import SQLModel
+
+    import dependency
+    SQLModel.metadata.create_all(dependency.engine)
+    yield dependency.engine
+    SQLModel.metadata.drop_all(dependency.engine)
@@ -0,0 +1,70 @@
+import threading
+
+from sqlmodel import Session, select
+
+import dependency
+from helper import lb_types
+from model.generic_model import DependencyIndexSchema, VersionHistorySchema
+from model.http_model import HttpLBVersionSchema, HttpLbStagingRevisionSchema
+from model.tcp_model import TcpLbVersionSchema
+
+
+def _seed(engine):
+    with Session(engine) as session:
+        session.add(HttpLBVersionSchema(uid='1', app_name='app', original_app_name='app-staging', timestamp=300,
+                                        environment='staging', current_version=2))
+        session.add(HttpLbStagingRevisionSchema(uid='2', app_name='app', original_app_name='app-staging',
+                                                generated_by='tests', version=2, previous_version=1, timestamp=200,
+                                                lb_resource_version=1, waf_resource_version=1,
+                                                origin_resource_version=1))
+        session.add(TcpLbVersionSchema(uid='3', tcp_lb_name='tcp', original_tcp_lb_name='tcp', timestamp=400,
+                                       environment='production', current_version=1))
+        session.commit()
+
+
+def test_backfill_version_history(database):
+    _seed(database)
+    dependency.backfill_version_history()
+    with Session(database) as session:
+        history = sorted((row.lb_type, row.environment, row.app_name, row.version, row.valid_from, row.valid_to)
+                         for row in session.exec(select(VersionHistorySchema)).all())
+    # Counted from the time of the revision, or of the version without a revision
+    assert history == [(lb_types.http, 'staging', 'app', 2, 200, None),
+                       (lb_types.tcp, 'production', 'tcp', 1, 400, None)]
+
+
+def test_backfill_version_history_once(database):
+    _seed(database)
+    threads = [threading.Thread(target=dependency.backfill_version_history) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    dependency.backfill_version_history()
+    with Session(database) as session:
+        assert len(session.exec(select(VersionHistorySchema)).all()) == 2
+
+
+def test_new_lb_stored_once(database):
+    revision = {'uid': 'rev-1', 'app_name': 'app-staging', 'original_app_name': 'app-staging', 'generated_by': 'tests',
+                'version': 1, 'previous_version': None, 'timestamp': 100, 'lb_resource_version': 1,
+                'waf_resource_version': 0, 'origin_resource_version': 0, 'lb_config': {}, 'waf_config': {},
+                'origin_config': {}, 'bot_config': {}}
+    assert dependency.push_http_lb_to_db('staging', new_data=[revision]) == ['app-staging']
+    # Seen as new by another snapshot too, e.g. a targeted one running during a full one
+    assert dependency.push_http_lb_to_db('staging', new_data=[{**revision, 'uid': 'rev-2'}]) == []
+    with Session(database) as session:
+        assert len(session.exec(select(HttpLBVersionSchema)).all()) == 1
+        assert len(session.exec(select(HttpLbStagingRevisionSchema)).all()) == 1
+        assert len(session.exec(select(VersionHistorySchema)).all()) == 1
+
+
+def test_prune_dependency_index(database):
+    with Session(database) as session:
+        for lb_name in ('app', 'deleted-app'):
+            session.add(DependencyIndexSchema(uid=lb_name, object_kind=lb_types.origin_pool, object_name='pool',
+                                              lb_type=lb_types.http, lb_name=lb_name, environment='production',
+                                              timestamp=100))
+        session.commit()
+    dependency.prune_dependency_index(lb_types.http, {'app', 'unindexed-app'})
+    assert dependency.find_dependent_lbs(lb_types.origin_pool, 'pool') == [(lb_types.http, 'production', 'app')]
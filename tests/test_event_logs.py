@@ -0,0 +1,46 @@
+import json
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import dependency
+from helper import lb_types
+from routes import event_logs
+
+
+def test_unindexed_change_schedules_a_full_snapshot(monkeypatch):
+    scheduled, queued = [], []
+    monkeypatch.setattr(event_logs, 'snapshot_scheduler', lambda: scheduled.append(True))
+    monkeypatch.setattr(dependency, 'find_dependent_lbs', lambda object_kind, object_name: [])
+    monkeypatch.setattr(dependency, 'enqueue_snapshot_targets', lambda targets, debounce: queued.extend(targets))
+    event_logs.incremental_snapshot_scheduler([(lb_types.origin_pool, 'pool'), (lb_types.http, 'app-staging')])
+    assert scheduled == [True]
+    assert queued == [(lb_types.http, 'staging', 'app-staging')]
+
+
+def test_indexed_change_queues_the_dependent_lbs(monkeypatch):
+    scheduled, queued = [], []
+    monkeypatch.setattr(event_logs, 'snapshot_scheduler', lambda: scheduled.append(True))
+    monkeypatch.setattr(dependency, 'find_dependent_lbs',
+                        lambda object_kind, object_name: [(lb_types.tcp, 'production', 'tcp')])
+    monkeypatch.setattr(dependency, 'enqueue_snapshot_targets', lambda targets, debounce: queued.extend(targets))
+    event_logs.incremental_snapshot_scheduler([(lb_types.app_firewall, 'waf')])
+    assert scheduled == []
+    assert queued == [(lb_types.tcp, 'production', 'tcp')]
+
+
+def test_deleted_lb_drops_its_dependency_index(monkeypatch):
+    refreshed, changes = [], []
+    monkeypatch.setattr(dependency, 'refresh_dependency_index',
+                        lambda lb_type, lb_names, references: refreshed.append((lb_type, lb_names, references)))
+    monkeypatch.setattr(event_logs, 'incremental_snapshot_scheduler', lambda each: changes.extend(each))
+    app = FastAPI()
+    app.include_router(event_logs.router)
+    audit = [{'rpc': 'ves.io.schema.views.http_loadbalancer.API.Delete', 'namespace': 'tests',
+              'req_path': '/api/config/namespaces/tests/http_loadbalancers/app'},
+             {'rpc': 'ves.io.schema.views.origin_pool.API.Replace', 'namespace': 'tests',
+              'req_path': '/api/config/namespaces/tests/origin_pools/pool'}]
+    response = TestClient(app).post('/xc/logs/audit', content='\n'.join(json.dumps(each) for each in audit))
+    assert response.status_code == 202
+    assert refreshed == [(lb_types.http, ['app'], [])]
+    assert changes == [(lb_types.origin_pool, 'pool')]
@@ -0,0 +1,84 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, select
+
+import dependency
+import replace_executor
+from model.generic_model import SchedulerModel, SnapshotQueueSchema
+from model.http_model import HttpLBVersionSchema, HttpLbProductionRevisionSchema, ReplaceHttpLbPolicySchema
+from routes import http_lb
+
+token = SimpleNamespace(username='tests')
+form = ReplaceHttpLbPolicySchema(app_name='app', environment='production', target_version=1)
+
+
+def _seed(engine):
+    with Session(engine) as session:
+        session.add(SchedulerModel(id=1, scheduled_time=0, is_started=True))
+        session.add(HttpLBVersionSchema(uid='1', app_name='app', original_app_name='app', timestamp=100,
+                                        environment='production', current_version=2))
+        for version in (1, 2):
+            session.add(HttpLbProductionRevisionSchema(
+                uid=str(version + 1), app_name='app', original_app_name='app', generated_by='tests', version=version,
+                timestamp=100, lb_resource_version=version, waf_resource_version=0, origin_resource_version=0,
+                lb_config={'replace_form': {'version': version}}))
+        session.commit()
+
+
+def _current_version(engine) -> int:
+    with Session(engine) as session:
+        return session.exec(select(HttpLBVersionSchema.current_version)).one()
+
+
+def _paused(engine) -> bool:
+    with Session(engine) as session:
+        return session.exec(select(SchedulerModel.is_started)).one()
+
+
+def test_replace_version(database, monkeypatch):
+    _seed(database)
+    monkeypatch.setattr(replace_executor, 'replace_lb', lambda *args: ({'resource_version': 5}, [], {}))
+    with Session(database) as session:
+        assert http_lb._replace_version(token, form, session) == {}
+    assert _current_version(database) == 1
+
+
+def test_replace_version_changed_during_the_replace(database, monkeypatch):
+    _seed(database)
+
+    def replace_lb(*args):
+        # Another version became current while XC was being replaced
+        with Session(database) as other:
+            version = other.exec(select(HttpLBVersionSchema)).one()
+            version.current_version = 3
+            other.add(version)
+            other.commit()
+        return {'resource_version': 5}, [], {}
+
+    monkeypatch.setattr(replace_executor, 'replace_lb', replace_lb)
+    with Session(database) as session, pytest.raises(HTTPException) as error:
+        http_lb.replace_version(token=token, form=form, session=session)
+    assert error.value.status_code == 409
+    assert _current_version(database) == 3
+    # XC runs version 1 now, a snapshot of the LB is queued to store it
+    with Session(database) as session:
+        queued = session.exec(select(SnapshotQueueSchema)).all()
+    assert [(each.lb_type, each.environment, each.lb_name) for each in queued] == [('http_lb', 'production', 'app')]
+    # The scheduled snapshot isn't left paused
+    assert not _paused(database)
+
+
+def test_failed_replace_resumes_the_scheduled_snapshot(database, monkeypatch):
+    _seed(database)
+
+    def replace_lb(*args):
+        raise HTTPException(status_code=502, detail='XC refused the LB')
+
+    monkeypatch.setattr(replace_executor, 'replace_lb', replace_lb)
+    monkeypatch.setattr(dependency, 'auto_snapshot_pause', lambda status: paused.append(status))
+    paused = []
+    with Session(database) as session, pytest.raises(HTTPException):
+        http_lb.replace_version(token=token, form=form, session=session)
+    assert paused == [True, False]
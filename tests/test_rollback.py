@@ -0,0 +1,30 @@
+import threading
+
+import dependency
+from helper import lb_types
+from model.rollback_model import RollbackRequest, RollbackTarget
+from model.user_model import UserSchema
+from routes import rollback
+
+
+def test_scheduled_snapshot_paused_for_the_whole_rollback(database, monkeypatch):
+    paused = []
+    monkeypatch.setattr(dependency, 'auto_snapshot_pause', lambda status: paused.append(status))
+    monkeypatch.setattr(dependency, 'log_stuff', lambda data: None)
+    started = threading.Barrier(3)
+
+    def replace(token, session, form):
+        # Every LB is being replaced at the same time
+        started.wait(timeout=5)
+        if form.app_name == 'failing':
+            raise RuntimeError('XC refused the LB')
+        return {}
+
+    handler = rollback.rollback_handlers[lb_types.http]
+    monkeypatch.setitem(rollback.rollback_handlers, lb_types.http, (replace, *handler[1:]))
+    targets = [RollbackTarget(lb_type=lb_types.http, app_name=name, environment='production', target_version=1)
+               for name in ('app', 'other', 'failing')]
+    result = rollback.fleet_rollback(token=UserSchema(username='tests'), form=RollbackRequest(targets=targets),
+                                     response=rollback.Response())
+    assert (result.replaced, result.failed) == (2, 1)
+    assert paused == [True, False]
@@ -0,0 +1,54 @@
+import threading
+
+import dependency
+import snapshot_jobs
+from helper import snapshot_job
+
+
+def test_targets_never_join_a_queued_full_job(database):
+    full_job = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.manual, username='tests')
+    targeted_job = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.webhook, username='tests',
+                                                     targets=[('http_lb', 'production', 'app')])
+    assert targeted_job.job_id != full_job.job_id
+    assert targeted_job.job_type == snapshot_job.targeted
+    assert targeted_job.targets == [['http_lb', 'production', 'app']]
+    # Full snapshots are still coalesced, and targets join the queued targeted job
+    assert snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.scheduler, username='tests').job_id == \
+           full_job.job_id
+    joined = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.webhook, username='tests',
+                                               targets=[('tcp_lb', 'staging', 'tcp-staging')])
+    assert joined.job_id == targeted_job.job_id
+    assert joined.targets == [['http_lb', 'production', 'app'], ['tcp_lb', 'staging', 'tcp-staging']]
+
+
+def test_targeted_job_runs_while_a_full_job_is_running(database, monkeypatch):
+    ran = []
+    monkeypatch.setattr(snapshot_jobs, 'run_job', lambda job: ran.append(job.job_id))
+    snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.manual, username='tests')
+    full_job = snapshot_jobs._claim_next_job(snapshot_job.full)
+    assert full_job.status == snapshot_job.running
+    targeted_job = snapshot_jobs.submit_snapshot_job(trigger=snapshot_job.webhook, username='tests',
+                                                     targets=[('http_lb', 'production', 'app')])
+    assert targeted_job.job_type == snapshot_job.targeted
+
+    sweep_started, sweep_done = threading.Event(), threading.Event()
+
+    def full_sweep():
+        # Holds the full lane, like a worker running a full snapshot
+        with dependency.advisory_lock(snapshot_jobs.worker_lanes[snapshot_job.full]):
+            sweep_started.set()
+            sweep_done.wait(timeout=10)
+
+    sweep = threading.Thread(target=full_sweep)
+    sweep.start()
+    try:
+        assert sweep_started.wait(timeout=10)
+        snapshot_jobs._run_queued_jobs(snapshot_job.full)
+        assert ran == []
+        snapshot_jobs._run_queued_jobs(snapshot_job.targeted)
+        assert ran == [targeted_job.job_id]
+        # The running full job wasn't failed as interrupted by the targeted lane
+        assert snapshot_jobs.get_job(full_job.job_id).status == snapshot_job.running
+    finally:
+        sweep_done.set()
+        sweep.join()
@@ -0,0 +1,26 @@
+import snapshot_pipeline
+from helper import environments, lb_types
+
+
+class RecordedCheckpoint:
+    def __init__(self):
+        self.saved = []
+
+    def save(self, lb_type, environment, lb_names):
+        self.saved.append((lb_type, environment, lb_names))
+
+
+def test_checkpoint_skips_lb_replaced_since_compared(monkeypatch):
+    # app-b was replaced after it was compared, push_http_lb_to_db doesn't store it
+    collection, get_lb_data, _, kind = snapshot_pipeline.snapshot_handlers[lb_types.http]
+    monkeypatch.setitem(snapshot_pipeline.snapshot_handlers, lb_types.http,
+                        (collection, get_lb_data, lambda environment, new_data, exist_data: ['app-a'], kind))
+    checkpoint = RecordedCheckpoint()
+    writer = snapshot_pipeline.SnapshotWriter(lb_types.http, checkpoint)
+    lb_list = {'items': [{'name': name} for name in ('app-a', 'app-b', 'app-c')]}
+    new_data = [{'app_name': 'app-a', 'original_app_name': 'app-a', 'version': 1}]
+    exist_data = [{'app_name': 'app-b', 'original_app_name': 'app-b', 'version': 3, 'previous_version': 2}]
+    writer.put(environments.production, lb_list, new_data, exist_data)
+    writer.close()
+    # app-c is unchanged
+    assert checkpoint.saved == [(lb_types.http, environments.production, ['app-a', 'app-c'])]
@@ -0,0 +1,97 @@
+import json
+
+import pytest
+import requests
+
+from helper import xc_client
+from helper.xc_client import AdaptiveLimiter, CircuitBreaker, XCRequestError, iter_json_items
+
+documents = [
+    '{"items":[1234,5678],"total": 12345}',
+    '{"total": 12345, "items": [{"name": "lb-1", "labels": {"env": "prod"}}, -1.5e3, true, null, "\\u00e9t\\u00e9"]}',
+    '{"errors": [], "items": [], "metadata": {"count": 0}}',
+    '{ "items" : [ "café" , 0.25 , [1, 2] , false ] , "next": null }',
+]
+
+
+@pytest.mark.parametrize('document', documents)
+def test_items_split_one_byte_per_chunk(document):
+    encoded = document.encode()
+    chunks = (encoded[index:index + 1] for index in range(len(encoded)))
+    assert list(iter_json_items(chunks)) == json.loads(document)['items']
+
+
+def test_number_cut_at_chunk_boundary():
+    encoded = b'{"items":[1234,5678]}'
+    assert list(iter_json_items([encoded[:12], encoded[12:]])) == [1234, 5678]
+
+
+def test_truncated_document():
+    with pytest.raises(ValueError):
+        list(iter_json_items([b'{"items":[1, 2']))
+
+
+def test_breaker_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(threshold=2, cooldown=60)
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open'
+    assert not breaker.allow()
+
+
+@pytest.mark.parametrize('trial_succeeds, state', [(True, 'closed'), (False, 'open')])
+def test_breaker_trial_request(trial_succeeds, state):
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.failure()
+    assert breaker.allow()
+    assert breaker.state == 'half-open'
+    # A single trial request at a time
+    assert not breaker.allow()
+    breaker.success() if trial_succeeds else breaker.failure()
+    assert breaker.state == state
+
+
+@pytest.mark.parametrize('error', [requests.exceptions.ChunkedEncodingError('cut'),
+                                   requests.exceptions.InvalidURL('invalid'), RuntimeError('bug')])
+def test_failed_trial_request_opens_the_breaker_again(monkeypatch, error):
+    breaker = CircuitBreaker(threshold=1, cooldown=0)
+    breaker.failure()
+    monkeypatch.setattr(xc_client, 'xc_breaker', breaker)
+    monkeypatch.setattr(xc_client, 'xc_max_retries', 0)
+
+    def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(xc_client.requests, 'request', fail)
+    with pytest.raises((XCRequestError, RuntimeError)):
+        xc_client.xc_request('GET', 'http://xc.invalid/api')
+    assert breaker.state == 'open'
+    # Not stuck half-open: the next request is the next trial
+    assert breaker.allow()
+
+
+def test_limiter_halves_when_throttled_and_grows_back():
+    limiter = AdaptiveLimiter(minimum=1, maximum=8)
+    limiter.throttled()
+    assert limiter.limit == 4
+    # Throttled together with the previous request
+    limiter.throttled()
+    assert limiter.limit == 4
+    for _ in range(4):
+        limiter.success()
+    assert limiter.limit == pytest.approx(5, abs=0.1)
+    for _ in range(100):
+        limiter.success()
+    assert limiter.limit == 8
+
+
+def test_limiter_minimum(monkeypatch):
+    limiter = AdaptiveLimiter(minimum=2, maximum=8)
+    clock = iter(range(0, 100, 2))
+    monkeypatch.setattr(xc_client.time, 'monotonic', lambda: next(clock))
+    for _ in range(5):
+        limiter.throttled()
+    assert limiter.limit == 2